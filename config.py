@@ -1,6 +1,5 @@
 # Properties
 from pathlib import Path
-from subprocess import run as runCmd
 
 # REQUIRED
 # database where TPC-BiH data is generated
@@ -15,14 +14,84 @@ host = "localhost"
 port = "5432" 
 # Path of tpch tables and tpch-dbgen folder
 tpchTblPath = str(Path.cwd() / "tpch-dbgen")
-# Path of psql
-psqlPath = "psql"
 # Destination of generated data and history
 destPath = str(Path.cwd())
 # Only generate V1data or generate V1data and history
 v1Only = True
 # Numbers of update operations
 updateTimes = 10000
+# Numbers of connections loading tpch tables concurrently
+loadParallelism = 4
+# Size in bytes of the chunks large tpch tables are split into for loading
+loadChunkSize = 268435456
+# Load with the bulk profile: tables are created UNLOGGED, commits do not 
+# wait for WAL flushes, tables are analyzed after loading and indexes are 
+# built with more memory and parallel workers sized from this machine
+bulkLoad = False
+# Switch the UNLOGGED tables of the bulk profile to LOGGED after loading, 
+# so they survive a crash of the database
+bulkLoadLogged = False
+# Load the tables and indexes read by history into shared buffers with 
+# pg_prewarm before generating history
+prewarmTables = False
+# Numbers of orderkey range partitions of orders and lineitem, 0 means 
+# they are not partitioned
+partitions = 0
+# Numbers of connections building the indexes read by history concurrently, 
+# one table at a time per connection from the largest table
+indexParallelism = 4
+# Keep the indexes read by history after generating history, so a later 
+# generation run on the same database reuses them
+keepHistoryIndexes = False
+# How V1data is derived from tpch tables, "update" adds columns and updates 
+# every row, "ctas" creates every table once with CREATE TABLE AS, 
+# "stream" writes V1data from tpch tables without database
+version1Mode = "update"
+# Numbers of processes generating V1data in "stream" mode, each of them 
+# processes a range of orderkeys
+version1Parallelism = 1
+# Generate comments with the random stream of earlier versions, which 
+# chooses grammer, phrases and words one by one
+compatibleComments = False
+# Derive random draws of every transaction from (seed, transaction index, 
+# purpose) instead of consuming generators in sequence
+counterBasedRandom = False
+# Draw the days of history transactions as a Poisson process in one pass 
+# instead of a Bernoulli trial per transaction and per day, which builds a 
+# different schedule of the same rate
+poissonSchedule = False
+# File caching the schedule of history transactions, which is reused by 
+# runs with the same options, empty string builds the schedule every run
+scheduleFile = ""
+# Numbers of history transactions between checkpoints which an interrupted 
+# run resumes from with `--resume`, 0 disables checkpoints. With 
+# checkpoints, the database is only committed at checkpoints.
+checkpointInterval = 0
+# Keep the state at the end of history in destPath, so the history can be 
+# extended by `--extend N` without generating it again
+keepHistoryState = False
+# Seconds between progress reports of history, 0 disables them
+progressInterval = 60
+# File where the progress of history is written in the text format of 
+# Prometheus at every progress report, empty string disables it. It needs 
+# progressInterval > 0.
+metricsFile = ""
+# Template database keeping V1data, the database is cloned from it instead 
+# of generating V1data again while tpch tables, dbgen, version1Mode and 
+# partitions are unchanged, empty string disables the template
+version1Template = ""
+# Connection strings of the shard databases, orders and lineitem are 
+# distributed over them by orderkey range and the other tables are 
+# replicated on every shard. V1data is derived by the stream mode and 
+# history statements go to the shards owning their rows. Empty list keeps 
+# all tables in the database above.
+shards = []
+# Simulate history in memory instead of executing every statement on 
+# the database
+inMemoryHistory = False
+# Numbers of history transactions committed together, 0 commits once per 
+# simulated day
+historyCommitInterval = 1
 
 # # OPTION
 
@@ -34,13 +103,86 @@ updateTimes = 10000
 
 # v1Only = False # whether do a V1data generation or do V1data and history generation
 
-# psqlPath = "/usr/bin/psql" # Path of psql
+# compatibleComments = True # generate the same comments as earlier versions
+
+# counterBasedRandom = True # seed random draws by transaction index
+
+# poissonSchedule = True # draw the days of transactions as a Poisson process
+
+# scheduleFile = "schedule.txt" # cache the schedule of transactions
+
+# checkpointInterval = 100000 # write a checkpoint every 100000 transactions
+
+# keepHistoryState = True # keep the state to extend the history later
+
+# progressInterval = 10 # report progress every 10 seconds
+# metricsFile = "/var/lib/node_exporter/textfile/dbgen.prom" # export progress to Prometheus
+
+# version1Template = "tpchtemplate" # keep V1data in template database tpchtemplate
+
+# shards = ["host=node1 port=5432 dbname=tpcbih user=postgres password=''", 
+#           "host=node2 port=5432 dbname=tpcbih user=postgres password=''"] # shard orders and lineitem over 2 databases
+
+# inMemoryHistory = True # whether load V1data once and generate history in memory
+
+# historyCommitInterval = 100 # commit history every 100 transactions
+
+# loadParallelism = 16 # load tpch tables on 16 connections
+# loadChunkSize = 67108864 # split tpch tables into 64MB chunks
+
+# bulkLoad = True # load with unlogged tables and tuned session settings
+# bulkLoadLogged = True # keep tables logged after a bulk load
+# prewarmTables = True # prewarm tables before history
+# partitions = 8 # range partition orders and lineitem into 8 partitions
+# indexParallelism = 2 # build history indexes on 2 connections
+# keepHistoryIndexes = True # keep history indexes for later runs
+
+# version1Mode = "ctas" # derive V1data with CREATE UNLOGGED TABLE AS
+# version1Mode = "stream" # derive V1data by streaming tpch tables
+# version1Parallelism = 32 # stream 32 orderkey ranges concurrently
 
 def config():
     assert type(v1Only) == bool
+    assert type(inMemoryHistory) == bool
+    assert type(compatibleComments) == bool
+    assert type(counterBasedRandom) == bool
+    assert type(poissonSchedule) == bool
+    assert type(scheduleFile) == str
+    assert type(checkpointInterval) == int
+    assert checkpointInterval >= 0
+    assert type(keepHistoryState) == bool
+    assert type(version1Template) == str
+    assert version1Template != dbname
+    assert type(shards) == list
+    for shard in shards:
+        assert type(shard) == str
+    if len(shards) > 0:
+        assert version1Mode == "stream"
+        assert not inMemoryHistory
+        assert version1Template == ""
+    assert type(progressInterval) in (int, float)
+    assert progressInterval >= 0
+    assert type(metricsFile) == str
+    if metricsFile != "":
+        assert progressInterval > 0
     assert updateTimes > 0
-    assert len(psqlPath) > 0
-    assert runCmd([psqlPath, "-V"]).returncode == 0
+    assert type(loadParallelism) == int
+    assert loadParallelism > 0
+    assert type(loadChunkSize) == int
+    assert loadChunkSize > 0
+    assert type(bulkLoad) == bool
+    assert type(bulkLoadLogged) == bool
+    assert type(prewarmTables) == bool
+    assert type(partitions) == int
+    assert partitions >= 0
+    assert type(indexParallelism) == int
+    assert indexParallelism > 0
+    assert type(keepHistoryIndexes) == bool
+    assert version1Mode in ("update", "ctas", "stream")
+    assert type(version1Parallelism) == int
+    assert version1Parallelism > 0
+    assert type(historyCommitInterval) == int
+    assert historyCommitInterval >= 0
     # Ensure all tpch tables have been generated
     tableNames = ("nation", "region", "part", "supplier", 
                   "partsupp", "customer", "orders", "lineitem")
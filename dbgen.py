@@ -1,35 +1,321 @@
 #!/usr/bin/python3
 
 import psycopg2
+from psycopg2.pool import ThreadedConnectionPool
+from psycopg2.extensions import make_dsn
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date, timedelta, datetime
+from decimal import Decimal, ROUND_HALF_UP
+from calendar import monthrange
+from math import floor
+from hashlib import md5
+from shutil import copyfileobj
+from array import array
+from heapq import heappush, heappop
+from itertools import repeat, accumulate
+from bisect import bisect
 from random import Random
-from csv import reader as csvReader
+from csv import reader as csvReader, writer as csvWriter
 from pathlib import Path
-from subprocess import run as runCmd
-from time import perf_counter
+from argparse import ArgumentParser
+from time import perf_counter, perf_counter_ns
+from contextlib import contextmanager
+from abc import ABC, abstractmethod
 import logging
+import os
+import pickle
+import json
+import re
+try:
+    import resource
+except ImportError:
+    resource = None
 
 import config
 
-# Logger for debuging and profiling SQL execution
-SQL_DEBUG = False
+# Logger of dbgen. Its handler is attached by `setupLogging` when dbgen 
+# runs as a program, importing dbgen neither prints nor writes files.
 LOG = logging.getLogger("dbgen")
-LOG.setLevel(logging.DEBUG)
-console_handler = logging.StreamHandler()
-console_handler.setLevel(logging.INFO)
-file_handler = logging.FileHandler('dbgen-sql.prof')
-file_handler.setLevel(logging.DEBUG)
-LOG.addHandler(console_handler)
-LOG.addHandler(file_handler)
-# Postgresql cursor's execute function with debuging and profiling
-def _executeWrapper(cur: psycopg2.extensions.cursor, sql: str):
-    if SQL_DEBUG:
-        LOG.debug(sql)
-        st = perf_counter()
+
+def setupLogging(level: int = logging.INFO):
+    LOG.setLevel(level)
+    consoleHandler = logging.StreamHandler()
+    consoleHandler.setLevel(level)
+    LOG.addHandler(consoleHandler)
+
+# Latency histogram of nanosecond values in log-linear buckets like HDR 
+# histograms. A value is kept with its 5 most significant bits, so 
+# quantiles are within 1/16 of the recorded values.
+HISTOGRAM_SUB_BITS = 5
+class LatencyHistogram:
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.max = 0
+        self.buckets = {}
+
+    def record(self, value: int):
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+        shift = max(0, value.bit_length() - HISTOGRAM_SUB_BITS)
+        bucket = (shift << HISTOGRAM_SUB_BITS) | (value >> shift)
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+
+    # Upper bound of the bucket holding the value of quantile `q`
+    def quantile(self, q: float) -> int:
+        rank = q * self.count
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                shift = bucket >> HISTOGRAM_SUB_BITS
+                mantissa = bucket & ((1 << HISTOGRAM_SUB_BITS) - 1)
+                return min(self.max, ((mantissa + 1) << shift) - 1)
+        return self.max
+
+# Latency of SQL statements grouped by template, which is the scenario of 
+# the running transaction and the statement's verb and table, for example 
+# "cancel order: delete lineitem". Whole transactions are recorded as 
+# "<scenario>: transaction", so the profile also covers in-memory history.
+SQL_PROFILE = False
+SQL_PROFILE_TOP = 10
+STATEMENT_PATTERN = re.compile(
+    r"\s*(select\b.*?\bfrom|update|insert\s+into|delete\s+from|\w+\s+(?:or\s+replace\s+)?\w+)\s+(\w+)", 
+    re.IGNORECASE | re.DOTALL
+)
+def _statementLabel(sql: str) -> str:
+    match = STATEMENT_PATTERN.match(sql)
+    if match is None:
+        return sql.split(None, 1)[0].lower()
+    verb = match.group(1).split(None, 1)[0].lower()
+    if verb in ("select", "update", "insert", "delete"):
+        return "{} {}".format(verb, match.group(2).lower())
+    return match.group(1).lower()
+
+class SqlProfiler:
+
+    def __init__(self):
+        self.scenario = ""
+        self.histograms = {}
+
+    def template(self, label: str) -> str:
+        if self.scenario == "":
+            return label
+        return self.scenario + ": " + label
+
+    def record(self, template: str, value: int):
+        histogram = self.histograms.get(template)
+        if histogram is None:
+            histogram = self.histograms[template] = LatencyHistogram()
+        histogram.record(value)
+
+    # Rows of the profile in seconds, slowest template by total first
+    def summary(self) -> list:
+        rows = []
+        for template, histogram in self.histograms.items():
+            rows.append({
+                "template": template, 
+                "count": histogram.count, 
+                "total": histogram.total / 1e9, 
+                "p50": histogram.quantile(0.5) / 1e9, 
+                "p95": histogram.quantile(0.95) / 1e9, 
+                "p99": histogram.quantile(0.99) / 1e9, 
+                "max": histogram.max / 1e9
+            })
+        rows.sort(key=lambda row: row["total"], reverse=True)
+        return rows
+
+    # Write the profile as sql-profile.json and sql-profile.csv into 
+    # `destDir` and log the slowest templates
+    def dump(self, destDir: Path):
+        rows = self.summary()
+        with open(destDir / "sql-profile.json", "w") as jsonFile:
+            json.dump(rows, jsonFile, indent=4)
+        with open(destDir / "sql-profile.csv", "w", newline="") as csvFile:
+            writer = csvWriter(csvFile)
+            writer.writerow(("template", "count", "total", "p50", "p95", "p99", "max"))
+            for row in rows:
+                writer.writerow((row["template"], row["count"], 
+                                 "{:.6f}".format(row["total"]), 
+                                 "{:.6f}".format(row["p50"]), 
+                                 "{:.6f}".format(row["p95"]), 
+                                 "{:.6f}".format(row["p99"]), 
+                                 "{:.6f}".format(row["max"])))
+        LOG.info("Slowest statement templates:")
+        for row in rows[:SQL_PROFILE_TOP]:
+            LOG.info("{}: {} calls, {:.3f}s total, p50 {:.6f}s, p95 {:.6f}s, "
+                     "p99 {:.6f}s, max {:.6f}s".format(
+                row["template"], row["count"], row["total"], 
+                row["p50"], row["p95"], row["p99"], row["max"]
+            ))
+
+PROFILER = SqlProfiler()
+
+# Wall time, CPU time of the process and its children, bytes of files read 
+# and written by the process and peak RSS at this moment
+def _resourceUsage() -> tuple:
+    times = os.times()
+    cpu = times.user + times.system + times.children_user + times.children_system
+    bytesRead = bytesWritten = 0
+    try:
+        with open("/proc/self/io") as ioFile:
+            for line in ioFile:
+                key, value = line.split(":")
+                if key == "rchar":
+                    bytesRead = int(value)
+                elif key == "wchar":
+                    bytesWritten = int(value)
+    except OSError:
+        pass
+    peakRss = 0
+    if resource is not None:
+        # kilobytes on Linux
+        peakRss = 1024 * max(
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, 
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+        )
+    return perf_counter(), cpu, bytesRead, bytesWritten, peakRss
+
+# Resource usage of the named phases of a run. Phases nest, a phase is 
+# named by the path of its ancestors, e.g. "version1/derive/update orders". 
+# In a phase traced with `statements`, every statement run by 
+# `_executeWrapper` is a phase counting the rows it affects.
+REPORT_COLUMNS = ("phase", "wall", "cpu", "rows", "bytesRead", 
+                  "bytesWritten", "peakRss")
+class PhaseTracer:
+
+    def __init__(self):
+        self.phases = []
+        self.stack = []
+        self.statements = False
+
+    @contextmanager
+    def phase(self, name: str, statements: bool = False):
+        if len(self.stack) > 0:
+            name = self.stack[-1]["phase"] + "/" + name
+        record = {"phase": name, "rows": 0}
+        self.phases.append(record)
+        self.stack.append(record)
+        outerStatements = self.statements
+        self.statements = statements
+        start = _resourceUsage()
+        try:
+            yield record
+        finally:
+            end = _resourceUsage()
+            self.stack.pop()
+            self.statements = outerStatements
+            record["wall"] = end[0] - start[0]
+            record["cpu"] = end[1] - start[1]
+            record["bytesRead"] = end[2] - start[2]
+            record["bytesWritten"] = end[3] - start[3]
+            record["peakRss"] = end[4]
+
+    # Write the phases as run-report.json and run-report.txt into `destDir`
+    def dump(self, destDir: Path):
+        rows = [{column: record[column] for column in REPORT_COLUMNS} 
+                for record in self.phases if "wall" in record]
+        with open(destDir / "run-report.json", "w") as jsonFile:
+            json.dump(rows, jsonFile, indent=4)
+        lines = [("phase", "wall(s)", "cpu(s)", "rows", "read(MB)", 
+                  "written(MB)", "peak RSS(MB)")]
+        for row in rows:
+            lines.append((
+                row["phase"], 
+                "{:.2f}".format(row["wall"]), 
+                "{:.2f}".format(row["cpu"]), 
+                str(row["rows"]), 
+                "{:.1f}".format(row["bytesRead"] / 1048576), 
+                "{:.1f}".format(row["bytesWritten"] / 1048576), 
+                "{:.1f}".format(row["peakRss"] / 1048576)
+            ))
+        widths = [max(len(line[i]) for line in lines) for i in range(len(lines[0]))]
+        with open(destDir / "run-report.txt", "w") as txtFile:
+            for line in lines:
+                txtFile.write("  ".join(
+                    [line[0].ljust(widths[0])] 
+                    + [cell.rjust(width) for cell, width in zip(line[1:], widths[1:])]
+                ).rstrip() + "\n")
+
+TRACER = PhaseTracer()
+
+# Queries slower than `SQL_EXPLAIN_THRESHOLD` seconds are run again with 
+# EXPLAIN (ANALYZE, BUFFERS) in a savepoint which is rolled back, so the 
+# plan is measured on the same data without changing it. Writes are only 
+# explained without ANALYZE, as the dead tuples of a rolled back write 
+# would move the rows written later and change V1data. Plans of at most 
+# `SQL_EXPLAIN_LIMIT` statements per template are appended to 
+# sql-explain.txt in destPath. 0 disables explaining.
+SQL_EXPLAIN_THRESHOLD = 0
+SQL_EXPLAIN_LIMIT = 3
+EXPLAINABLE_VERBS = ("select", "update", "insert", "delete", "with")
+ANALYZABLE_VERBS = ("select", "with")
+# Running these again would advance PostgreSQL's random sequence, which a 
+# rolled back savepoint does not restore
+VOLATILE_CALLS = ("random(", "setseed(")
+EXPLAIN_COUNTS = {}
+def _explainStatement(cur: psycopg2.extensions.cursor, sql: str, 
+                      template: str, seconds: float):
+    conn = cur.connection
+    # batches of statements and statements outside transactions are not 
+    # explained
+    if (EXPLAIN_COUNTS.get(template, 0) >= SQL_EXPLAIN_LIMIT 
+        or conn.autocommit 
+        or sql.strip().rstrip(";").count(";") > 0 
+        or sql.split(None, 1)[0].lower() not in EXPLAINABLE_VERBS 
+        or any(call in sql for call in VOLATILE_CALLS)):
+        return
+    EXPLAIN_COUNTS[template] = EXPLAIN_COUNTS.get(template, 0) + 1
+    explainSql = "explain " + sql
+    if sql.split(None, 1)[0].lower() in ANALYZABLE_VERBS:
+        explainSql = "explain (analyze, buffers) " + sql
+    # another cursor keeps the results of `cur` for the caller
+    with conn.cursor() as explainCur:
+        explainCur.execute("savepoint dbgen_explain")
+        try:
+            explainCur.execute(explainSql)
+            plan = [row[0] for row in explainCur.fetchall()]
+        except psycopg2.Error as e:
+            plan = ["EXPLAIN failed: {}".format(e).rstrip()]
+        explainCur.execute("rollback to savepoint dbgen_explain")
+        explainCur.execute("release savepoint dbgen_explain")
+    with open(Path(config.destPath) / "sql-explain.txt", "a") as explainFile:
+        explainFile.write("-- {} ({:.6f}s)\n{}\n{}\n\n".format(
+            template, seconds, sql.strip(), "\n".join(plan)
+        ))
+    if any("Seq Scan" in line for line in plan):
+        LOG.warning("{} took {:.6f}s with a sequential scan".format(
+            template, seconds
+        ))
+
+def _executeProfiled(cur: psycopg2.extensions.cursor, sql: str, 
+                     template: str):
+    if not SQL_PROFILE and SQL_EXPLAIN_THRESHOLD <= 0:
+        cur.execute(sql)
+        return
+    st = perf_counter_ns()
     cur.execute(sql)
-    if SQL_DEBUG:
-        et = perf_counter()
-        LOG.debug("\nTime cost:{:.6f}s\n".format(et - st))
+    elapsed = perf_counter_ns() - st
+    if template is None:
+        template = PROFILER.template(_statementLabel(sql))
+    if SQL_PROFILE:
+        PROFILER.record(template, elapsed)
+    if elapsed > SQL_EXPLAIN_THRESHOLD * 1e9 > 0:
+        _explainStatement(cur, sql, template, elapsed / 1e9)
+
+# Postgresql cursor's execute function with profiling and tracing, 
+# `template` overrides the template derived from `sql`
+def _executeWrapper(cur: psycopg2.extensions.cursor, sql: str, 
+                    template: str = None):
+    if not TRACER.statements:
+        _executeProfiled(cur, sql, template)
+        return
+    with TRACER.phase(_statementLabel(sql)) as phase:
+        _executeProfiled(cur, sql, template)
+        phase["rows"] = max(cur.rowcount, 0)
 
 
 
@@ -49,6 +335,21 @@ UPDATE_P_RAND = Random(0.7579544029403025)
 UPDATE_SCENARIO_P_RAND = Random(0.420571580830845)
 UNIFORM_RAND = Random(0.25891675029296335)
 TABLE_SAMPLE_SEED_RAND = Random(0.5112747213686085)
+# With `config.counterBasedRandom`, generators are reseeded from a hash of 
+# (seed, counter, purpose) before every transaction and every simulated 
+# day, so the draws of a transaction do not depend on the transactions 
+# before it
+HISTORY_SEED = 0.7579544029403025
+
+def seedScenario(index: int):
+    UPDATE_SCENARIO_P_RAND.seed("{}|{}|scenario".format(HISTORY_SEED, index))
+
+def seedTransaction(index: int):
+    UNIFORM_RAND.seed("{}|{}|uniform".format(HISTORY_SEED, index))
+    TABLE_SAMPLE_SEED_RAND.seed("{}|{}|sample".format(HISTORY_SEED, index))
+
+def seedDay(day: date):
+    UPDATE_P_RAND.seed("{}|{}|schedule".format(HISTORY_SEED, day.isoformat()))
 
 
 
@@ -102,92 +403,134 @@ VP = (
 )
 VP_WEIGHT = (30, 1, 40, 1)
 
-with open("nouns.csv") as nounsFile:
-    reader = csvReader(nounsFile, delimiter="|")
-    N, N_WEIGHT = (tuple(t) for t in zip(*(reader)))
-    N_WEIGHT = tuple(map(int, N_WEIGHT))
-
-with open("verbs.csv") as verbsFile:
-    reader = csvReader(verbsFile, delimiter="|")
-    V, V_WEIGHT = (tuple(t) for t in zip(*(reader)))
-    V_WEIGHT = tuple(map(int, V_WEIGHT))
-
-with open("adverbs.csv") as adverbsFile:
-    reader = csvReader(adverbsFile, delimiter="|")
-    D, D_WEIGHT = (tuple(t) for t in zip(*(reader)))
-    D_WEIGHT = tuple(map(int, D_WEIGHT))
-
-with open("prepositions.csv") as prepositionsFile:
-    reader = csvReader(prepositionsFile, delimiter="|")
-    P, P_WEIGHT = (tuple(t) for t in zip(*(reader)))
-    P_WEIGHT = tuple(map(int, P_WEIGHT))
-
-with open("auxillaries.csv") as auxillariesFile:
-    reader = csvReader(auxillariesFile, delimiter="|")
-    X, X_WEIGHT = (tuple(t) for t in zip(*(reader)))
-    X_WEIGHT = tuple(map(int, X_WEIGHT))
-
 T = (".", ";", ":", "?", "!", "--")
 T_WEIGHT = (50, 1, 1, 1, 1, 1)
 
-with open("adjectives.csv") as adjectivesFile:
-    reader = csvReader(adjectivesFile, delimiter="|")
-    J, J_WEIGHT = (tuple(t) for t in zip(*(reader)))
-    J_WEIGHT = tuple(map(int, J_WEIGHT))
+# Words of symbols with their weights are read from the CSV files next to 
+# dbgen.py when the first comment is generated
+WORDS_PATH = Path(__file__).resolve().parent
+WORD_FILES = {
+    "N": "nouns.csv",
+    "V": "verbs.csv",
+    "D": "adverbs.csv",
+    "P": "prepositions.csv",
+    "X": "auxillaries.csv",
+    "J": "adjectives.csv"
+}
+def _readWords(fileName: str) -> tuple:
+    with open(WORDS_PATH / fileName, newline="") as wordsFile:
+        words, weights = zip(*csvReader(wordsFile, delimiter="|"))
+    return tuple(words), tuple(map(int, weights))
+
+# Word tables compiled once for sampling, a table is the population, its 
+# cumulative weights and the total weight. Picking `population[bisect(
+# cumWeights, random() * total)]` consumes the generator exactly as 
+# `Random.choices` does.
+def _compileChoices(population: tuple, weights: tuple) -> tuple:
+    cumWeights = list(accumulate(weights))
+    return population, cumWeights, cumWeights[-1] + 0.0
+
+def _choose(rand: Random, table: tuple):
+    population, cumWeights, total = table
+    return population[
+        bisect(cumWeights, rand.random() * total, 0, len(cumWeights) - 1)
+    ]
+
+GRAMMER_TABLE = _compileChoices(GRAMMER, GRAMMER_WEIGHT)
+NP_TABLE = _compileChoices(NP, NP_WEIGHT)
+VP_TABLE = _compileChoices(VP, VP_WEIGHT)
+
+# Every expansion of a grammer with its NP and VP expanded, compiled into 
+# literals and word tables. Its weight is the probability of picking the 
+# grammer and its expansions, scaled to an integer.
+def _compileTemplates(wordTables: dict) -> tuple:
+    maxNPNum = max(grammer.count("NP") for grammer in GRAMMER)
+    maxVPNum = max(grammer.count("VP") for grammer in GRAMMER)
+    templates = []
+    weights = []
+    for grammer, grammerWeight in zip(GRAMMER, GRAMMER_WEIGHT):
+        expansions = [((), grammerWeight)]
+        for elem in grammer:
+            if elem == "NP":
+                phrases = tuple(zip(NP, NP_WEIGHT))
+            elif elem == "VP":
+                phrases = tuple(zip(VP, VP_WEIGHT))
+            else:
+                phrases = (((elem,), 1),)
+            expansions = [
+                (symbols + tuple(phrase), weight * phraseWeight)
+                for symbols, weight in expansions
+                for phrase, phraseWeight in phrases
+            ]
+        # Same denominator for grammers with different numbers of phrases
+        scale = sum(NP_WEIGHT) ** (maxNPNum - grammer.count("NP")) \
+            * sum(VP_WEIGHT) ** (maxVPNum - grammer.count("VP"))
+        for symbols, weight in expansions:
+            templates.append(tuple(
+                wordTables.get(symbol, symbol) for symbol in symbols
+            ))
+            weights.append(weight * scale)
+    return _compileChoices(tuple(templates), tuple(weights))
+
+# Word tables and the template table, compiled by `_commentTables` once
+COMMENT_TABLES = None
+def _commentTables() -> tuple:
+    global COMMENT_TABLES
+    if COMMENT_TABLES is None:
+        wordTables = {
+            symbol: _compileChoices(*_readWords(fileName)) 
+            for symbol, fileName in WORD_FILES.items()
+        }
+        wordTables["T"] = _compileChoices(T, T_WEIGHT)
+        COMMENT_TABLES = (wordTables, _compileTemplates(wordTables))
+    return COMMENT_TABLES
+
+# `dbgen.WORD_TABLES` and `dbgen.TEMPLATE_TABLE` compile the tables on 
+# first access
+def __getattr__(name: str):
+    if name == "WORD_TABLES":
+        return _commentTables()[0]
+    if name == "TEMPLATE_TABLE":
+        return _commentTables()[1]
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
 
 def generateComment(maxLen: int) -> str:
-    commentGrammer = UNIFORM_RAND.choices(
-        GRAMMER, weights=GRAMMER_WEIGHT
-    ).pop()
+    if config.compatibleComments:
+        return _generateCompatibleComment(maxLen)
+    template = _choose(UNIFORM_RAND, (COMMENT_TABLES or _commentTables())[1])
+    comment = "".join([
+        symbol if type(symbol) == str else _choose(UNIFORM_RAND, symbol)
+        for symbol in template
+    ])
+    return comment[:maxLen]
+
+# Comment drawn as by choosing a grammer, expanding its NP and VP and then 
+# every word, which is the random stream of earlier versions
+def _generateCompatibleComment(maxLen: int) -> str:
+    wordTables = (COMMENT_TABLES or _commentTables())[0]
+    commentGrammer = _choose(UNIFORM_RAND, GRAMMER_TABLE)
 
     commentGrammerOnlyWords = []
     for elem in commentGrammer:
         if elem == "NP":
-            commentGrammerOnlyWords.extend(
-                UNIFORM_RAND.choices(NP, weights=NP_WEIGHT).pop()
-            )
+            commentGrammerOnlyWords.extend(_choose(UNIFORM_RAND, NP_TABLE))
         elif elem == "VP":
-            commentGrammerOnlyWords.extend(
-                UNIFORM_RAND.choices(VP, weights=VP_WEIGHT).pop()
-            )
+            commentGrammerOnlyWords.extend(_choose(UNIFORM_RAND, VP_TABLE))
         else:
             commentGrammerOnlyWords.append(elem)
 
     wordsOfComment = []
     for elem in commentGrammerOnlyWords:
-        if elem == "N":
-            wordsOfComment.extend(
-                UNIFORM_RAND.choices(N, weights=N_WEIGHT)
-            )
-        elif elem == "V":
-            wordsOfComment.extend(
-                UNIFORM_RAND.choices(V, weights=V_WEIGHT)
-            )
-        elif elem == "D":
-            wordsOfComment.extend(
-                UNIFORM_RAND.choices(D, weights=D_WEIGHT)
-            )
-        elif elem == "P":
-            wordsOfComment.extend(
-                UNIFORM_RAND.choices(P, weights=P_WEIGHT)
-            )
-        elif elem == "X":
-            wordsOfComment.extend(
-                UNIFORM_RAND.choices(X, weights=X_WEIGHT)
-            )
-        elif elem == "T":
-            wordsOfComment.extend(
-                UNIFORM_RAND.choices(T, weights=T_WEIGHT)
-            )
-        elif elem == "J":
-            wordsOfComment.extend(
-                UNIFORM_RAND.choices(J, weights=J_WEIGHT)
-            )
+        if elem in wordTables:
+            wordsOfComment.append(_choose(UNIFORM_RAND, wordTables[elem]))
         else:
             wordsOfComment.append(elem)
     comment = "".join(wordsOfComment)
     return comment[:maxLen]
 
+def generateComments(count: int, maxLen: int) -> list:
+    return [generateComment(maxLen) for i in range(count)]
+
 
 
 
@@ -200,133 +543,222 @@ SHIPPING_MODE = ("REG AIR", "AIR", "RAIL", "TRUCK", "MAIL", "FOB", "SHIP")
 ORDER_PRIORITY = ("1-URGENT","2-HIGH","3-MEDIUM", 
                   "4-NOT SPECIFIED","5-LOW")
 
+# Keys of tables, rows of bi-<table>.tbl are ordered by them
+TABLE_KEYS = {
+    "nation": ("n_nationkey",),
+    "region": ("r_regionkey",),
+    "part": ("p_partkey",),
+    "supplier": ("s_suppkey",),
+    "partsupp": ("ps_partkey", "ps_suppkey"),
+    "customer": ("c_custkey",),
+    "orders": ("o_orderkey",),
+    "lineitem": ("l_orderkey", "l_linenumber")
+}
+
+
+
+
+
+# Utility for loading tpch tables. Every .tbl file is split into chunks 
+# of about `config.loadChunkSize` bytes ending at line boundaries, chunks 
+# are copied concurrently on `config.loadParallelism` connections.
+COPY_BUFFER_SIZE = 1048576
+class _FileRange:
+
+    def __init__(self, path: Path, begin: int, end: int):
+        self.file = open(path, "rb")
+        self.file.seek(begin)
+        self.remaining = end - begin
+
+    def read(self, size: int = -1) -> bytes:
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+# Split the bytes from `begin` to `end` of a .tbl file, the whole file by 
+# default, into chunks ending at line boundaries
+def splitTblFile(path: Path, chunkSize: int, begin: int = 0, 
+                 end: int = None) -> list:
+    if end is None:
+        end = path.stat().st_size
+    bounds = [begin]
+    with open(path, "rb") as tblFile:
+        while bounds[-1] + chunkSize < end:
+            tblFile.seek(bounds[-1] + chunkSize)
+            tblFile.readline()
+            if tblFile.tell() >= end:
+                break
+            bounds.append(tblFile.tell())
+    bounds.append(end)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+def _logCopyRate(action: str, tblName: str, rows: int, size: int, 
+                 seconds: float):
+    seconds = max(seconds, 1e-6)
+    LOG.info("{} {}: {} rows, {:.1f}MB in {:.2f}s ({:.0f} rows/s, {:.1f}MB/s)".format(
+        action, tblName, rows, size / 1048576, seconds, 
+        rows / seconds, size / 1048576 / seconds
+    ))
 
-
-
-
-def initializeVersion1(connStr: str):
-
-    conn = psycopg2.connect(connStr)
-    cur = conn.cursor()
-
-    # create tables
-    tableNames = ("nation", "region", "part", "supplier", 
-                  "partsupp", "customer", "orders", "lineitem")
-    dropAllTblSql = "drop table if exists {}".format(",".join(tableNames))
-    _executeWrapper(cur, dropAllTblSql)
-    createNationSql = '''
-        CREATE TABLE NATION (
-            N_NATIONKEY INTEGER NOT NULL,
-            N_NAME CHAR(25) NOT NULL,
-            N_REGIONKEY INTEGER NOT NULL,
-            N_COMMENT VARCHAR(152)
-        );
-    '''
-    createRegionSql = '''
-        CREATE TABLE REGION (
-            R_REGIONKEY INTEGER NOT NULL,
-            R_NAME CHAR(25) NOT NULL,
-            R_COMMENT VARCHAR(152)
-        );
-    '''
-    createPartSql = '''
-        CREATE TABLE PART (
-            P_PARTKEY INTEGER NOT NULL,
-            P_NAME VARCHAR(55) NOT NULL,
-            P_MFGR CHAR(25) NOT NULL,
-            P_BRAND CHAR(10) NOT NULL,
-            P_TYPE VARCHAR(25) NOT NULL,
-            P_SIZE INTEGER NOT NULL,
-            P_CONTAINER CHAR(10) NOT NULL,
-            P_RETAILPRICE DECIMAL(15, 2) NOT NULL,
-            P_COMMENT VARCHAR(23) NOT NULL
-        );
-    '''
-    createSupplierSql = '''
-        CREATE TABLE SUPPLIER (
-            S_SUPPKEY INTEGER NOT NULL,
-            S_NAME CHAR(25) NOT NULL,
-            S_ADDRESS VARCHAR(40) NOT NULL,
-            S_NATIONKEY INTEGER NOT NULL,
-            S_PHONE CHAR(15) NOT NULL,
-            S_ACCTBAL DECIMAL(15, 2) NOT NULL,
-            S_COMMENT VARCHAR(101) NOT NULL
-        );
-    '''
-    createPartsuppSql = '''
-        CREATE TABLE PARTSUPP (
-            PS_PARTKEY INTEGER NOT NULL,
-            PS_SUPPKEY INTEGER NOT NULL,
-            PS_AVAILQTY INTEGER NOT NULL,
-            PS_SUPPLYCOST DECIMAL(15, 2) NOT NULL,
-            PS_COMMENT VARCHAR(199) NOT NULL
-        );
-    '''
-    createCustomerSql = '''
-        CREATE TABLE CUSTOMER (
-            C_CUSTKEY INTEGER NOT NULL,
-            C_NAME VARCHAR(25) NOT NULL,
-            C_ADDRESS VARCHAR(40) NOT NULL,
-            C_NATIONKEY INTEGER NOT NULL,
-            C_PHONE CHAR(15) NOT NULL,
-            C_ACCTBAL DECIMAL(15, 2) NOT NULL,
-            C_MKTSEGMENT CHAR(10) NOT NULL,
-            C_COMMENT VARCHAR(117) NOT NULL
-        );
-    '''
-    createOrderSql = '''
-        CREATE TABLE ORDERS (
-            O_ORDERKEY INTEGER NOT NULL,
-            O_CUSTKEY INTEGER NOT NULL,
-            O_ORDERSTATUS CHAR(1) NOT NULL,
-            O_TOTALPRICE DECIMAL(15, 2) NOT NULL,
-            O_ORDERDATE DATE NOT NULL,
-            O_ORDERPRIORITY CHAR(15) NOT NULL,
-            O_CLERK CHAR(15) NOT NULL,
-            O_SHIPPRIORITY INTEGER NOT NULL,
-            O_COMMENT VARCHAR(79) NOT NULL
-        );
-    '''
-    createLineitemSql = '''
-        CREATE TABLE LINEITEM (
-            L_ORDERKEY INTEGER NOT NULL,
-            L_PARTKEY INTEGER NOT NULL,
-            L_SUPPKEY INTEGER NOT NULL,
-            L_LINENUMBER INTEGER NOT NULL,
-            L_QUANTITY DECIMAL(15, 2) NOT NULL,
-            L_EXTENDEDPRICE DECIMAL(15, 2) NOT NULL,
-            L_DISCOUNT DECIMAL(15, 2) NOT NULL,
-            L_TAX DECIMAL(15, 2) NOT NULL,
-            L_RETURNFLAG CHAR(1) NOT NULL,
-            L_LINESTATUS CHAR(1) NOT NULL,
-            L_SHIPDATE DATE NOT NULL,
-            L_COMMITDATE DATE NOT NULL,
-            L_RECEIPTDATE DATE NOT NULL,
-            L_SHIPINSTRUCT CHAR(25) NOT NULL,
-            L_SHIPMODE CHAR(10) NOT NULL,
-            L_COMMENT VARCHAR(44) NOT NULL
-        );
-    '''
-    createTableSqls = (createNationSql, 
-                       createRegionSql, 
-                       createPartSql, 
-                       createSupplierSql, 
-                       createPartsuppSql, 
-                       createCustomerSql, 
-                       createOrderSql, 
-                       createLineitemSql)
-    for createTableSql in createTableSqls:
-        _executeWrapper(cur, createTableSql)
-
-    conn.commit()
-
-    # insert data into tables from dbgen-generated files
-    tableDir = Path(config.tpchTblPath)
+# Copy a chunk of a .tbl file into its table, return the number of rows 
+# and the time the copy started and finished
+def _copyTblRange(connPool: ThreadedConnectionPool, tblName: str, 
+                  path: Path, begin: int, end: int) -> tuple:
+    conn = connPool.getconn()
+    try:
+        st = perf_counter()
+        with conn.cursor() as cur:
+            if config.bulkLoad:
+                applySessionSettings(cur, {"synchronous_commit": "off"})
+            copyFromSql = "copy {} from stdin with (delimiter '|')".format(
+                tblName
+            )
+            tblRange = _FileRange(path, begin, end)
+            try:
+                cur.copy_expert(copyFromSql, tblRange, size=COPY_BUFFER_SIZE)
+            finally:
+                tblRange.close()
+            rows = cur.rowcount
+        conn.commit()
+        return rows, st, perf_counter()
+    finally:
+        connPool.putconn(conn)
+
+# Load .tbl files into their tables, only the rows of orders and lineitem 
+# whose orderkeys are in `keyRange` if it is given, None bounds are open
+def loadTblFiles(connStr: str, tableNames: tuple, tableDir: Path = None, 
+                 filePrefix: str = "", keyRange: tuple = None):
+    if tableDir is None:
+        tableDir = Path(config.tpchTblPath)
+    tasks = []
+    for tblName in tableNames:
+        path = tableDir / (filePrefix + tblName + ".tbl")
+        fileBegin, fileEnd = 0, path.stat().st_size
+        if keyRange is not None and tblName in PARTITION_KEYS:
+            low, high = keyRange
+            if low is not None:
+                fileBegin = _seekKey(path, low)
+            if high is not None:
+                fileEnd = _seekKey(path, high)
+        for begin, end in splitTblFile(path, config.loadChunkSize, 
+                                       fileBegin, fileEnd):
+            tasks.append((tblName, path, begin, end))
+    # Largest chunks first, small tables fill the gaps
+    tasks.sort(key=lambda task: task[3] - task[2], reverse=True)
+
+    with TRACER.phase("load") as phase:
+        stats = _copyTblTasks(connStr, tasks)
+        phase["rows"] = sum(stat[0] for stat in stats.values())
     for tblName in tableNames:
-        copyFromFileStr = "\copy {} from '{}' with (delimiter '|')".format(
-            tblName, tableDir / (tblName + ".tbl")
+        rows, size, st, et = stats[tblName]
+        _logCopyRate("Loaded", tblName, rows, size, et - st)
+
+# Run copy tasks concurrently, return rows, bytes, first start and last 
+# finish of every table
+def _copyTblTasks(connStr: str, tasks: list) -> dict:
+    connPool = ThreadedConnectionPool(1, config.loadParallelism, connStr)
+    try:
+        with ThreadPoolExecutor(max_workers=config.loadParallelism) as executor:
+            futures = [executor.submit(_copyTblRange, connPool, *task) 
+                       for task in tasks]
+            stats = {}
+            for task, future in zip(tasks, futures):
+                rows, st, et = future.result()
+                tblName, _, begin, end = task
+                tblRows, tblSize, tblSt, tblEt = stats.get(
+                    tblName, (0, 0, st, et)
+                )
+                stats[tblName] = (tblRows + rows, tblSize + end - begin, 
+                                  min(tblSt, st), max(tblEt, et))
+    finally:
+        connPool.closeall()
+    return stats
+
+# Copy a table or partition into a .tbl file, return the number of rows
+def _exportTbl(connPool: ThreadedConnectionPool, tblName: str, 
+               relName: str, path: Path) -> int:
+    conn = connPool.getconn()
+    try:
+        copyToSql = "copy (select * from {} order by {}) to stdout with (delimiter '|')".format(
+            relName, ", ".join(TABLE_KEYS[tblName])
         )
-        runCmd([config.psqlPath, "-d", connStr, "-c", copyFromFileStr])
+        with conn.cursor() as cur, \
+                open(path, "wb", buffering=COPY_BUFFER_SIZE) as tblFile:
+            cur.copy_expert(copyToSql, tblFile, size=COPY_BUFFER_SIZE)
+            rows = cur.rowcount
+        conn.commit()
+        return rows
+    finally:
+        connPool.putconn(conn)
+
+# Copy tables into bi-<table>.tbl files in destPath. Rows are ordered by 
+# key, the physical order depends on how the tables were loaded. 
+# Partitions are copied concurrently into slices of the file, which are 
+# concatenated in key order.
+def exportTblFiles(connStr: str, tableNames: tuple):
+    destPath = Path(config.destPath)
+    connPool = ThreadedConnectionPool(1, config.loadParallelism, connStr)
+    try:
+        with TRACER.phase("export"), \
+                ThreadPoolExecutor(max_workers=config.loadParallelism) as executor:
+            for tblName in tableNames:
+                tblPath = destPath / ("bi-" + tblName + ".tbl")
+                relNames = partitionNames(tblName)
+                slicePaths = [tblPath.with_name("{}.{}".format(tblPath.name, i)) 
+                              for i in range(len(relNames))]
+                if len(relNames) == 0:
+                    relNames, slicePaths = [tblName], [tblPath]
+                st = perf_counter()
+                with TRACER.phase(tblName) as phase:
+                    phase["rows"] = sum(executor.map(
+                        _exportTbl, repeat(connPool), repeat(tblName), 
+                        relNames, slicePaths
+                    ))
+                    if slicePaths[0] != tblPath:
+                        with open(tblPath, "wb") as tblOut:
+                            for slicePath in slicePaths:
+                                with open(slicePath, "rb") as sliceIn:
+                                    copyfileobj(sliceIn, tblOut, COPY_BUFFER_SIZE)
+                                slicePath.unlink()
+                _logCopyRate("Exported", tblName, phase["rows"], 
+                             tblPath.stat().st_size, perf_counter() - st)
+    finally:
+        connPool.closeall()
+
+
+
+
+
+# Receivable times are drawn uniformly from the active time of an order 
+# by a hash of (RECEIVABLE_SEED, orderkey, "begin" or "end"), the same as 
+# `_hashRandom` and `_uniformDate` of the stream mode. The result does not 
+# depend on the order rows are visited, so every mode, partitioning and 
+# parallel plan derives the same receivable times.
+RECEIVABLE_SEED = 8444218515250481
+CREATE_UNIFORM_SQL = '''
+    CREATE OR REPLACE FUNCTION uniform(low date, high date, 
+                                       orderkey integer, purpose text) 
+        RETURNS date AS
+    $$
+        SELECT low + cast(floor(
+            cast(cast(cast(('x' || substr(md5(
+                '{}|' || orderkey || '|' || purpose
+            ), 1, 13)) as bit(52)) as bigint) as double precision) 
+            / 4503599627370496 * (high - low + 1)
+        ) as int)
+    $$ LANGUAGE sql IMMUTABLE STRICT PARALLEL SAFE
+'''.format(RECEIVABLE_SEED)
+DROP_UNIFORM_SQL = "drop function if exists uniform"
+
+# Derive V1 data by adding temporal columns to the loaded tables and 
+# updating every row
+def deriveVersion1ByUpdate(cur: psycopg2.extensions.cursor):
+    conn = cur.connection
 
     # generate V1data for lineitem
     alterLineitemAddATSql = '''
@@ -391,36 +823,24 @@ def initializeVersion1(connStr: str):
     '''
     _executeWrapper(cur, updateOrdersATSql1)
     _executeWrapper(cur, updateOrdersATSql2)
-    selectSetseedSql = "select setseed({})".format(0.8444218515250481)
-    createUniformSql = '''
-        CREATE OR REPLACE FUNCTION uniform(low date ,high date) 
-            RETURNS date AS
-        $$
-        BEGIN
-            RETURN low + cast(floor(random()* (high-low + 1)) as int);
-        END;
-        $$ language 'plpgsql' STRICT
-        '''
     updateOrdersReceTimeSql1 = '''
         update
             orders
         set
             o_RECEIVABLE_TIME_BEGIN = uniform(o_active_time_begin, 
-                o_active_time_end);
+                o_active_time_end, o_orderkey, 'begin');
     '''
     updateOrdersReceTimeSql2 = '''
         update
             orders
         set
             o_RECEIVABLE_TIME_end = uniform(o_RECEIVABLE_TIME_BEGIN, 
-                o_active_time_end);
+                o_active_time_end, o_orderkey, 'end');
     '''
-    dropUniformSql = "drop function if exists uniform;"
-    _executeWrapper(cur, selectSetseedSql)
-    _executeWrapper(cur, createUniformSql)
+    _executeWrapper(cur, CREATE_UNIFORM_SQL)
     _executeWrapper(cur, updateOrdersReceTimeSql1)
     _executeWrapper(cur, updateOrdersReceTimeSql2)
-    _executeWrapper(cur, dropUniformSql)
+    _executeWrapper(cur, DROP_UNIFORM_SQL)
     
     conn.commit()
 
@@ -518,145 +938,2681 @@ def initializeVersion1(connStr: str):
 
     conn.commit()
 
-    cur.close()
-    conn.close()
+# Derive V1 data by creating every table once from the loaded tables with 
+# CREATE UNLOGGED TABLE AS, so no row is rewritten and no dead tuple is 
+# left. V1 tables of partitioned tables are partitioned in the same way 
+# and filled by INSERT, partition by partition on concurrent connections. 
+# Out of the bulk profile the tables are made logged after they replace 
+# the loaded tables, in the bulk profile `finishBulkLoad` decides.
+def deriveVersion1ByCtas(cur: psycopg2.extensions.cursor, connStr: str):
+    conn = cur.connection
+
+    for tblName in PARTITION_KEYS:
+        if len(partitionNames(tblName)) > 0:
+            createV1Sql = '''
+                create table {}_v1 (like {}, {}) partition by range ({})
+            '''.format(tblName, tblName, ", ".join(
+                "{} date".format(column) for column in VERSION1_COLUMNS[tblName]
+            ), PARTITION_KEYS[tblName])
+            _executeWrapper(cur, createV1Sql)
+            createPartitions(cur, tblName, "_v1", unlogged=True)
+    conn.commit()
 
-    # output data into files
-    destPath = Path(config.destPath)
-    for i in range(len(tableNames)):
-        copyToFileStr = "\copy {} to '{}' with (delimiter '|')".format(
-            tableNames[i], 
-            destPath / ("bi-" + tableNames[i] + ".tbl")
-        )
-        runCmd(
-            [config.psqlPath, "-d", connStr, "-c", copyToFileStr], 
-            bufsize=8192
-        )
+    # generate V1data for lineitem
+    createLineitemV1Sql = '''
+        {}
+        select
+            lineitem.*,
+            least(l_shipdate, l_commitdate, l_receiptdate) 
+                as l_active_time_begin,
+            greatest(l_shipdate, l_commitdate, l_receiptdate) 
+                as l_active_time_end
+        from
+            {} as lineitem;
+    '''
+    lineitemPartitions = partitionNames("lineitem")
+    if len(lineitemPartitions) > 0:
+        with TRACER.phase("insert lineitem partitions") as phase:
+            phase["rows"] = _executeConcurrently(connStr, [
+                createLineitemV1Sql.format("insert into " + v1Partition, partition) 
+                for partition, v1Partition in zip(lineitemPartitions, 
+                                                  partitionNames("lineitem", "_v1"))
+            ])
+    else:
+        _executeWrapper(cur, createLineitemV1Sql.format(
+            "create unlogged table lineitem_v1 as", "lineitem"
+        ))
+
+    # generate V1data for orders, partition by partition on concurrent 
+    # connections like lineitem
+    createOrdersV1Sql = '''
+        {target}
+        select
+            o_orderkey, o_custkey, o_orderstatus, o_totalprice, o_orderdate, 
+            o_orderpriority, o_clerk, o_shippriority, o_comment, 
+            o_active_time_begin, o_active_time_end, 
+            o_receivable_time_begin, 
+            uniform(o_receivable_time_begin, o_active_time_end, 
+                o_orderkey, 'end') as o_receivable_time_end
+        from
+            (
+                select
+                    *,
+                    uniform(o_active_time_begin, o_active_time_end, 
+                        o_orderkey, 'begin') as o_receivable_time_begin
+                from
+                    (
+                        select
+                            orders.*,
+                            case when agg_lineitem.l_orderkey is null
+                                then date '{maxDate}'
+                                else least(o_orderdate, 
+                                    min_l_active_time_begin)
+                            end as o_active_time_begin,
+                            case when agg_lineitem.l_orderkey is null
+                                then date '{minDate}'
+                                else max_l_active_time_end
+                            end as o_active_time_end
+                        from
+                            {orders} as orders
+                            left join (
+                                select
+                                    l_orderkey,
+                                    min(l_active_time_begin) 
+                                        as min_l_active_time_begin,
+                                    max(l_active_time_end) 
+                                        as max_l_active_time_end
+                                from
+                                    {lineitem}
+                                group by
+                                    l_orderkey
+                            ) as agg_lineitem 
+                            on o_orderkey = agg_lineitem.l_orderkey
+                    ) as active_orders
+            ) as receivable_orders;
+    '''
+    _executeWrapper(cur, CREATE_UNIFORM_SQL)
+    conn.commit()
+    ordersPartitions = partitionNames("orders")
+    if len(ordersPartitions) > 0:
+        with TRACER.phase("insert orders partitions") as phase:
+            phase["rows"] = _executeConcurrently(connStr, [
+                createOrdersV1Sql.format(
+                    target="insert into " + v1Partition, orders=partition, 
+                    lineitem=lineitemV1Partition, maxDate=MAX_DATE, minDate=MIN_DATE
+                ) 
+                for partition, v1Partition, lineitemV1Partition in zip(
+                    ordersPartitions, partitionNames("orders", "_v1"), 
+                    partitionNames("lineitem", "_v1")
+                )
+            ])
+    else:
+        _executeWrapper(cur, createOrdersV1Sql.format(
+            target="create unlogged table orders_v1 as", orders="orders", 
+            lineitem="lineitem_v1", maxDate=MAX_DATE, minDate=MIN_DATE
+        ))
+    _executeWrapper(cur, DROP_UNIFORM_SQL)
+
+    # generate V1data for customer
+    createCustomerV1Sql = '''
+        create unlogged table customer_v1 as
+        select
+            customer.*,
+            least(date '{}', min_o_active_time_begin) as c_active_time_begin,
+            date '{}' as c_active_time_end
+        from
+            customer
+            left join (
+                select
+                    o_custkey,
+                    min(o_active_time_begin) as min_o_active_time_begin
+                from
+                    orders_v1
+                group by
+                    o_custkey
+            ) as agg_orders 
+            on c_custkey = agg_orders.o_custkey;
+    '''.format(MAX_DATE, MAX_DATE)
+    _executeWrapper(cur, createCustomerV1Sql)
+
+    # generate V1data for part
+    createPartV1Sql = '''
+        create unlogged table part_v1 as
+        select
+            part.*,
+            least(date '{}', min_l_active_time_begin) 
+                as p_availablity_time_begin,
+            date '{}' as p_availablity_time_end
+        from
+            part
+            left join (
+                select
+                    l_partkey,
+                    min(l_active_time_begin) as min_l_active_time_begin
+                from
+                    lineitem_v1
+                group by
+                    l_partkey
+            ) as agg_lineitem 
+            on p_partkey = agg_lineitem.l_partkey;
+    '''.format(MAX_DATE, MAX_DATE)
+    _executeWrapper(cur, createPartV1Sql)
+
+    # generate V1data for partsupp
+    createPartsuppV1Sql = '''
+        create unlogged table partsupp_v1 as
+        select
+            partsupp.*,
+            p_availablity_time_begin as ps_validity_time_begin,
+            case when p_partkey is null then null else date '{}' end 
+                as ps_validity_time_end
+        from
+            partsupp
+            left join part_v1 on p_partkey = ps_partkey;
+    '''.format(MAX_DATE)
+    _executeWrapper(cur, createPartsuppV1Sql)
+
+    # replace loaded tables with V1 tables
+    for tblName in ("lineitem", "orders", "customer", "part", "partsupp"):
+        _executeWrapper(cur, "drop table {}".format(tblName))
+        _executeWrapper(cur, "alter table {}_v1 rename to {}".format(
+            tblName, tblName
+        ))
+        for v1Partition, partition in zip(partitionNames(tblName, "_v1"), 
+                                          partitionNames(tblName)):
+            _executeWrapper(cur, "alter table {} rename to {}".format(
+                v1Partition, partition
+            ))
+    if not config.bulkLoad:
+        setTablesLogged(cur, ("lineitem", "orders", "customer", "part", "partsupp"))
+
+    conn.commit()
 
 
 
 
 
-def generataHistory(connStr: str):
-    conn = psycopg2.connect(connStr)
+# Generate V1 data without a database by streaming the .tbl files. 
+# lineitem.tbl and orders.tbl are both sorted by orderkey, so they are 
+# split into orderkey ranges, and the lineitems of every range are merged 
+# into their orders in one pass by a worker process. Workers keep the 
+# minimal active time of every part and customer in arrays indexed by 
+# key, which are merged before part and customer are written. Dates are 
+# compared as ISO strings, and receivable times are derived from a hash 
+# of the orderkey, so the result does not depend on the number of ranges.
+DECIMAL = "decimal"
+# Format of every column in a .tbl file, None keeps the value, an integer 
+# pads a CHAR(n) column, DECIMAL normalizes a DECIMAL(15, 2) column
+TBL_COLUMN_FORMATS = {
+    "nation": (None, 25, None, None),
+    "region": (None, 25, None),
+    "part": (None, None, 25, 10, None, None, 10, DECIMAL, None),
+    "supplier": (None, 25, None, None, 15, DECIMAL, None),
+    "partsupp": (None, None, None, DECIMAL, None),
+    "customer": (None, None, None, None, 15, DECIMAL, 10, None),
+    "orders": (None, None, 1, DECIMAL, None, 15, 15, None, None),
+    "lineitem": (None, None, None, None, DECIMAL, DECIMAL, DECIMAL, DECIMAL, 
+                 1, 1, None, None, None, 25, 10, None)
+}
+# Temporal columns added to every table in V1 data
+VERSION1_COLUMNS = {
+    "lineitem": ("l_active_time_begin", "l_active_time_end"),
+    "orders": ("o_active_time_begin", "o_active_time_end", 
+               "o_receivable_time_begin", "o_receivable_time_end"),
+    "customer": ("c_active_time_begin", "c_active_time_end"),
+    "part": ("p_availablity_time_begin", "p_availablity_time_end"),
+    "partsupp": ("ps_validity_time_begin", "ps_validity_time_end")
+}
+# Date number of keys without any date, larger than every date
+NO_DATE = 99999999
+
+def _formatTblRow(tblName: str, line: str) -> list:
+    row = line.rstrip("\n").split("|")
+    for i, columnFormat in enumerate(TBL_COLUMN_FORMATS[tblName]):
+        if columnFormat == DECIMAL:
+            row[i] = str(toNumeric(row[i]))
+        elif columnFormat is not None:
+            row[i] = row[i].ljust(columnFormat)
+    return row
+
+# Dates as integers yyyymmdd, which are ordered as the dates are
+def _dateNumber(isoDate: str) -> int:
+    return int(isoDate[:4] + isoDate[5:7] + isoDate[8:10])
+
+def _isoDate(dateNumber: int) -> str:
+    return "{:04d}-{:02d}-{:02d}".format(
+        dateNumber // 10000, dateNumber // 100 % 100, dateNumber % 100
+    )
+
+def _setMinDate(dates: array, key: int, dateNumber: int):
+    if key >= len(dates):
+        dates.extend(repeat(NO_DATE, max(key + 1, 2 * len(dates)) - len(dates)))
+    if dateNumber < dates[key]:
+        dates[key] = dateNumber
+
+def _mergeMinDates(dates: array, otherDates: array) -> array:
+    if len(dates) < len(otherDates):
+        dates, otherDates = otherDates, dates
+    merged = array("i", map(min, dates, otherDates))
+    merged.extend(dates[len(otherDates):])
+    return merged
+
+# Uniform number in [0, 1) from the md5 of keys, its 52 leading bits are 
+# exactly representable as a double
+def _hashRandom(*keys) -> float:
+    digest = md5("|".join(str(key) for key in keys).encode()).hexdigest()
+    return int(digest[:13], 16) / 4503599627370496
+
+def _uniformDate(random: float, low: str, high: str) -> str:
+    lowOrdinal = date.fromisoformat(low).toordinal()
+    highOrdinal = date.fromisoformat(high).toordinal()
+    return date.fromordinal(
+        lowOrdinal + floor(random * (highOrdinal - lowOrdinal + 1))
+    ).isoformat()
+
+def _openTbl(tblName: str, mode: str):
+    if mode == "r":
+        path = Path(config.tpchTblPath) / (tblName + ".tbl")
+    else:
+        path = Path(config.destPath) / ("bi-" + tblName + ".tbl")
+    return open(path, mode, buffering=COPY_BUFFER_SIZE)
+
+# Offset of the first line whose first column is not less than `key` in a 
+# file sorted by its first column
+def _seekKey(path: Path, key: int) -> int:
+    fileSize = path.stat().st_size
+    with open(path, "rb") as tblFile:
+        # offset of the first line beginning at or after `offset`
+        def lineBegin(offset: int) -> int:
+            if offset == 0:
+                return 0
+            tblFile.seek(offset - 1)
+            tblFile.readline()
+            return tblFile.tell()
+
+        low, high = 0, fileSize
+        while low < high:
+            middle = (low + high) // 2
+            begin = lineBegin(middle)
+            if begin >= fileSize:
+                high = middle
+                continue
+            tblFile.seek(begin)
+            if int(tblFile.readline().split(b"|", 1)[0]) < key:
+                low = begin + 1
+            else:
+                high = middle
+        return lineBegin(low)
+
+def _readLines(tblRange: _FileRange):
+    rest = b""
+    while True:
+        data = tblRange.read(COPY_BUFFER_SIZE)
+        if not data:
+            break
+        data = rest + data
+        lineEnd = data.rfind(b"\n") + 1
+        rest = data[lineEnd:]
+        yield from data[:lineEnd].decode().splitlines(True)
+    if rest:
+        yield rest.decode() + "\n"
+
+# Merge a range of orders.tbl and lineitem.tbl into bi-orders and 
+# bi-lineitem slices, return minimal active times of parts and customers
+def _generateVersion1Slice(ordersRange: tuple, lineitemRange: tuple, 
+                           ordersOutPath: Path, lineitemOutPath: Path) -> tuple:
+    minDate, maxDate = MIN_DATE.isoformat(), MAX_DATE.isoformat()
+    partBegins = array("i")
+    customerBegins = array("i")
+    ordersIn = _FileRange(*ordersRange)
+    lineitemIn = _FileRange(*lineitemRange)
+    try:
+        ordersLines = _readLines(ordersIn)
+        lineitemLines = _readLines(lineitemIn)
+        with open(ordersOutPath, "w", buffering=COPY_BUFFER_SIZE) as ordersOut, \
+                open(lineitemOutPath, "w", 
+                     buffering=COPY_BUFFER_SIZE) as lineitemOut:
+            lineitemLine = next(lineitemLines, "")
+            lastOrderkey = -1
+            for orderLine in ordersLines:
+                order = _formatTblRow("orders", orderLine)
+                orderkey = int(order[0])
+                if orderkey <= lastOrderkey:
+                    raise ValueError("orders.tbl is not sorted by orderkey")
+                lastOrderkey = orderkey
+                begin, end = maxDate, minDate
+                hasLineitem = False
+                while lineitemLine:
+                    lineitem = _formatTblRow("lineitem", lineitemLine)
+                    lineitemOrderkey = int(lineitem[0])
+                    if lineitemOrderkey > orderkey:
+                        break
+                    if lineitemOrderkey < orderkey:
+                        raise ValueError(
+                            "lineitem.tbl is not sorted by orderkey or has "
+                            "lineitems without order"
+                        )
+                    dates = lineitem[10:13]
+                    lineitemBegin, lineitemEnd = min(dates), max(dates)
+                    lineitem.append(lineitemBegin)
+                    lineitem.append(lineitemEnd)
+                    lineitemOut.write("|".join(lineitem) + "\n")
+                    _setMinDate(partBegins, int(lineitem[1]), 
+                                _dateNumber(lineitemBegin))
+                    if not hasLineitem:
+                        begin = min(order[4], lineitemBegin)
+                        end = lineitemEnd
+                        hasLineitem = True
+                    else:
+                        begin = min(begin, lineitemBegin)
+                        end = max(end, lineitemEnd)
+                    lineitemLine = next(lineitemLines, "")
+                receivableBegin = _uniformDate(
+                    _hashRandom(RECEIVABLE_SEED, orderkey, "begin"), begin, end
+                )
+                receivableEnd = _uniformDate(
+                    _hashRandom(RECEIVABLE_SEED, orderkey, "end"), 
+                    receivableBegin, end
+                )
+                order.extend((begin, end, receivableBegin, receivableEnd))
+                ordersOut.write("|".join(order) + "\n")
+                _setMinDate(customerBegins, int(order[1]), _dateNumber(begin))
+            if lineitemLine:
+                raise ValueError(
+                    "lineitem.tbl is not sorted by orderkey or has lineitems "
+                    "without order"
+                )
+    finally:
+        ordersIn.close()
+        lineitemIn.close()
+    return partBegins, customerBegins
+
+def generateVersion1FromTbl():
+    maxDate = MAX_DATE.isoformat()
+    tblDir = Path(config.tpchTblPath)
+    destDir = Path(config.destPath)
+
+    # lineitem and orders, split into orderkey ranges at order boundaries
+    ordersPath = tblDir / "orders.tbl"
+    lineitemPath = tblDir / "lineitem.tbl"
+    ordersSize = ordersPath.stat().st_size
+    ordersBounds = [begin for begin, end in splitTblFile(
+        ordersPath, max(1, ordersSize // config.version1Parallelism)
+    )] + [ordersSize]
+    lineitemBounds = [0]
+    with open(ordersPath, "rb") as ordersFile:
+        for bound in ordersBounds[1:-1]:
+            ordersFile.seek(bound)
+            orderkey = int(ordersFile.readline().split(b"|", 1)[0])
+            lineitemBounds.append(_seekKey(lineitemPath, orderkey))
+    lineitemBounds.append(lineitemPath.stat().st_size)
+    sliceNum = len(ordersBounds) - 1
+    if sliceNum == 1:
+        slicePaths = [(destDir / "bi-orders.tbl", destDir / "bi-lineitem.tbl")]
+    else:
+        slicePaths = [
+            (destDir / "bi-orders.tbl.{}".format(i), 
+             destDir / "bi-lineitem.tbl.{}".format(i))
+            for i in range(sliceNum)
+        ]
+    sliceArgs = [
+        ((ordersPath, ordersBounds[i], ordersBounds[i + 1]), 
+         (lineitemPath, lineitemBounds[i], lineitemBounds[i + 1])) 
+        + slicePaths[i]
+        for i in range(sliceNum)
+    ]
+    if sliceNum == 1:
+        sliceResults = [_generateVersion1Slice(*sliceArgs[0])]
+    else:
+        # imported here, multiprocessing slows down importing dbgen
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=sliceNum) as executor:
+            sliceResults = list(executor.map(
+                _generateVersion1Slice, *zip(*sliceArgs)
+            ))
+        for i, tblName in enumerate(("orders", "lineitem")):
+            with open(destDir / ("bi-" + tblName + ".tbl"), "wb") as tblOut:
+                for paths in slicePaths:
+                    with open(paths[i], "rb") as sliceIn:
+                        copyfileobj(sliceIn, tblOut, COPY_BUFFER_SIZE)
+                    paths[i].unlink()
+
+    # reduce minimal active times of all ranges
+    partBegins, customerBegins = sliceResults[0]
+    for slicePartBegins, sliceCustomerBegins in sliceResults[1:]:
+        partBegins = _mergeMinDates(partBegins, slicePartBegins)
+        customerBegins = _mergeMinDates(customerBegins, sliceCustomerBegins)
+
+    # customer
+    with _openTbl("customer", "r") as customerIn, \
+            _openTbl("customer", "w") as customerOut:
+        for customerLine in customerIn:
+            customer = _formatTblRow("customer", customerLine)
+            custkey = int(customer[0])
+            begin = maxDate
+            if custkey < len(customerBegins) \
+                    and customerBegins[custkey] != NO_DATE:
+                begin = _isoDate(customerBegins[custkey])
+            customer.extend((begin, maxDate))
+            customerOut.write("|".join(customer) + "\n")
+
+    # part, whose availablity time begins are kept for partsupp
+    availablityBegins = array("i")
+    with _openTbl("part", "r") as partIn, _openTbl("part", "w") as partOut:
+        for partLine in partIn:
+            part = _formatTblRow("part", partLine)
+            partkey = int(part[0])
+            begin = maxDate
+            if partkey < len(partBegins) and partBegins[partkey] != NO_DATE:
+                begin = _isoDate(partBegins[partkey])
+            _setMinDate(availablityBegins, partkey, _dateNumber(begin))
+            part.extend((begin, maxDate))
+            partOut.write("|".join(part) + "\n")
+
+    # partsupp, NULL if the part does not exist. Suppliers of a part are 
+    # not sorted by suppkey in partsupp.tbl, so they are sorted per part.
+    def writePartsupps(partsupps: list):
+        partsupps.sort(key=lambda partsupp: int(partsupp[1]))
+        for partsupp in partsupps:
+            partsuppOut.write("|".join(partsupp) + "\n")
+        partsupps.clear()
+
+    with _openTbl("partsupp", "r") as partsuppIn, \
+            _openTbl("partsupp", "w") as partsuppOut:
+        partsupps = []
+        for partsuppLine in partsuppIn:
+            partsupp = _formatTblRow("partsupp", partsuppLine)
+            partkey = int(partsupp[0])
+            if partsupps and partsupps[0][0] != partsupp[0]:
+                writePartsupps(partsupps)
+            if partkey < len(availablityBegins) \
+                    and availablityBegins[partkey] != NO_DATE:
+                partsupp.extend((_isoDate(availablityBegins[partkey]), 
+                                 maxDate))
+            else:
+                partsupp.extend(("\\N", "\\N"))
+            partsupps.append(partsupp)
+        writePartsupps(partsupps)
+
+    # tables without temporal columns
+    for tblName in ("nation", "region", "supplier"):
+        with _openTbl(tblName, "r") as tblIn, \
+                _openTbl(tblName, "w") as tblOut:
+            for line in tblIn:
+                tblOut.write("|".join(_formatTblRow(tblName, line)) + "\n")
+
+
+
+
+
+# Versions of the derivation of V1data and of history, bumped whenever a 
+# change of dbgen changes the data they generate. Outputs and templates of 
+# another version are not reused.
+VERSION1_VERSION = 2
+HISTORY_VERSION = 2
+TEMPLATE_READ_SIZE = 1 << 20
+
+
+def _fileHash(path: Path) -> str:
+    fileHash = md5()
+    with open(path, "rb") as file:
+        while True:
+            buffer = file.read(TEMPLATE_READ_SIZE)
+            if not buffer:
+                break
+            fileHash.update(buffer)
+    return fileHash.hexdigest()
+
+
+# Fingerprint of V1data, which changes with tpch tables, `VERSION1_VERSION` 
+# and options deriving V1data. `inputHashes` caches the hashes of tpch 
+# tables by path, a table is hashed again only when its size or 
+# modification time changes.
+def _version1Fingerprint(inputHashes: dict = None) -> str:
+    if inputHashes is None:
+        inputHashes = {}
+    fingerprint = md5("{}|{}|{}".format(
+        VERSION1_VERSION, config.version1Mode, config.partitions
+    ).encode())
+    with TRACER.phase("fingerprint"):
+        for tblName in TABLE_KEYS:
+            path = (Path(config.tpchTblPath) / (tblName + ".tbl")).resolve()
+            stat = path.stat()
+            cached = inputHashes.get(str(path))
+            if cached is None or cached["size"] != stat.st_size \
+                    or cached["mtime_ns"] != stat.st_mtime_ns:
+                cached = {
+                    "size": stat.st_size, 
+                    "mtime_ns": stat.st_mtime_ns, 
+                    "md5": _fileHash(path)
+                }
+                inputHashes[str(path)] = cached
+            fingerprint.update(cached["md5"].encode())
+    return "tpc-bih v1 " + fingerprint.hexdigest()
+
+
+# Connection to the maintenance database, where databases are created and 
+# dropped
+def _connectMaintenance(connStr: str):
+    conn = psycopg2.connect(make_dsn(connStr, dbname="postgres"))
+    conn.autocommit = True
+    return conn
+
+
+def _dropTemplate(cur, templateName: str):
+    cur.execute("select 1 from pg_database where datname = %s", (templateName,))
+    if cur.fetchone() is not None:
+        _executeWrapper(cur, 'alter database "{}" is_template false'.format(templateName))
+        _executeWrapper(cur, 'drop database "{}"'.format(templateName))
+
+
+# Recreate the database from the template if the template holds V1data of 
+# the fingerprint, return whether it is recreated
+def cloneVersion1Template(connStr: str, fingerprint: str) -> bool:
+    conn = _connectMaintenance(connStr)
     cur = conn.cursor()
+    cur.execute(
+        "select shobj_description(oid, 'pg_database') from pg_database "
+        "where datname = %s", 
+        (config.version1Template,)
+    )
+    row = cur.fetchone()
+    cloned = row is not None and row[0] == fingerprint
+    if cloned:
+        _executeWrapper(cur, 'drop database if exists "{}"'.format(config.dbname))
+        _executeWrapper(cur, 'create database "{}" template "{}"'.format(
+            config.dbname, config.version1Template
+        ))
+    cur.close()
+    conn.close()
+    return cloned
 
-    oneDay = timedelta(days=1)
-    avgUTPerDay = config.updateTimes / (TO_DATE - FROM_DATE).days
-    currentUT = avgUTPerDay
-    totalUT = 0
 
-    # create index on primary key of part, supplier, partsupp, 
-    # customer, orders, lineitem
-    createPartPKSql = '''
-        create index if not exists part_pk on part 
-            (p_partkey)
+# Copy the database holding V1data into the template, replacing the 
+# template of other V1data
+def saveVersion1Template(connStr: str, fingerprint: str):
+    conn = _connectMaintenance(connStr)
+    cur = conn.cursor()
+    _dropTemplate(cur, config.version1Template)
+    _executeWrapper(cur, 'create database "{}" template "{}"'.format(
+        config.version1Template, config.dbname
+    ))
+    _executeWrapper(cur, "comment on database \"{}\" is '{}'".format(
+        config.version1Template, fingerprint
+    ))
+    _executeWrapper(cur, 'alter database "{}" is_template true'.format(
+        config.version1Template
+    ))
+    cur.close()
+    conn.close()
+
+
+def initializeVersion1(connStr: str, *, fingerprint: str = None):
+
+    if config.version1Template == "":
+        buildVersion1(connStr)
+        return
+
+    if fingerprint is None:
+        fingerprint = _version1Fingerprint()
+    with TRACER.phase("clone template"):
+        cloned = cloneVersion1Template(connStr, fingerprint)
+    if cloned:
+        LOG.info("V1data is cloned from template {}".format(config.version1Template))
+        # history is generated from the database, V1data files are still 
+        # written for users
+        exportTblFiles(connStr, tuple(TABLE_KEYS))
+        return
+
+    buildVersion1(connStr)
+    if config.version1Mode != "stream" or not config.v1Only:
+        with TRACER.phase("save template"):
+            saveVersion1Template(connStr, fingerprint)
+        LOG.info("V1data is saved as template {}".format(config.version1Template))
+
+
+# Session settings of the bulk profile, sized from the cores and memory of 
+# this machine, which usually runs the database too
+BULK_MAINTENANCE_MEMORY_SHARE = 16
+BULK_MAX_MAINTENANCE_MEMORY = 2 << 30
+BULK_MAX_MAINTENANCE_WORKERS = 8
+def bulkSessionSettings(sessions: int = 1) -> dict:
+    cores = os.cpu_count() or 1
+    try:
+        memory = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (AttributeError, ValueError, OSError):
+        memory = 1 << 30
+    # shared by `sessions` building indexes at the same time
+    maintenanceMemory = min(memory // BULK_MAINTENANCE_MEMORY_SHARE // sessions, 
+                            BULK_MAX_MAINTENANCE_MEMORY)
+    return {
+        "synchronous_commit": "off", 
+        "maintenance_work_mem": "{}MB".format(max(64, maintenanceMemory >> 20)), 
+        "max_parallel_maintenance_workers": 
+            str(min(max(cores // sessions - 1, 0), BULK_MAX_MAINTENANCE_WORKERS))
+    }
+
+def applySessionSettings(cur: psycopg2.extensions.cursor, settings: dict):
+    for name, value in settings.items():
+        _executeWrapper(cur, "set {} = '{}'".format(name, value))
+
+def resetSessionSettings(cur: psycopg2.extensions.cursor, names):
+    for name in names:
+        _executeWrapper(cur, "reset {}".format(name))
+
+def analyzeTables(cur: psycopg2.extensions.cursor):
+    for tblName in TABLE_KEYS:
+        _executeWrapper(cur, "analyze {}".format(tblName))
+    cur.connection.commit()
+
+# Make unlogged tables logged, partitioned tables have no storage and 
+# their partitions are altered instead
+def setTablesLogged(cur: psycopg2.extensions.cursor, tableNames):
+    for tblName in tableNames:
+        for relName in partitionNames(tblName) or [tblName]:
+            _executeWrapper(cur, "alter table {} set logged".format(relName))
+
+# Make the tables of V1data logged if asked and analyze them, the end of 
+# loading in the bulk profile
+def finishBulkLoad(cur: psycopg2.extensions.cursor):
+    if config.bulkLoadLogged:
+        setTablesLogged(cur, TABLE_KEYS)
+    analyzeTables(cur)
+
+
+# With `config.partitions` > 0, orders and lineitem are range partitioned 
+# on orderkey into partitions of equal orderkey ranges up to the largest 
+# orderkey of orders.tbl. Rows of a partition are contiguous in the tables 
+# sorted by key, so partitions are derived, indexed and exported on their 
+# own connections, and history reads and writes touch one partition.
+PARTITION_KEYS = {"orders": "o_orderkey", "lineitem": "l_orderkey"}
+
+# Partitions of a table, none if it is not partitioned
+def partitionNames(tblName: str, suffix: str = "") -> list:
+    if config.partitions == 0 or tblName not in PARTITION_KEYS:
+        return []
+    return ["{}{}_p{}".format(tblName, suffix, i) for i in range(config.partitions)]
+
+# Largest key of a .tbl file sorted by its first column
+def _lastKey(path: Path) -> int:
+    with open(path, "rb") as tblFile:
+        tblFile.seek(max(0, path.stat().st_size - COPY_BUFFER_SIZE))
+        return int(tblFile.read().splitlines()[-1].split(b"|", 1)[0])
+
+# Lowest orderkeys of the 2nd to the last of `count` equal orderkey ranges, 
+# orderkeys added by history are in the last range
+def orderkeyBounds(count: int) -> list:
+    step = _lastKey(Path(config.tpchTblPath) / "orders.tbl") // count + 1
+    return [i * step + 1 for i in range(1, count)]
+
+def partitionBounds() -> list:
+    lows = ["minvalue"] + [str(low) for low in orderkeyBounds(config.partitions)]
+    return list(zip(lows, lows[1:] + ["maxvalue"]))
+
+def createPartitions(cur: psycopg2.extensions.cursor, tblName: str, 
+                     suffix: str = "", unlogged: bool = False):
+    for partitionName, (low, high) in zip(partitionNames(tblName, suffix), 
+                                          partitionBounds()):
+        _executeWrapper(cur, "create {}table {} partition of {}{} for values from ({}) to ({})".format(
+            "unlogged " if unlogged else "", partitionName, tblName, suffix, low, high
+        ))
+
+# Run statements concurrently on `config.loadParallelism` connections, 
+# return the total number of rows they affect. Statements are not traced 
+# one by one, the tracer follows the calling thread only.
+def _executeConcurrently(connStr: str, sqls: list) -> int:
+    def execute(sql: str) -> int:
+        conn = connPool.getconn()
+        try:
+            with conn.cursor() as cur:
+                if config.bulkLoad:
+                    applySessionSettings(cur, {"synchronous_commit": "off"})
+                _executeProfiled(cur, sql, None)
+                rows = max(cur.rowcount, 0)
+            conn.commit()
+            return rows
+        finally:
+            connPool.putconn(conn)
+
+    connPool = ThreadedConnectionPool(1, config.loadParallelism, connStr)
+    try:
+        with ThreadPoolExecutor(max_workers=config.loadParallelism) as executor:
+            return sum(executor.map(execute, sqls))
+    finally:
+        connPool.closeall()
+
+
+def createTables(cur: psycopg2.extensions.cursor):
+    tableNames = ("nation", "region", "part", "supplier", 
+                  "partsupp", "customer", "orders", "lineitem")
+    dropAllTblSql = "drop table if exists {}".format(",".join(tableNames))
+    _executeWrapper(cur, dropAllTblSql)
+    createNationSql = '''
+        CREATE TABLE NATION (
+            N_NATIONKEY INTEGER NOT NULL,
+            N_NAME CHAR(25) NOT NULL,
+            N_REGIONKEY INTEGER NOT NULL,
+            N_COMMENT VARCHAR(152)
+        );
     '''
-    createSupplierPKSql = '''
-        create index if not exists supplier_pk on supplier 
-            (s_suppkey)
+    createRegionSql = '''
+        CREATE TABLE REGION (
+            R_REGIONKEY INTEGER NOT NULL,
+            R_NAME CHAR(25) NOT NULL,
+            R_COMMENT VARCHAR(152)
+        );
     '''
-    createPartsuppPKSql = '''
-        create index if not exists partsupp_pk on partsupp 
-            (ps_partkey, ps_suppkey)
+    createPartSql = '''
+        CREATE TABLE PART (
+            P_PARTKEY INTEGER NOT NULL,
+            P_NAME VARCHAR(55) NOT NULL,
+            P_MFGR CHAR(25) NOT NULL,
+            P_BRAND CHAR(10) NOT NULL,
+            P_TYPE VARCHAR(25) NOT NULL,
+            P_SIZE INTEGER NOT NULL,
+            P_CONTAINER CHAR(10) NOT NULL,
+            P_RETAILPRICE DECIMAL(15, 2) NOT NULL,
+            P_COMMENT VARCHAR(23) NOT NULL
+        );
     '''
-    createCustomerPKSql = '''
-        create index if not exists customer_pk on customer 
-            (c_custkey)
+    createSupplierSql = '''
+        CREATE TABLE SUPPLIER (
+            S_SUPPKEY INTEGER NOT NULL,
+            S_NAME CHAR(25) NOT NULL,
+            S_ADDRESS VARCHAR(40) NOT NULL,
+            S_NATIONKEY INTEGER NOT NULL,
+            S_PHONE CHAR(15) NOT NULL,
+            S_ACCTBAL DECIMAL(15, 2) NOT NULL,
+            S_COMMENT VARCHAR(101) NOT NULL
+        );
     '''
-    createOrdersPKSql = '''
-        create index if not exists orders_pk on orders 
-            (o_orderkey)
+    createPartsuppSql = '''
+        CREATE TABLE PARTSUPP (
+            PS_PARTKEY INTEGER NOT NULL,
+            PS_SUPPKEY INTEGER NOT NULL,
+            PS_AVAILQTY INTEGER NOT NULL,
+            PS_SUPPLYCOST DECIMAL(15, 2) NOT NULL,
+            PS_COMMENT VARCHAR(199) NOT NULL
+        );
     '''
-    createLineitemPKSql = '''
-        create index if not exists lineitem_pk on lineitem 
-            (l_orderkey, l_partkey, l_suppkey)
+    createCustomerSql = '''
+        CREATE TABLE CUSTOMER (
+            C_CUSTKEY INTEGER NOT NULL,
+            C_NAME VARCHAR(25) NOT NULL,
+            C_ADDRESS VARCHAR(40) NOT NULL,
+            C_NATIONKEY INTEGER NOT NULL,
+            C_PHONE CHAR(15) NOT NULL,
+            C_ACCTBAL DECIMAL(15, 2) NOT NULL,
+            C_MKTSEGMENT CHAR(10) NOT NULL,
+            C_COMMENT VARCHAR(117) NOT NULL
+        );
+    '''
+    createOrderSql = '''
+        CREATE TABLE ORDERS (
+            O_ORDERKEY INTEGER NOT NULL,
+            O_CUSTKEY INTEGER NOT NULL,
+            O_ORDERSTATUS CHAR(1) NOT NULL,
+            O_TOTALPRICE DECIMAL(15, 2) NOT NULL,
+            O_ORDERDATE DATE NOT NULL,
+            O_ORDERPRIORITY CHAR(15) NOT NULL,
+            O_CLERK CHAR(15) NOT NULL,
+            O_SHIPPRIORITY INTEGER NOT NULL,
+            O_COMMENT VARCHAR(79) NOT NULL
+        );
+    '''
+    createLineitemSql = '''
+        CREATE TABLE LINEITEM (
+            L_ORDERKEY INTEGER NOT NULL,
+            L_PARTKEY INTEGER NOT NULL,
+            L_SUPPKEY INTEGER NOT NULL,
+            L_LINENUMBER INTEGER NOT NULL,
+            L_QUANTITY DECIMAL(15, 2) NOT NULL,
+            L_EXTENDEDPRICE DECIMAL(15, 2) NOT NULL,
+            L_DISCOUNT DECIMAL(15, 2) NOT NULL,
+            L_TAX DECIMAL(15, 2) NOT NULL,
+            L_RETURNFLAG CHAR(1) NOT NULL,
+            L_LINESTATUS CHAR(1) NOT NULL,
+            L_SHIPDATE DATE NOT NULL,
+            L_COMMITDATE DATE NOT NULL,
+            L_RECEIPTDATE DATE NOT NULL,
+            L_SHIPINSTRUCT CHAR(25) NOT NULL,
+            L_SHIPMODE CHAR(10) NOT NULL,
+            L_COMMENT VARCHAR(44) NOT NULL
+        );
     '''
-    createPKSqls = (createPartPKSql, 
-                    createSupplierPKSql, 
-                    createPartsuppPKSql, 
-                    createCustomerPKSql, 
-                    createOrdersPKSql, 
-                    createLineitemPKSql)
-    for createPKSql in createPKSqls:
-        _executeWrapper(cur, createPKSql)
+    createTableSqls = (createNationSql, 
+                       createRegionSql, 
+                       createPartSql, 
+                       createSupplierSql, 
+                       createPartsuppSql, 
+                       createCustomerSql, 
+                       createOrderSql, 
+                       createLineitemSql)
+    for tblName, createTableSql in zip(tableNames, createTableSqls):
+        # a partitioned table has no storage, its partitions are unlogged
+        partitioned = len(partitionNames(tblName)) > 0
+        if config.bulkLoad and not partitioned:
+            createTableSql = createTableSql.replace(
+                "CREATE TABLE", "CREATE UNLOGGED TABLE", 1
+            )
+        if partitioned:
+            createTableSql = createTableSql.rstrip().rstrip(";") \
+                + " PARTITION BY RANGE ({})".format(PARTITION_KEYS[tblName])
+        _executeWrapper(cur, createTableSql)
+        if partitioned:
+            createPartitions(cur, tblName, unlogged=config.bulkLoad)
+
+
+# Load V1data files in destPath into the database for generating history. 
+# With `config.shards`, every shard gets the orders and lineitems of its 
+# orderkey range and all rows of the other tables.
+def loadVersion1(connStr: str):
+    if len(config.shards) == 0:
+        _loadVersion1(connStr)
+        return
+    lows = orderkeyBounds(len(config.shards))
+    for i, shardConnStr in enumerate(config.shards):
+        with TRACER.phase("shard {}".format(i)):
+            _loadVersion1(shardConnStr, ([None] + lows)[i], (lows + [None])[i])
+
+def _loadVersion1(connStr: str, lowKey: int = None, highKey: int = None):
+    conn = psycopg2.connect(connStr)
+    cur = conn.cursor()
+    if len(config.shards) > 0:
+        # checkpoints left prepared by an interrupted history hold locks
+        _finishPreparedCheckpoints(conn)
+    with TRACER.phase("create tables"):
+        createTables(cur)
+        for tblName, columns in VERSION1_COLUMNS.items():
+            alterAddV1Sql = "alter table {} {}".format(tblName, ", ".join(
+                "add column {} date".format(column) for column in columns
+            ))
+            _executeWrapper(cur, alterAddV1Sql)
+        conn.commit()
+    keyRange = None if len(config.shards) == 0 else (lowKey, highKey)
+    loadTblFiles(connStr, tuple(TABLE_KEYS), Path(config.destPath), "bi-", 
+                 keyRange)
+    if config.bulkLoad:
+        with TRACER.phase("finish bulk load"):
+            finishBulkLoad(cur)
+    cur.close()
+    conn.close()
 
-    conn.commit()
 
-    # Get max and min c_custkey
-    selectMinMaxCustkeySql = '''
-        select min(c_custkey), max(c_custkey)
-        from customer;
-    '''
-    _executeWrapper(cur, selectMinMaxCustkeySql)
-    minCustkey, maxCustkey = cur.fetchone()
+def buildVersion1(connStr: str):
 
-    conn.commit()
+    if config.version1Mode == "stream":
+        with TRACER.phase("stream"):
+            generateVersion1FromTbl()
+        if not config.v1Only:
+            loadVersion1(connStr)
+        return
 
-    # Get max and min n_nationkey
-    selectMinMaxNationkeySql = '''
-        select min(n_nationkey), max(n_nationkey) 
-        from nation
-    '''
-    _executeWrapper(cur, selectMinMaxNationkeySql)
-    minNationkey, maxNationkey = cur.fetchone()
+    conn = psycopg2.connect(connStr)
+    cur = conn.cursor()
+    if config.bulkLoad:
+        applySessionSettings(cur, {"synchronous_commit": "off"})
 
-    conn.commit()
+    # create tables
+    tableNames = ("nation", "region", "part", "supplier", 
+                  "partsupp", "customer", "orders", "lineitem")
+    with TRACER.phase("create tables"):
+        createTables(cur)
+        conn.commit()
 
-    # Get max o_orderkey
-    selectMaxOrderekySql = "select max(o_orderkey) from orders"
-    _executeWrapper(cur, selectMaxOrderekySql)
-    maxOrderkey = cur.fetchone()[0]
+    # insert data into tables from dbgen-generated files
+    loadTblFiles(connStr, tableNames)
+    if config.bulkLoad:
+        with TRACER.phase("analyze"):
+            analyzeTables(cur)
+
+    with TRACER.phase("derive", statements=True):
+        if config.version1Mode == "ctas":
+            deriveVersion1ByCtas(cur, connStr)
+        else:
+            deriveVersion1ByUpdate(cur)
+        conn.commit()
+    if config.bulkLoad:
+        with TRACER.phase("finish bulk load"):
+            finishBulkLoad(cur)
+            resetSessionSettings(cur, ("synchronous_commit",))
+            conn.commit()
+    cur.close()
+    conn.close()
 
-    conn.commit()
+    # output data into files
+    exportTblFiles(connStr, tableNames)
 
-    # Get max and min p_partkey
-    selectMinMaxPartkeySql = '''
-        select min(p_partkey), max(p_partkey) 
-        from part
-    '''
-    _executeWrapper(cur, selectMinMaxPartkeySql)
-    minPartkey, maxPartkey = cur.fetchone()
 
-    conn.commit()
 
-    # create btree index on o_receivable_time to reduce cost from 
-    # "Uniformly select orders still being opened in `currentTime`"
-    createReceivableTimeBTreeIndexSql = '''
-        create index if not exists o_receivable_time_btree on orders 
-            (o_receivable_time_begin, o_receivable_time_end)
-    '''
-    _executeWrapper(cur, createReceivableTimeBTreeIndexSql)
 
-    conn.commit()
 
-    # Get max and min s_suppkey
-    selectMinMaxSuppkeySql = "select min(s_suppkey), max(s_suppkey) from supplier"
-    _executeWrapper(cur, selectMinMaxSuppkeySql)
-    minSuppkey, maxSuppkey = cur.fetchone()
+# Set of non-negative integer keys which picks the key of any rank in 
+# O(log n). Keys are bits of a bitmap, a Fenwick tree counts the keys of 
+# every block of the bitmap. The tree is built lazily, so a set filled 
+# before its first `select` costs O(n) instead of O(n log n).
+BLOCK_WORDS = 8
+BLOCK_BITS = 64 * BLOCK_WORDS
+class RankedKeySet:
+
+    def __init__(self):
+        self.words = array("Q")
+        self.tree = None
+        self.size = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __contains__(self, key: int) -> bool:
+        word = key >> 6
+        return word < len(self.words) and (self.words[word] >> (key & 63)) & 1 == 1
+
+    def _grow(self, key: int):
+        blockNum = max(1, len(self.words) // BLOCK_WORDS)
+        while blockNum * BLOCK_BITS <= key:
+            blockNum *= 2
+        self.words.extend(repeat(0, blockNum * BLOCK_WORDS - len(self.words)))
+        self.tree = None
+
+    def _buildTree(self):
+        blockNum = len(self.words) // BLOCK_WORDS
+        self.tree = array("q", repeat(0, blockNum + 1))
+        for block in range(blockNum):
+            self.tree[block + 1] = sum(
+                bin(word).count("1") for word in 
+                self.words[block * BLOCK_WORDS:(block + 1) * BLOCK_WORDS]
+            )
+        for i in range(1, blockNum + 1):
+            parent = i + (i & -i)
+            if parent <= blockNum:
+                self.tree[parent] += self.tree[i]
+
+    def _updateTree(self, key: int, delta: int):
+        if self.tree is None:
+            return
+        i = key // BLOCK_BITS + 1
+        while i < len(self.tree):
+            self.tree[i] += delta
+            i += i & -i
+
+    def add(self, key: int):
+        if key >= len(self.words) * 64:
+            self._grow(key)
+        word, bit = key >> 6, 1 << (key & 63)
+        if self.words[word] & bit == 0:
+            self.words[word] |= bit
+            self.size += 1
+            self._updateTree(key, 1)
+
+    def discard(self, key: int):
+        word, bit = key >> 6, 1 << (key & 63)
+        if word < len(self.words) and self.words[word] & bit != 0:
+            self.words[word] ^= bit
+            self.size -= 1
+            self._updateTree(key, -1)
+
+    def select(self, rank: int) -> int:
+        # Key with `rank` smaller keys in the set
+        if self.tree is None:
+            self._buildTree()
+        block, step = 0, 1 << ((len(self.tree) - 1).bit_length() - 1)
+        while step > 0:
+            if block + step < len(self.tree) and self.tree[block + step] <= rank:
+                block += step
+                rank -= self.tree[block]
+            step >>= 1
+        word = block * BLOCK_WORDS
+        while True:
+            count = bin(self.words[word]).count("1")
+            if rank < count:
+                break
+            rank -= count
+            word += 1
+        bits = self.words[word]
+        for _ in range(rank):
+            bits &= bits - 1
+        return word * 64 + (bits & -bits).bit_length() - 1
+
+    def __iter__(self):
+        # Keys in ascending order
+        for word, bits in enumerate(self.words):
+            while bits != 0:
+                lowBit = bits & -bits
+                yield word * 64 + lowBit.bit_length() - 1
+                bits ^= lowBit
+
+    def sample(self, rand: Random) -> int:
+        # Uniformly pick one key, None if the set is empty
+        if self.size == 0:
+            return None
+        return self.select(rand.randrange(self.size))
+
+
+
+
+
+# Utility for ordering keys by date in the heaps of `HistorySampler`
+def _timedKey(day: date, key: int) -> int:
+    return (day.toordinal() << 40) | key
+
+def _untimedKey(timedKey: int) -> tuple:
+    return date.fromordinal(timedKey >> 40), timedKey & ((1 << 40) - 1)
+
+def addOneMonth(day: date) -> date:
+    # `day + interval '1 month'`, None if it is beyond MAX_DATE
+    if day.year == MAX_DATE.year and day.month == 12:
+        return None
+    year, month = divmod(day.year * 12 + day.month, 12)
+    month += 1
+    return date(year, month, min(day.day, monthrange(year, month)[1]))
+
+# Keys of the rows which transactions of `generataHistory` may pick, one 
+# rank-addressable set for every eligibility class. Sets follow each write 
+# of history, except for lineitems which are checked and dropped when they 
+# are picked. Time dependent classes are moved forward by `advanceTo`.
+LINEITEM_SLOTS = 8
+class HistorySampler:
+
+    def __init__(self):
+        self.currentTime = FROM_DATE
+        # Orders picked by "Cancel order"
+        self.nonFOrders = RankedKeySet()
+        self.fOrders = RankedKeySet()
+        # Orders picked by "Deliver order", with 'P' status or with 'O' 
+        # status which their customers can afford
+        self.deliverableOrders = RankedKeySet()
+        # o_orderkey -> (o_custkey, o_totalprice) of orders with 'O' status
+        self.openOrders = {}
+        # c_custkey -> o_orderkey of its orders with 'O' status
+        self.customerOpenOrders = {}
+        # c_custkey -> c_acctbal
+        self.customerAcctbal = {}
+        # Orders with 'O' status and `currentTime` in receivable time
+        self.receivableOrders = RankedKeySet()
+        # o_orderkey -> o_receivable_time_end of orders with 'O' status 
+        # which are or will be receivable
+        self.receivableTimeEnd = {}
+        self.receivableBegins = []
+        self.receivableEnds = []
+        # Orders with 'F' status and `currentTime` later than one month 
+        # after receivable time
+        self.manipulableOrders = RankedKeySet()
+        self.manipulableBegins = []
+        # Lineitems which may still have 'O' status, 
+        # l_orderkey * LINEITEM_SLOTS + l_linenumber
+        self.openLineitems = RankedKeySet()
+        # Partsupp is never inserted or deleted by history, 
+        # ps_partkey << 32 | ps_suppkey
+        self.partsupps = array("q")
+
+    def addCustomer(self, custkey: int, acctbal: Decimal):
+        self.customerAcctbal[custkey] = acctbal
+        self._checkCustomerOrders(custkey)
+
+    def addCustomerAcctbal(self, custkey: int, amount: Decimal):
+        self.customerAcctbal[custkey] = toNumeric(
+            self.customerAcctbal[custkey] + amount
+        )
+        self._checkCustomerOrders(custkey)
+
+    def _checkCustomerOrders(self, custkey: int):
+        for orderkey in self.customerOpenOrders.get(custkey, ()):
+            self._checkDeliverable(orderkey)
+
+    # Same condition as "c_acctbal - o_totalprice >= 0" of an inner join 
+    # with customer
+    def _checkDeliverable(self, orderkey: int):
+        custkey, totalprice = self.openOrders[orderkey]
+        acctbal = self.customerAcctbal.get(custkey)
+        if acctbal is not None and acctbal - totalprice >= 0:
+            self.deliverableOrders.add(orderkey)
+        else:
+            self.deliverableOrders.discard(orderkey)
+
+    def _removeOpenOrder(self, orderkey: int):
+        openOrder = self.openOrders.pop(orderkey, None)
+        if openOrder is not None:
+            self.customerOpenOrders[openOrder[0]].discard(orderkey)
+
+    def addOrder(self, orderkey: int, custkey: int, status: str, 
+                 totalprice: Decimal, receivableTimeBegin: date, 
+                 receivableTimeEnd: date):
+        if status != "F":
+            self.nonFOrders.add(orderkey)
+        else:
+            self.fOrders.add(orderkey)
+            self._addManipulableOrder(orderkey, receivableTimeEnd)
+        if status == "O":
+            self.openOrders[orderkey] = (custkey, toNumeric(totalprice))
+            self.customerOpenOrders.setdefault(custkey, set()).add(orderkey)
+            self._checkDeliverable(orderkey)
+        elif status == "P":
+            self.deliverableOrders.add(orderkey)
+        if status == "O" and receivableTimeEnd >= self.currentTime:
+            self.receivableTimeEnd[orderkey] = receivableTimeEnd
+            heappush(self.receivableBegins, 
+                     _timedKey(receivableTimeBegin, orderkey))
+            if receivableTimeEnd != MAX_DATE:
+                heappush(self.receivableEnds, 
+                         _timedKey(receivableTimeEnd, orderkey))
+
+    def _addManipulableOrder(self, orderkey: int, receivableTimeEnd: date):
+        manipulableTime = addOneMonth(receivableTimeEnd)
+        if manipulableTime is None:
+            return
+        if manipulableTime < self.currentTime:
+            self.manipulableOrders.add(orderkey)
+        else:
+            heappush(self.manipulableBegins, 
+                     _timedKey(manipulableTime, orderkey))
+
+    def removeOrder(self, orderkey: int):
+        self.nonFOrders.discard(orderkey)
+        self.fOrders.discard(orderkey)
+        self.deliverableOrders.discard(orderkey)
+        self._removeOpenOrder(orderkey)
+        self.receivableOrders.discard(orderkey)
+        self.receivableTimeEnd.pop(orderkey, None)
+        self.manipulableOrders.discard(orderkey)
+
+    def setOrderStatus(self, orderkey: int, status: str, 
+                       receivableTimeEnd: date):
+        if status != "O":
+            self.receivableOrders.discard(orderkey)
+            self.receivableTimeEnd.pop(orderkey, None)
+            self._removeOpenOrder(orderkey)
+        if status == "P":
+            self.deliverableOrders.add(orderkey)
+        if status == "F" and orderkey not in self.fOrders:
+            self.nonFOrders.discard(orderkey)
+            self.deliverableOrders.discard(orderkey)
+            self.fOrders.add(orderkey)
+            self._addManipulableOrder(orderkey, receivableTimeEnd)
+
+    def setOrderTotalprice(self, orderkey: int, totalprice: Decimal):
+        if orderkey in self.openOrders:
+            self.openOrders[orderkey] = (self.openOrders[orderkey][0], 
+                                         toNumeric(totalprice))
+            self._checkDeliverable(orderkey)
+
+    def setOrderReceivableTimeEnd(self, orderkey: int, 
+                                  receivableTimeEnd: date):
+        if orderkey in self.receivableTimeEnd:
+            self.receivableTimeEnd[orderkey] = receivableTimeEnd
+            heappush(self.receivableEnds, 
+                     _timedKey(receivableTimeEnd, orderkey))
+
+    def addLineitem(self, orderkey: int, linenumber: int, status: str):
+        if status == "O":
+            self.openLineitems.add(orderkey * LINEITEM_SLOTS + linenumber)
+
+    def addPartsupp(self, partkey: int, suppkey: int):
+        self.partsupps.append((partkey << 32) | suppkey)
+
+    def advanceTo(self, currentTime: date):
+        self.currentTime = currentTime
+        while (len(self.receivableBegins) > 0 
+               and _untimedKey(self.receivableBegins[0])[0] <= currentTime):
+            _, orderkey = _untimedKey(heappop(self.receivableBegins))
+            receivableTimeEnd = self.receivableTimeEnd.get(orderkey)
+            if receivableTimeEnd is not None and receivableTimeEnd >= currentTime:
+                self.receivableOrders.add(orderkey)
+        while (len(self.receivableEnds) > 0 
+               and _untimedKey(self.receivableEnds[0])[0] < currentTime):
+            receivableTimeEnd, orderkey = _untimedKey(
+                heappop(self.receivableEnds)
+            )
+            # Skip ends overwritten by a later o_receivable_time_end
+            if self.receivableTimeEnd.get(orderkey) == receivableTimeEnd:
+                self.receivableOrders.discard(orderkey)
+                del self.receivableTimeEnd[orderkey]
+        while (len(self.manipulableBegins) > 0 
+               and _untimedKey(self.manipulableBegins[0])[0] < currentTime):
+            _, orderkey = _untimedKey(heappop(self.manipulableBegins))
+            if orderkey in self.fOrders:
+                self.manipulableOrders.add(orderkey)
+
+    def samplePartsupp(self, rand: Random) -> tuple:
+        if len(self.partsupps) == 0:
+            return None
+        partsupp = self.partsupps[rand.randrange(len(self.partsupps))]
+        return partsupp >> 32, partsupp & 0xFFFFFFFF
+
+
+
+
+
+# Operations `generataHistory` performs on the database state. Every write
+# receives the exact statement that goes into history.sql together with its
+# parameters, so a state may either execute the statement or apply it
+# directly. Writes whose effect is never read back by a later transaction
+# only go through `write`, except those of orders and lineitem which carry 
+# their orderkey for states split by orderkey. Rows are picked by the shared `HistorySampler`, 
+# so every state picks the same rows from the same random generator.
+# "Update stock" scans all open lineitems after `SAMPLE_ATTEMPTS` draws of 
+# lineitems whose parts are not available.
+SAMPLE_ATTEMPTS = 1000
+class HistoryState(ABC):
+
+    def __init__(self):
+        self.sampler = HistorySampler()
+
+    # Prepare for generating history, from the database or from the 
+    # `snapshot` of a checkpoint
+    def prepare(self, snapshot: dict = None):
+        pass
+
+    def cleanup(self):
+        pass
+
+    # End of one history transaction
+    def commit(self):
+        pass
+
+    # End of one simulated day
+    def endDay(self):
+        pass
+
+    # Make everything written so far durable, return what `prepare` needs 
+    # to continue from here
+    def checkpoint(self) -> dict:
+        return {"sampler": self.sampler}
+
+    # The snapshot returned by `checkpoint` has been saved
+    def finishCheckpoint(self):
+        pass
+
+    # Give up history generation after an error
+    def abort(self):
+        pass
+
+    @abstractmethod
+    def write(self, sql: str):
+        pass
+
+    # Point probes answered by every state
+    @abstractmethod
+    def selectOrder(self, orderkey: int) -> tuple:
+        # (o_orderstatus, o_totalprice, o_custkey, o_receivable_time_begin, 
+        #  o_receivable_time_end, c_acctbal), None if order is missing
+        pass
+
+    @abstractmethod
+    def selectLineitem(self, orderkey: int, linenumber: int) -> tuple:
+        # (l_partkey, l_suppkey, l_quantity, l_linestatus), None if 
+        # lineitem is missing
+        pass
+
+    @abstractmethod
+    def checkAvailTimeCondition(self, partkey: int, currentTime: date) -> bool:
+        pass
+
+    # Uniformly select one order with non 'F' status
+    def sampleCancelOrder(self, rand: Random) -> tuple:
+        o_orderkey = self.sampler.nonFOrders.sample(rand)
+        if o_orderkey is None:
+            return None
+        o_orderstatus, o_totalprice, o_custkey, _, _, _ = self.selectOrder(
+            o_orderkey
+        )
+        return o_orderkey, o_orderstatus, o_custkey, o_totalprice
+
+    # Uniformly select one order with 'P' status or with 'O' status 
+    # which its customer can afford
+    def sampleDeliverOrder(self, rand: Random) -> tuple:
+        o_orderkey = self.sampler.deliverableOrders.sample(rand)
+        if o_orderkey is None:
+            raise RuntimeError("no order can be delivered")
+        o_orderstatus, o_totalprice, o_custkey, o_receivable_time_begin, \
+            o_receivable_time_end, _ = self.selectOrder(o_orderkey)
+        return (o_orderkey, 
+                o_orderstatus, 
+                o_totalprice, 
+                o_custkey, 
+                o_receivable_time_begin, 
+                o_receivable_time_end)
+
+    # Uniformly select orders still being opened in `currentTime`
+    def sampleReceivableOrder(self, rand: Random, currentTime: date) -> tuple:
+        self.sampler.advanceTo(currentTime)
+        o_orderkey = self.sampler.receivableOrders.sample(rand)
+        if o_orderkey is None:
+            return None
+        _, o_totalprice, o_custkey, _, _, _ = self.selectOrder(o_orderkey)
+        return o_orderkey, o_totalprice, o_custkey
+
+    # Uniformly select lineitem with 'O' status and related part is 
+    # available
+    def sampleUpdateStockLineitem(self, rand: Random, 
+                                  currentTime: date) -> tuple:
+        attempts = 0
+        while attempts < SAMPLE_ATTEMPTS:
+            lineitemKey = self.sampler.openLineitems.sample(rand)
+            if lineitemKey is None:
+                break
+            lineitem = self._openLineitem(lineitemKey)
+            if lineitem is None:
+                continue
+            if self.checkAvailTimeCondition(lineitem[0], currentTime):
+                return lineitem
+            attempts += 1
+
+        # Too few lineitems are available to be drawn, pick among all
+        lineitems = []
+        availableParts = {}
+        for lineitemKey in list(self.sampler.openLineitems):
+            lineitem = self._openLineitem(lineitemKey)
+            if lineitem is None:
+                continue
+            l_partkey = lineitem[0]
+            if l_partkey not in availableParts:
+                availableParts[l_partkey] = self.checkAvailTimeCondition(
+                    l_partkey, currentTime
+                )
+            if availableParts[l_partkey]:
+                lineitems.append(lineitem)
+        if len(lineitems) == 0:
+            raise RuntimeError("no lineitem can update stock")
+        return lineitems[rand.randrange(len(lineitems))]
+
+    # (l_partkey, l_suppkey, l_quantity) of a lineitem with 'O' status, 
+    # None if it is no longer open and dropped from the sampler
+    def _openLineitem(self, lineitemKey: int) -> tuple:
+        lineitem = self.selectLineitem(*divmod(lineitemKey, LINEITEM_SLOTS))
+        if lineitem is None or lineitem[3] != "O":
+            self.sampler.openLineitems.discard(lineitemKey)
+            return None
+        return lineitem[:3]
+
+    # Uniformly select one partsupp
+    def sampleChangePricePartsupp(self, rand: Random) -> tuple:
+        return self.sampler.samplePartsupp(rand)
+
+    # Uniformly select one order with 'F' status which has not been 
+    # receivable for one month
+    def sampleManipulateOrder(self, rand: Random, currentTime: date) -> int:
+        self.sampler.advanceTo(currentTime)
+        return self.sampler.manipulableOrders.sample(rand)
+
+    def insertCustomer(self, sql: str, custkey: int):
+        self.sampler.addCustomer(custkey, toNumeric(0))
+        self.write(sql)
+
+    def addCustomerAcctbal(self, sql: str, custkey: int, amount: Decimal):
+        self.sampler.addCustomerAcctbal(custkey, amount)
+        self.write(sql)
+
+    def insertOrder(self, sql: str, orderkey: int, custkey: int, status: str,
+                    totalprice: float, receivableTimeBegin: date,
+                    receivableTimeEnd: date):
+        self.sampler.addOrder(orderkey, custkey, status, totalprice, 
+                              receivableTimeBegin, receivableTimeEnd)
+        self.write(sql)
+
+    def deleteOrder(self, sql: str, orderkey: int):
+        self.sampler.removeOrder(orderkey)
+        self.write(sql)
+
+    def setOrderStatus(self, sql: str, orderkey: int, status: str, 
+                       receivableTimeEnd: date):
+        self.sampler.setOrderStatus(orderkey, status, receivableTimeEnd)
+        self.write(sql)
+
+    def setOrderReceivableTimeEnd(self, sql: str, orderkey: int, 
+                                  receivableTimeEnd: date):
+        self.sampler.setOrderReceivableTimeEnd(orderkey, receivableTimeEnd)
+        self.write(sql)
+
+    def setOrderTotalprice(self, sql: str, orderkey: int, totalprice: Decimal):
+        self.sampler.setOrderTotalprice(orderkey, totalprice)
+        self.write(sql)
+
+    def setOrderActiveTimeEnd(self, sql: str, orderkey: int, 
+                              activeTimeEnd: date):
+        self.write(sql)
+
+    def insertLineitem(self, sql: str, orderkey: int, partkey: int, 
+                       suppkey: int, linenumber: int, quantity: int, 
+                       extendedprice: float, linestatus: str):
+        self.sampler.addLineitem(orderkey, linenumber, linestatus)
+        self.write(sql)
+
+    def deleteLineitems(self, sql: str, orderkey: int, partkey: int, 
+                        suppkey: int):
+        self.write(sql)
+
+    def setLineitemStatus(self, sql: str, orderkey: int, partkey: int, 
+                          suppkey: int, linestatus: str):
+        self.write(sql)
+
+    def setLineitemExtendedprice(self, sql: str, orderkey: int, partkey: int, 
+                                 suppkey: int, extendedprice: Decimal):
+        self.write(sql)
+
+    def addPartsuppAvailqty(self, sql: str, partkey: int, suppkey: int, 
+                            amount: Decimal):
+        self.write(sql)
+
+    def setPartAvailablity(self, sql: str, partkey: int, begin: date, 
+                           end: date):
+        self.write(sql)
+
+
+
+
+
+# Server-side cursor over the rows of `sql`, large tables are never 
+# fetched at once
+def _streamRows(conn: psycopg2.extensions.connection, sql: str):
+    cur = conn.cursor(name="dbgen_stream")
+    cur.itersize = 100000
+    cur.execute(sql)
+    yield from cur
+    cur.close()
 
-    conn.commit()
 
-    # TODO:p_availablity_time_btree for # Update stock
-    # create btree index on p_availablity_time to reduce cost from 
-    # "Uniformly select lineitem with 'O' status and related part 
-    # is available"
-    createAvailablityTimeBTreeIndexSql = '''
-        create index if not exists p_availablity_time_btree on part
-            (p_availablity_time_begin, p_availablity_time_end);
-    '''
-    _executeWrapper(cur, createAvailablityTimeBTreeIndexSql)
 
-    conn.commit()
 
-    historySqlFile = (Path(config.destPath) / "history.sql").open(
-        mode="+w", buffering=1048576
+
+# Table written by a statement of history
+WRITTEN_TABLE_PATTERN = re.compile(
+    r"\s*(?:update|insert\s+into|delete\s+from)\s+(\w+)", re.IGNORECASE
+)
+def _writtenTable(sql: str) -> str:
+    return WRITTEN_TABLE_PATTERN.match(sql).group(1).lower()
+
+# History state kept in PostgreSQL, every probe and every write is a 
+# statement on the live database. Writes are sent in batches of many 
+# transactions, a probe first sends the pending writes on tables it reads. 
+# Transactions are committed in groups of `config.historyCommitInterval`, 
+# or once per simulated day if it is 0.
+HISTORY_BATCH_STATEMENTS = 1000
+# Indexes read by history with their tables. Besides primary keys, btree 
+# index on o_receivable_time reduces cost from "Uniformly select orders 
+# still being opened in `currentTime`", btree index on p_availablity_time 
+# reduces cost from "Uniformly select lineitem with 'O' status and 
+# related part is available".
+HISTORY_INDEXES = (
+    ("part_pk", "part", "p_partkey"), 
+    ("supplier_pk", "supplier", "s_suppkey"), 
+    ("partsupp_pk", "partsupp", "ps_partkey, ps_suppkey"), 
+    ("customer_pk", "customer", "c_custkey"), 
+    ("orders_pk", "orders", "o_orderkey"), 
+    ("lineitem_pk", "lineitem", "l_orderkey, l_partkey, l_suppkey"), 
+    ("o_receivable_time_btree", "orders", 
+     "o_receivable_time_begin, o_receivable_time_end"), 
+    ("p_availablity_time_btree", "part", 
+     "p_availablity_time_begin, p_availablity_time_end")
+)
+CREATE_INDEX_SQL = "create index if not exists {} on {} ({})"
+
+# Indexes of history with their relations, the index of a partitioned 
+# table is made of an index on every partition
+def historyIndexRelations() -> list:
+    relations = []
+    for indexName, tblName, columns in HISTORY_INDEXES:
+        for i, partitionName in enumerate(partitionNames(tblName)):
+            relations.append(("{}_p{}".format(indexName, i), partitionName, columns))
+        relations.append((indexName, tblName, columns))
+    return relations
+
+# Build the indexes of a table one after another on a connection of the 
+# pool, indexes of one table never compete for reading it
+def _buildTableIndexes(connPool: ThreadedConnectionPool, createIndexSqls: list):
+    conn = connPool.getconn()
+    try:
+        with conn.cursor() as cur:
+            for createIndexSql in createIndexSqls:
+                _executeWrapper(cur, createIndexSql)
+                conn.commit()
+    finally:
+        connPool.putconn(conn)
+
+# Build the indexes of history on `config.indexParallelism` connections, 
+# tables are scheduled from the largest, so its builds are not left last. 
+# Partitions are indexed like tables, the indexes of partitioned tables are 
+# created at last and only attach the indexes of their partitions.
+def buildHistoryIndexes(connStr: str):
+    tableIndexes = {}
+    parentIndexSqls = []
+    for indexName, relName, columns in historyIndexRelations():
+        createIndexSql = CREATE_INDEX_SQL.format(indexName, relName, columns)
+        if len(partitionNames(relName)) > 0:
+            parentIndexSqls.append(createIndexSql)
+        else:
+            tableIndexes.setdefault(relName, []).append(createIndexSql)
+    conn = psycopg2.connect(connStr)
+    with conn.cursor() as cur:
+        cur.execute("select relname, pg_relation_size(oid) from pg_class "
+                    "where relname in %s and relkind = 'r'", 
+                    (tuple(tableIndexes),))
+        tableSizes = dict(cur.fetchall())
+    conn.close()
+    relNames = sorted(tableIndexes, key=lambda relName: tableSizes.get(relName, 0), 
+                      reverse=True)
+
+    # the pool is closed after the builds, so the bulk profile is not reset
+    sessionSettings = bulkSessionSettings(min(config.indexParallelism, len(relNames))) \
+        if config.bulkLoad else {}
+    connPool = ThreadedConnectionPool(
+        1, config.indexParallelism, connStr, 
+        options=" ".join("-c {}={}".format(name, value) 
+                         for name, value in sessionSettings.items())
+    )
+    try:
+        with ThreadPoolExecutor(max_workers=config.indexParallelism) as executor:
+            futures = [
+                executor.submit(_buildTableIndexes, connPool, tableIndexes[relName]) 
+                for relName in relNames
+            ]
+            for future in futures:
+                future.result()
+        _buildTableIndexes(connPool, parentIndexSqls)
+    finally:
+        connPool.closeall()
+
+
+class PostgresHistoryState(HistoryState):
+
+    def __init__(self, connStr: str):
+        super().__init__()
+        self.connStr = connStr
+        self.conn = psycopg2.connect(connStr)
+        self.cur = self.conn.cursor()
+        self.pendingSqls = []
+        self.pendingTables = set()
+        self.uncommittedNum = 0
+
+    def prepare(self, snapshot: dict = None):
+        self.prepareDatabase()
+
+        # The database is left as it was at the checkpoint
+        if snapshot is not None:
+            self.sampler = snapshot["sampler"]
+            return
+        self.fillSampler(self.sampler)
+
+    def prepareDatabase(self):
+        # the bulk profile keeps synchronous_commit off for the history
+        if config.bulkLoad:
+            applySessionSettings(self.cur, {"synchronous_commit": "off"})
+            self.conn.commit()
+
+        with TRACER.phase("indexes"):
+            buildHistoryIndexes(self.connStr)
+
+        if config.prewarmTables:
+            self.prewarm()
+
+    # Fill `sampler` with customers and keys of orders, lineitems and 
+    # partsupp, shards replicating customer and partsupp skip them
+    def fillSampler(self, sampler: HistorySampler, replicated: bool = True):
+        selectCustomerSql = "select c_custkey, c_acctbal from customer"
+        if replicated:
+            for row in _streamRows(self.conn, selectCustomerSql):
+                sampler.addCustomer(*row)
+        selectOrdersSql = '''
+            select o_orderkey, o_custkey, o_orderstatus, o_totalprice, 
+                o_receivable_time_begin, o_receivable_time_end
+            from orders
+        '''
+        for row in _streamRows(self.conn, selectOrdersSql):
+            sampler.addOrder(*row)
+        selectOpenLineitemsSql = '''
+            select l_orderkey, l_linenumber, l_linestatus
+            from lineitem
+            where l_linestatus = 'O'
+        '''
+        for row in _streamRows(self.conn, selectOpenLineitemsSql):
+            sampler.addLineitem(*row)
+        selectPartsuppSql = '''
+            select ps_partkey, ps_suppkey
+            from partsupp
+            order by ps_partkey, ps_suppkey
+        '''
+        if replicated:
+            for row in _streamRows(self.conn, selectPartsuppSql):
+                sampler.addPartsupp(*row)
+
+        self.conn.commit()
+
+    def cleanup(self):
+        self.flush()
+        self.conn.commit()
+
+        if not config.keepHistoryIndexes:
+            for indexName, tblName, columns in HISTORY_INDEXES:
+                _executeWrapper(self.cur, "drop index if exists {}".format(indexName))
+            self.conn.commit()
+
+        if config.bulkLoad:
+            resetSessionSettings(self.cur, ("synchronous_commit",))
+            self.conn.commit()
+
+        self.cur.close()
+        self.conn.close()
+
+    # Load the tables and indexes read by history into shared buffers, 
+    # history goes on without it if pg_prewarm is not available
+    def prewarm(self):
+        # partitioned tables and their indexes have no storage
+        relNames = []
+        for tblName in ("orders", "lineitem", "partsupp", "part", "customer"):
+            relNames.extend(partitionNames(tblName) or [tblName])
+        relNames.extend(indexName for indexName, relName, columns 
+                        in historyIndexRelations() 
+                        if len(partitionNames(relName)) == 0)
+        prewarmSql = '''
+            select pg_prewarm(c.oid) 
+            from pg_class c join pg_namespace n on c.relnamespace = n.oid
+            where n.nspname = current_schema() and c.relname in ({})
+        '''.format(", ".join("'{}'".format(relName) for relName in relNames))
+        try:
+            _executeWrapper(self.cur, "create extension if not exists pg_prewarm")
+            _executeWrapper(self.cur, prewarmSql)
+            self.conn.commit()
+        except psycopg2.Error as e:
+            self.conn.rollback()
+            LOG.warning("Tables are not prewarmed: {}".format(e).rstrip())
+
+    # With checkpoints, the database is only committed at checkpoints, so 
+    # an interrupted run leaves it as it was at the last checkpoint
+    def commit(self):
+        self.uncommittedNum += 1
+        if (config.checkpointInterval == 0 
+            and config.historyCommitInterval > 0 
+            and self.uncommittedNum >= config.historyCommitInterval):
+            self.flush()
+            self.conn.commit()
+            self.uncommittedNum = 0
+
+    def endDay(self):
+        if (config.checkpointInterval == 0 
+            and config.historyCommitInterval == 0 
+            and self.uncommittedNum > 0):
+            self.flush()
+            self.conn.commit()
+            self.uncommittedNum = 0
+
+    def checkpoint(self) -> dict:
+        self.flush()
+        if config.bulkLoad:
+            # the checkpoint file must not be ahead of the database
+            _executeWrapper(self.cur, "set local synchronous_commit = on")
+        self.conn.commit()
+        self.uncommittedNum = 0
+        return super().checkpoint()
+
+    def abort(self):
+        if not self.conn.closed:
+            self.conn.rollback()
+            self.conn.close()
+
+    def write(self, sql: str):
+        self.pendingSqls.append(sql)
+        self.pendingTables.add(_writtenTable(sql))
+        if len(self.pendingSqls) >= HISTORY_BATCH_STATEMENTS:
+            self.flush()
+
+    # Send all pending writes in one round trip
+    def flush(self):
+        if len(self.pendingSqls) == 0:
+            return
+        # statements of several transactions, so no scenario is recorded
+        _executeWrapper(self.cur, "\n".join(self.pendingSqls), "write batch")
+        self.pendingSqls = []
+        self.pendingTables = set()
+
+    def _read(self, sql: str, tables: tuple):
+        if not self.pendingTables.isdisjoint(tables):
+            self.flush()
+        _executeWrapper(self.cur, sql)
+
+    def selectKeyRanges(self) -> tuple:
+        selectKeyRangesSql = '''
+            select 
+                (select min(c_custkey) from customer),
+                (select max(c_custkey) from customer),
+                (select min(n_nationkey) from nation),
+                (select max(n_nationkey) from nation),
+                (select max(o_orderkey) from orders),
+                (select min(p_partkey) from part),
+                (select max(p_partkey) from part),
+                (select min(s_suppkey) from supplier),
+                (select max(s_suppkey) from supplier)
+        '''
+        _executeWrapper(self.cur, selectKeyRangesSql)
+        keyRanges = self.cur.fetchone()
+        self.conn.commit()
+        return keyRanges
+
+    def selectSuppkeys(self, partkey: int) -> list:
+        selectSuppkeySql = '''
+            select ps_suppkey 
+            from partsupp 
+            where ps_partkey = {}
+            order by ps_suppkey
+        '''.format(partkey)
+        self._read(selectSuppkeySql, ())
+        return [row[0] for row in self.cur.fetchall()]
+
+    def selectOrder(self, orderkey: int) -> tuple:
+        selectOrderSql = '''
+            select o_orderstatus, 
+                o_totalprice, 
+                o_custkey, 
+                o_receivable_time_begin, 
+                o_receivable_time_end, 
+                c_acctbal
+            from orders left join customer on o_custkey = c_custkey
+            where o_orderkey = {};
+        '''.format(orderkey)
+        self._read(selectOrderSql, ("orders", "customer"))
+        return self.cur.fetchone()
+
+    def selectLineitem(self, orderkey: int, linenumber: int) -> tuple:
+        selectLineitemSql = '''
+            select l_partkey, l_suppkey, l_quantity, l_linestatus
+            from lineitem
+            where l_orderkey = {} and l_linenumber = {};
+        '''.format(orderkey, linenumber)
+        self._read(selectLineitemSql, ("lineitem",))
+        return self.cur.fetchone()
+
+    def selectFLineitems(self, orderkey: int) -> list:
+        selectFLineitemPKsSql = '''
+            select l_partkey, l_suppkey, l_quantity
+            from lineitem
+            where l_orderkey = {} and l_linestatus = 'F'
+            order by l_partkey, l_suppkey, l_linenumber;
+        '''.format(orderkey)
+        self._read(selectFLineitemPKsSql, ("lineitem",))
+        return self.cur.fetchall()
+
+    def selectLineitems(self, orderkey: int) -> list:
+        selectFromLineitemSql = '''
+            select l_partkey, l_suppkey, l_linestatus, l_quantity
+            from lineitem
+            where l_orderkey = {}
+            order by l_partkey, l_suppkey, l_linenumber;
+        '''.format(orderkey)
+        self._read(selectFromLineitemSql, ("lineitem",))
+        return self.cur.fetchall()
+
+    def checkQTYCondition(self, partkey: int, suppkey: int, 
+                          quantity: Decimal) -> bool:
+        checkQTYConditionSql = '''
+            select (ps_availqty - {}) > 0
+            from partsupp
+            where ps_partkey = {} and ps_suppkey = {};
+        '''.format(quantity, partkey, suppkey)
+        self._read(checkQTYConditionSql, ("partsupp",))
+        return self.cur.fetchone()[0]
+
+    def checkAvailTimeCondition(self, partkey: int, currentTime: date) -> bool:
+        checkAvailTimeConditionSql = '''
+            select (date '{}' >= p_availablity_time_begin)
+                and (date '{}' <= p_availablity_time_end)
+            from part
+            where p_partkey = {};
+        '''.format(currentTime, currentTime, partkey)
+        self._read(checkAvailTimeConditionSql, ("part",))
+        return self.cur.fetchone()[0]
+
+    def selectLineitemPrices(self, orderkey: int) -> list:
+        selectFromLineitemSql = '''
+            select l_orderkey, l_partkey, l_suppkey, l_extendedprice
+            from lineitem
+            where l_orderkey = {}
+            order by l_partkey, l_suppkey, l_linenumber;
+        '''.format(orderkey)
+        self._read(selectFromLineitemSql, ("lineitem",))
+        return self.cur.fetchall()
+
+
+
+
+
+# Prepared transactions of checkpoints of history on a shard, named 
+# dbgen_checkpoint_<shard>_<checkpoint id>
+CHECKPOINT_GID_PREFIX = "dbgen_checkpoint_"
+def _preparedCheckpoints(cur: psycopg2.extensions.cursor) -> list:
+    cur.execute(
+        "select gid from pg_prepared_xacts "
+        "where database = current_database() and gid like %s", 
+        (CHECKPOINT_GID_PREFIX + "%",)
     )
+    return [row[0] for row in cur.fetchall()]
+
+# End prepared transactions of checkpoints, committing those whose id is at 
+# most `checkpointId` and rolling back the others
+def _finishPreparedCheckpoints(conn: psycopg2.extensions.connection, 
+                               checkpointId: int = -1):
+    conn.rollback()
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            for gid in _preparedCheckpoints(cur):
+                action = "commit" if int(gid.rsplit("_", 1)[1]) <= checkpointId \
+                    else "rollback"
+                _executeWrapper(cur, "{} prepared '{}'".format(action, gid))
+    finally:
+        conn.autocommit = False
+
+# History state over the shard databases of `config.shards`. Statements on 
+# orders and lineitem go to the shard owning their orderkey, writes of the 
+# replicated tables go to every shard, so the customer joined by an order 
+# is read from the shard of the order.
+# Every shard records the id of its last checkpoint in dbgen_checkpoint. 
+# If every shard allows prepared transactions, a checkpoint is prepared on 
+# all shards, the checkpoint file is saved, then the shards are committed, 
+# so a resumed run commits or rolls back what an interruption left 
+# prepared. Otherwise shards are committed one after another, and a 
+# resumed run refuses shards which are not at the checkpoint of the file.
+class ShardedHistoryState(HistoryState):
+
+    def __init__(self, connStrs: list):
+        super().__init__()
+        self.shards = [PostgresHistoryState(connStr) for connStr in connStrs]
+        self.lows = orderkeyBounds(len(connStrs))
+        self.checkpointId = 0
+        self.twoPhase = False
+
+    def shard(self, orderkey: int) -> PostgresHistoryState:
+        return self.shards[bisect(self.lows, orderkey)]
+
+    def _checkpointGid(self, shardIndex: int) -> str:
+        return "{}{}_{}".format(CHECKPOINT_GID_PREFIX, shardIndex, self.checkpointId)
+
+    def prepare(self, snapshot: dict = None):
+        if snapshot is not None:
+            self.checkpointId = snapshot["checkpointId"]
+        for i, shard in enumerate(self.shards):
+            # locks of prepared transactions would block the index builds
+            _finishPreparedCheckpoints(shard.conn, 
+                                       self.checkpointId if snapshot else -1)
+            _executeWrapper(shard.cur, "show max_prepared_transactions")
+            self.twoPhase = (self.twoPhase or i == 0) \
+                and int(shard.cur.fetchone()[0]) > 0
+            _executeWrapper(shard.cur, "create table if not exists dbgen_checkpoint (id integer)")
+            _executeWrapper(shard.cur, "select max(id) from dbgen_checkpoint")
+            shardCheckpointId = shard.cur.fetchone()[0]
+            if snapshot is None:
+                _executeWrapper(shard.cur, "delete from dbgen_checkpoint")
+                _executeWrapper(shard.cur, "insert into dbgen_checkpoint values (0)")
+            elif shardCheckpointId != self.checkpointId:
+                raise RuntimeError(
+                    "shard {} is at checkpoint {} but the checkpoint file is "
+                    "at checkpoint {}, the shards must be loaded again".format(
+                        i, shardCheckpointId, self.checkpointId
+                    )
+                )
+            shard.conn.commit()
+
+        for i, shard in enumerate(self.shards):
+            with TRACER.phase("shard {}".format(i)):
+                shard.prepareDatabase()
+
+        if snapshot is not None:
+            self.sampler = snapshot["sampler"]
+            return
+        for i, shard in enumerate(self.shards):
+            shard.fillSampler(self.sampler, replicated=(i == 0))
+
+    def cleanup(self):
+        for shard in self.shards:
+            shard.cleanup()
+
+    def commit(self):
+        for shard in self.shards:
+            shard.commit()
+
+    def endDay(self):
+        for shard in self.shards:
+            shard.endDay()
+
+    def checkpoint(self) -> dict:
+        # no shard is committed before all writes are accepted
+        for shard in self.shards:
+            shard.flush()
+        self.checkpointId += 1
+        for i, shard in enumerate(self.shards):
+            _executeWrapper(shard.cur, "update dbgen_checkpoint set id = {}".format(
+                self.checkpointId
+            ))
+            if self.twoPhase:
+                if config.bulkLoad:
+                    _executeWrapper(shard.cur, "set local synchronous_commit = on")
+                _executeWrapper(shard.cur, "prepare transaction '{}'".format(
+                    self._checkpointGid(i)
+                ))
+                # the prepared transaction has ended the one of the session
+                shard.conn.rollback()
+                shard.uncommittedNum = 0
+            else:
+                shard.checkpoint()
+        snapshot = super().checkpoint()
+        snapshot["checkpointId"] = self.checkpointId
+        return snapshot
 
-    currentTime = FROM_DATE
-    while totalUT < config.updateTimes:
+    def finishCheckpoint(self):
+        if self.twoPhase:
+            for shard in self.shards:
+                _finishPreparedCheckpoints(shard.conn, self.checkpointId)
+
+    def abort(self):
+        for shard in self.shards:
+            shard.abort()
+
+    # Tables other than orders and lineitem are replicated on every shard
+    def write(self, sql: str):
+        for shard in self.shards:
+            shard.write(sql)
+
+    # Writes of orders and lineitem go to the shard of their orderkey only
+    def insertOrder(self, sql: str, orderkey: int, custkey: int, status: str,
+                    totalprice: float, receivableTimeBegin: date,
+                    receivableTimeEnd: date):
+        self.sampler.addOrder(orderkey, custkey, status, totalprice, 
+                              receivableTimeBegin, receivableTimeEnd)
+        self.shard(orderkey).write(sql)
+
+    def deleteOrder(self, sql: str, orderkey: int):
+        self.sampler.removeOrder(orderkey)
+        self.shard(orderkey).write(sql)
+
+    def setOrderStatus(self, sql: str, orderkey: int, status: str, 
+                       receivableTimeEnd: date):
+        self.sampler.setOrderStatus(orderkey, status, receivableTimeEnd)
+        self.shard(orderkey).write(sql)
+
+    def setOrderReceivableTimeEnd(self, sql: str, orderkey: int, 
+                                  receivableTimeEnd: date):
+        self.sampler.setOrderReceivableTimeEnd(orderkey, receivableTimeEnd)
+        self.shard(orderkey).write(sql)
+
+    def setOrderTotalprice(self, sql: str, orderkey: int, totalprice: Decimal):
+        self.sampler.setOrderTotalprice(orderkey, totalprice)
+        self.shard(orderkey).write(sql)
+
+    def setOrderActiveTimeEnd(self, sql: str, orderkey: int, 
+                              activeTimeEnd: date):
+        self.shard(orderkey).write(sql)
+
+    def insertLineitem(self, sql: str, orderkey: int, partkey: int, 
+                       suppkey: int, linenumber: int, quantity: int, 
+                       extendedprice: float, linestatus: str):
+        self.sampler.addLineitem(orderkey, linenumber, linestatus)
+        self.shard(orderkey).write(sql)
+
+    def deleteLineitems(self, sql: str, orderkey: int, partkey: int, 
+                        suppkey: int):
+        self.shard(orderkey).write(sql)
+
+    def setLineitemStatus(self, sql: str, orderkey: int, partkey: int, 
+                          suppkey: int, linestatus: str):
+        self.shard(orderkey).write(sql)
+
+    def setLineitemExtendedprice(self, sql: str, orderkey: int, partkey: int, 
+                                 suppkey: int, extendedprice: Decimal):
+        self.shard(orderkey).write(sql)
+
+    def selectKeyRanges(self) -> tuple:
+        shardKeyRanges = [shard.selectKeyRanges() for shard in self.shards]
+        keyRanges = list(shardKeyRanges[0])
+        keyRanges[4] = max((shardKeyRange[4] for shardKeyRange in shardKeyRanges 
+                            if shardKeyRange[4] is not None), default=None)
+        return tuple(keyRanges)
+
+    def selectSuppkeys(self, partkey: int) -> list:
+        return self.shards[0].selectSuppkeys(partkey)
+
+    def selectOrder(self, orderkey: int) -> tuple:
+        return self.shard(orderkey).selectOrder(orderkey)
+
+    def selectLineitem(self, orderkey: int, linenumber: int) -> tuple:
+        return self.shard(orderkey).selectLineitem(orderkey, linenumber)
+
+    def selectFLineitems(self, orderkey: int) -> list:
+        return self.shard(orderkey).selectFLineitems(orderkey)
+
+    def selectLineitems(self, orderkey: int) -> list:
+        return self.shard(orderkey).selectLineitems(orderkey)
+
+    def checkQTYCondition(self, partkey: int, suppkey: int, 
+                          quantity: Decimal) -> bool:
+        return self.shards[0].checkQTYCondition(partkey, suppkey, quantity)
+
+    def checkAvailTimeCondition(self, partkey: int, currentTime: date) -> bool:
+        return self.shards[0].checkAvailTimeCondition(partkey, currentTime)
+
+    def selectLineitemPrices(self, orderkey: int) -> list:
+        return self.shard(orderkey).selectLineitemPrices(orderkey)
+
+
+
+
+
+# Utility for emulating PostgreSQL's arithmetic in `MemoryHistoryState`
+CENT = Decimal("0.01")
+def toNumeric(value) -> Decimal:
+    # The value of a literal `value` stored into a DECIMAL(15, 2) column
+    return Decimal(str(value)).quantize(CENT, rounding=ROUND_HALF_UP)
+
+def toInteger(value: Decimal) -> int:
+    # The value of a numeric `value` stored into an INTEGER column
+    return int(value.to_integral_value(rounding=ROUND_HALF_UP))
+
+
+
+
+
+# History state kept in memory. The V1 state read back by transactions 
+# is loaded once, then all probes and writes are answered in process with 
+# the same results PostgreSQL would return
+class MemoryHistoryState(HistoryState):
+
+    def __init__(self, connStr: str):
+        super().__init__()
+        self.connStr = connStr
+        self.keyRanges = None
+        # c_custkey -> c_acctbal
+        self.customerAcctbal = {}
+        # o_orderkey -> [o_custkey, o_orderstatus, o_totalprice, 
+        #                o_receivable_time_begin, o_receivable_time_end]
+        self.orders = {}
+        # l_orderkey -> [[l_linenumber, l_partkey, l_suppkey, l_quantity, 
+        #                 l_linestatus, l_extendedprice], ...]
+        self.lineitems = {}
+        # (ps_partkey, ps_suppkey) -> ps_availqty
+        self.partsuppAvailqty = {}
+        # ps_partkey -> sorted ps_suppkey
+        self.partSuppkeys = {}
+        # p_partkey -> [p_availablity_time_begin, p_availablity_time_end]
+        self.partAvailablity = {}
+
+    def prepare(self, snapshot: dict = None):
+        if snapshot is not None:
+            self.__dict__.update(snapshot)
+            return
+
+        conn = psycopg2.connect(self.connStr)
+        cur = conn.cursor()
+
+        selectKeyRangesSql = '''
+            select 
+                (select min(c_custkey) from customer),
+                (select max(c_custkey) from customer),
+                (select min(n_nationkey) from nation),
+                (select max(n_nationkey) from nation),
+                (select max(o_orderkey) from orders),
+                (select min(p_partkey) from part),
+                (select max(p_partkey) from part),
+                (select min(s_suppkey) from supplier),
+                (select max(s_suppkey) from supplier)
+        '''
+        _executeWrapper(cur, selectKeyRangesSql)
+        self.keyRanges = cur.fetchone()
+
+        selectCustomerSql = "select c_custkey, c_acctbal from customer"
+        for c_custkey, c_acctbal in _streamRows(conn, selectCustomerSql):
+            self.customerAcctbal[c_custkey] = c_acctbal
+            self.sampler.addCustomer(c_custkey, c_acctbal)
+
+        selectPartSql = '''
+            select p_partkey, p_availablity_time_begin, p_availablity_time_end
+            from part
+        '''
+        for p_partkey, begin, end in _streamRows(conn, selectPartSql):
+            self.partAvailablity[p_partkey] = [begin, end]
+
+        selectPartsuppSql = '''
+            select ps_partkey, ps_suppkey, ps_availqty
+            from partsupp
+            order by ps_partkey, ps_suppkey
+        '''
+        for ps_partkey, ps_suppkey, ps_availqty in _streamRows(
+            conn, selectPartsuppSql
+        ):
+            self.partsuppAvailqty[(ps_partkey, ps_suppkey)] = ps_availqty
+            self.partSuppkeys.setdefault(ps_partkey, []).append(ps_suppkey)
+            self.sampler.addPartsupp(ps_partkey, ps_suppkey)
+
+        selectOrdersSql = '''
+            select o_orderkey, o_custkey, o_orderstatus, o_totalprice, 
+                o_receivable_time_begin, o_receivable_time_end
+            from orders
+        '''
+        for o_orderkey, o_custkey, o_orderstatus, o_totalprice, \
+                o_receivable_time_begin, o_receivable_time_end \
+                in _streamRows(conn, selectOrdersSql):
+            self.orders[o_orderkey] = [o_custkey, 
+                                       o_orderstatus, 
+                                       o_totalprice, 
+                                       o_receivable_time_begin, 
+                                       o_receivable_time_end]
+            self.sampler.addOrder(o_orderkey, 
+                                  o_custkey, 
+                                  o_orderstatus, 
+                                  o_totalprice, 
+                                  o_receivable_time_begin, 
+                                  o_receivable_time_end)
+
+        selectLineitemSql = '''
+            select l_orderkey, l_linenumber, l_partkey, l_suppkey, 
+                l_quantity, l_linestatus, l_extendedprice
+            from lineitem
+            order by l_orderkey, l_linenumber
+        '''
+        for l_orderkey, *lineitem in _streamRows(conn, selectLineitemSql):
+            self.lineitems.setdefault(l_orderkey, []).append(lineitem)
+            self.sampler.addLineitem(l_orderkey, lineitem[0], lineitem[4])
+
+        conn.commit()
+        cur.close()
+        conn.close()
+
+    def _matchedLineitems(self, orderkey: int, partkey: int, suppkey: int):
+        return [lineitem for lineitem in self.lineitems.get(orderkey, ())
+                if lineitem[1] == partkey and lineitem[2] == suppkey]
+
+    def _sortedLineitems(self, orderkey: int) -> list:
+        # Same order as "order by l_partkey, l_suppkey, l_linenumber"
+        return sorted(self.lineitems.get(orderkey, ()), 
+                      key=lambda lineitem: (lineitem[1], lineitem[2], 
+                                            lineitem[0]))
+
+    def write(self, sql: str):
+        pass
+
+    def checkpoint(self) -> dict:
+        snapshot = dict(self.__dict__)
+        del snapshot["connStr"]
+        return snapshot
+
+    def selectKeyRanges(self) -> tuple:
+        return self.keyRanges
+
+    def selectSuppkeys(self, partkey: int) -> list:
+        return list(self.partSuppkeys.get(partkey, ()))
+
+    def selectOrder(self, orderkey: int) -> tuple:
+        order = self.orders.get(orderkey)
+        if order is None:
+            return None
+        o_custkey, o_orderstatus, o_totalprice, o_receivable_time_begin, \
+            o_receivable_time_end = order
+        return (o_orderstatus, 
+                o_totalprice, 
+                o_custkey, 
+                o_receivable_time_begin, 
+                o_receivable_time_end, 
+                self.customerAcctbal.get(o_custkey))
+
+    def selectLineitem(self, orderkey: int, linenumber: int) -> tuple:
+        for l_linenumber, l_partkey, l_suppkey, l_quantity, l_linestatus, _ \
+                in self.lineitems.get(orderkey, ()):
+            if l_linenumber == linenumber:
+                return l_partkey, l_suppkey, l_quantity, l_linestatus
+        return None
+
+    def selectFLineitems(self, orderkey: int) -> list:
+        return [(l_partkey, l_suppkey, l_quantity) 
+                for _, l_partkey, l_suppkey, l_quantity, l_linestatus, _ 
+                in self._sortedLineitems(orderkey) if l_linestatus == "F"]
+
+    def selectLineitems(self, orderkey: int) -> list:
+        return [(l_partkey, l_suppkey, l_linestatus, l_quantity) 
+                for _, l_partkey, l_suppkey, l_quantity, l_linestatus, _ 
+                in self._sortedLineitems(orderkey)]
+
+    def checkQTYCondition(self, partkey: int, suppkey: int, 
+                          quantity: Decimal) -> bool:
+        return self.partsuppAvailqty[(partkey, suppkey)] - quantity > 0
+
+    def checkAvailTimeCondition(self, partkey: int, currentTime: date) -> bool:
+        begin, end = self.partAvailablity[partkey]
+        return begin <= currentTime <= end
+
+    def selectLineitemPrices(self, orderkey: int) -> list:
+        return [(orderkey, l_partkey, l_suppkey, l_extendedprice) 
+                for _, l_partkey, l_suppkey, _, _, l_extendedprice 
+                in self._sortedLineitems(orderkey)]
+
+    def insertCustomer(self, sql: str, custkey: int):
+        super().insertCustomer(sql, custkey)
+        self.customerAcctbal[custkey] = toNumeric(0)
+
+    def addCustomerAcctbal(self, sql: str, custkey: int, amount: Decimal):
+        super().addCustomerAcctbal(sql, custkey, amount)
+        self.customerAcctbal[custkey] = toNumeric(
+            self.customerAcctbal[custkey] + amount
+        )
+
+    def insertOrder(self, sql: str, orderkey: int, custkey: int, status: str,
+                    totalprice: float, receivableTimeBegin: date,
+                    receivableTimeEnd: date):
+        super().insertOrder(sql, orderkey, custkey, status, totalprice, 
+                            receivableTimeBegin, receivableTimeEnd)
+        self.orders[orderkey] = [custkey, status, toNumeric(totalprice), 
+                                 receivableTimeBegin, receivableTimeEnd]
+
+    def deleteOrder(self, sql: str, orderkey: int):
+        super().deleteOrder(sql, orderkey)
+        self.orders.pop(orderkey, None)
+
+    def setOrderStatus(self, sql: str, orderkey: int, status: str, 
+                       receivableTimeEnd: date):
+        super().setOrderStatus(sql, orderkey, status, receivableTimeEnd)
+        self.orders[orderkey][1] = status
+
+    def setOrderReceivableTimeEnd(self, sql: str, orderkey: int, 
+                                  receivableTimeEnd: date):
+        super().setOrderReceivableTimeEnd(sql, orderkey, receivableTimeEnd)
+        self.orders[orderkey][4] = receivableTimeEnd
+
+    def setOrderTotalprice(self, sql: str, orderkey: int, totalprice: Decimal):
+        super().setOrderTotalprice(sql, orderkey, totalprice)
+        self.orders[orderkey][2] = toNumeric(totalprice)
+
+    def insertLineitem(self, sql: str, orderkey: int, partkey: int, 
+                       suppkey: int, linenumber: int, quantity: int, 
+                       extendedprice: float, linestatus: str):
+        super().insertLineitem(sql, orderkey, partkey, suppkey, linenumber, 
+                               quantity, extendedprice, linestatus)
+        self.lineitems.setdefault(orderkey, []).append([
+            linenumber, partkey, suppkey, toNumeric(quantity), linestatus, 
+            toNumeric(extendedprice)
+        ])
+
+    def deleteLineitems(self, sql: str, orderkey: int, partkey: int, 
+                        suppkey: int):
+        super().deleteLineitems(sql, orderkey, partkey, suppkey)
+        lineitems = [lineitem for lineitem in self.lineitems.get(orderkey, ())
+                     if lineitem[1] != partkey or lineitem[2] != suppkey]
+        if len(lineitems) > 0:
+            self.lineitems[orderkey] = lineitems
+        else:
+            self.lineitems.pop(orderkey, None)
+
+    def setLineitemStatus(self, sql: str, orderkey: int, partkey: int, 
+                          suppkey: int, linestatus: str):
+        super().setLineitemStatus(sql, orderkey, partkey, suppkey, linestatus)
+        for lineitem in self._matchedLineitems(orderkey, partkey, suppkey):
+            lineitem[4] = linestatus
+
+    def setLineitemExtendedprice(self, sql: str, orderkey: int, partkey: int, 
+                                 suppkey: int, extendedprice: Decimal):
+        super().setLineitemExtendedprice(sql, orderkey, partkey, suppkey, 
+                                         extendedprice)
+        for lineitem in self._matchedLineitems(orderkey, partkey, suppkey):
+            lineitem[5] = toNumeric(extendedprice)
+
+    def addPartsuppAvailqty(self, sql: str, partkey: int, suppkey: int, 
+                            amount: Decimal):
+        super().addPartsuppAvailqty(sql, partkey, suppkey, amount)
+        self.partsuppAvailqty[(partkey, suppkey)] = toInteger(
+            self.partsuppAvailqty[(partkey, suppkey)] + amount
+        )
+
+    def setPartAvailablity(self, sql: str, partkey: int, begin: date, 
+                           end: date):
+        super().setPartAvailablity(sql, partkey, begin, end)
+        self.partAvailablity[partkey] = [begin, end]
+
+
+
+
+
+# Schedule of history, the day and the scenario probability of every 
+# transaction. Transactions of a day are decided by Bernoulli trials of 
+# `UPDATE_P_RAND` against the expected transactions left for the day, the 
+# scenario of a transaction is drawn by `UPDATE_SCENARIO_P_RAND`. With the 
+# same `avgUTPerDay`, a shorter schedule is a prefix of a longer one, so 
+# an extended history keeps the days of the transactions it extends.
+def buildSchedule(updateTimes: int, avgUTPerDay: float = None) -> tuple:
+    days = array("l")
+    scenarios = array("d")
+    if avgUTPerDay is None:
+        avgUTPerDay = updateTimes / (TO_DATE - FROM_DATE).days
+    currentUT = avgUTPerDay
+    currentDay = FROM_DATE.toordinal()
+    if config.counterBasedRandom:
+        seedDay(FROM_DATE)
+    while len(days) < updateTimes:
         if UPDATE_P_RAND.random() < currentUT:
-            p = UPDATE_SCENARIO_P_RAND.random()
+            if config.counterBasedRandom:
+                seedScenario(len(days))
+            days.append(currentDay)
+            scenarios.append(UPDATE_SCENARIO_P_RAND.random())
+            currentUT -= 1
+        else:
+            currentUT += avgUTPerDay
+            currentDay += 1
+            if config.counterBasedRandom:
+                seedDay(date.fromordinal(currentDay))
+    return days, scenarios
+
+# Schedule of history with `config.poissonSchedule`, transactions arrive 
+# as a Poisson process of `avgUTPerDay` transactions a day. The gaps 
+# between transactions are drawn by `UPDATE_P_RAND` in one pass without 
+# visiting the days between them, and the days are the floors of the 
+# accumulated gaps. It is a different schedule from `buildSchedule` of 
+# the same rate, and a shorter schedule is also a prefix of a longer one.
+def buildPoissonSchedule(updateTimes: int, avgUTPerDay: float = None) -> tuple:
+    if avgUTPerDay is None:
+        avgUTPerDay = updateTimes / (TO_DATE - FROM_DATE).days
+    if config.counterBasedRandom:
+        seedDay(FROM_DATE)
+    fromDay = FROM_DATE.toordinal()
+    days = array("l", (fromDay + int(time) for time in accumulate(
+        UPDATE_P_RAND.expovariate(avgUTPerDay) for _ in range(updateTimes)
+    )))
+    if config.counterBasedRandom:
+        scenarios = array("d")
+        for index in range(updateTimes):
+            seedScenario(index)
+            scenarios.append(UPDATE_SCENARIO_P_RAND.random())
+    else:
+        scenarios = array("d", (UPDATE_SCENARIO_P_RAND.random() 
+                                for _ in range(updateTimes)))
+    return days, scenarios
+
+# A schedule file has a header of the options it was built with, then a 
+# line of the day ordinal and the scenario probability of every 
+# transaction
+SCHEDULE_VERSION = 2
+def _scheduleHeader(updateTimes: int, avgUTPerDay: float) -> str:
+    return ("# version={} updateTimes={} avgUTPerDay={!r} "
+            "counterBasedRandom={} poissonSchedule={}\n").format(
+        SCHEDULE_VERSION, updateTimes, avgUTPerDay, config.counterBasedRandom, 
+        config.poissonSchedule
+    )
+
+def saveSchedule(path: Path, days: array, scenarios: array, 
+                 avgUTPerDay: float):
+    with open(path, "w", buffering=COPY_BUFFER_SIZE) as scheduleFile:
+        scheduleFile.write(_scheduleHeader(len(days), avgUTPerDay))
+        scheduleFile.writelines("{}|{}\n".format(day, p) 
+                                for day, p in zip(days, scenarios))
+
+# Schedule cached in `path`, None if it is missing or made for other options
+def loadSchedule(path: Path, updateTimes: int, avgUTPerDay: float) -> tuple:
+    if not path.exists():
+        return None
+    days = array("l")
+    scenarios = array("d")
+    with open(path, buffering=COPY_BUFFER_SIZE) as scheduleFile:
+        if scheduleFile.readline() != _scheduleHeader(updateTimes, avgUTPerDay):
+            return None
+        for line in scheduleFile:
+            day, p = line.split("|")
+            days.append(int(day))
+            scenarios.append(float(p))
+    return days, scenarios
+
+def prepareSchedule(updateTimes: int, avgUTPerDay: float) -> tuple:
+    build = buildPoissonSchedule if config.poissonSchedule else buildSchedule
+    if config.scheduleFile == "":
+        return build(updateTimes, avgUTPerDay)
+    path = Path(config.scheduleFile)
+    schedule = loadSchedule(path, updateTimes, avgUTPerDay)
+    if schedule is None:
+        schedule = build(updateTimes, avgUTPerDay)
+        saveSchedule(path, *schedule, avgUTPerDay)
+    else:
+        LOG.info("Reuse schedule in {}".format(path))
+    return schedule
+
+# Checkpoint of history generation, everything needed to continue an 
+# interrupted run and write the same history.sql. It is replaced 
+# atomically every `config.checkpointInterval` transactions. The state at 
+# the end of a run is kept in the same form with 
+# `config.keepHistoryState`, so the history can be extended later.
+CHECKPOINT_VERSION = 1
+def _checkpointPath() -> Path:
+    return Path(config.destPath) / "history.checkpoint"
+
+def _historyStatePath() -> Path:
+    return Path(config.destPath) / "history.state"
+
+# Options which must be the same to continue from a checkpoint
+def _checkpointOptions() -> dict:
+    return {
+        "version": CHECKPOINT_VERSION, 
+        "inMemoryHistory": config.inMemoryHistory, 
+        "compatibleComments": config.compatibleComments, 
+        "counterBasedRandom": config.counterBasedRandom, 
+        "poissonSchedule": config.poissonSchedule
+    }
+
+def _randomStates() -> tuple:
+    return tuple(rand.getstate() for rand in (
+        UPDATE_P_RAND, UPDATE_SCENARIO_P_RAND, UNIFORM_RAND, 
+        TABLE_SAMPLE_SEED_RAND
+    ))
+
+def _setRandomStates(states: tuple):
+    for rand, randState in zip((UPDATE_P_RAND, UPDATE_SCENARIO_P_RAND, 
+                                UNIFORM_RAND, TABLE_SAMPLE_SEED_RAND), states):
+        rand.setstate(randState)
+
+def saveCheckpoint(checkpoint: dict, path: Path = None):
+    if path is None:
+        path = _checkpointPath()
+    tmpPath = path.with_name(path.name + ".tmp")
+    with open(tmpPath, "wb") as checkpointFile:
+        pickle.dump(checkpoint, checkpointFile, pickle.HIGHEST_PROTOCOL)
+        checkpointFile.flush()
+        os.fsync(checkpointFile.fileno())
+    os.replace(tmpPath, path)
+
+def loadCheckpoint(path: Path = None) -> dict:
+    if path is None:
+        path = _checkpointPath()
+    with open(path, "rb") as checkpointFile:
+        checkpoint = pickle.load(checkpointFile)
+    if checkpoint["options"] != _checkpointOptions():
+        raise ValueError(
+            "checkpoint was written with options {}".format(
+                checkpoint["options"]
+            )
+        )
+    return checkpoint
+
+# Generate history from V1 data, continue it from its last checkpoint with 
+# `resume`, or append `extendTimes` transactions to a kept history
+def generataHistory(connStr: str, resume: bool = False, extendTimes: int = 0):
+    if resume:
+        checkpoint = loadCheckpoint()
+        updateTimes = checkpoint["updateTimes"]
+    elif extendTimes > 0:
+        checkpoint = loadCheckpoint(_historyStatePath())
+        updateTimes = checkpoint["totalUT"] + extendTimes
+        LOG.info("Extend history from {} to {} transactions".format(
+            checkpoint["totalUT"], updateTimes
+        ))
+    else:
+        checkpoint = None
+        updateTimes = config.updateTimes
+    if config.inMemoryHistory:
+        state = MemoryHistoryState(connStr)
+    elif len(config.shards) > 0:
+        state = ShardedHistoryState(config.shards)
+    else:
+        state = PostgresHistoryState(connStr)
+    historySqlPath = Path(config.destPath) / "history.sql"
+    if checkpoint is None:
+        historySqlFile = historySqlPath.open(mode="+w", buffering=1048576)
+    else:
+        # Continue after the last transaction of the checkpoint
+        historySqlFile = historySqlPath.open(mode="r+", buffering=1048576)
+        historySqlFile.truncate(checkpoint["historyOffset"])
+        historySqlFile.seek(checkpoint["historyOffset"])
+    try:
+        with TRACER.phase("generate") as phase:
+            phase["rows"] = _generateTransactions(
+                state, checkpoint, historySqlFile, updateTimes
+            )
+    except BaseException:
+        # Leave the database as it was at the last checkpoint
+        state.abort()
+        raise
+    finally:
+        historySqlFile.close()
+
+    with TRACER.phase("cleanup"):
+        state.cleanup()
+    if _checkpointPath().exists():
+        _checkpointPath().unlink()
+
+# Scenarios of transactions by their probability `p`
+SCENARIO_BOUNDS = (0.3, 0.4, 0.6, 0.8, 0.85, 0.9, 0.95, 0.999)
+SCENARIO_NAMES = ("new order", "cancel order", "deliver order", 
+                  "receive payment", "update stock", "delay availablity", 
+                  "change price", "update supplier", "manipulate order")
+
+# Progress of history logged every `config.progressInterval` seconds and 
+# written to `config.metricsFile` in the text format of Prometheus. The 
+# average rate is an exponential moving average of the rates of intervals.
+PROGRESS_RATE_WEIGHT = 0.3
+class ProgressReporter:
+
+    def __init__(self, updateTimes: int, totalUT: int):
+        self.updateTimes = updateTimes
+        self.scenarioCounts = [0] * len(SCENARIO_NAMES)
+        self.lastTime = perf_counter()
+        self.lastUT = totalUT
+        self.averageRate = None
+
+    def update(self, totalUT: int, currentTime: date, scenario: int):
+        self.scenarioCounts[scenario] += 1
+        if config.progressInterval > 0:
+            now = perf_counter()
+            if now - self.lastTime >= config.progressInterval:
+                self.report(totalUT, currentTime, now)
+
+    def report(self, totalUT: int, currentTime: date, now: float):
+        rate = (totalUT - self.lastUT) / max(now - self.lastTime, 1e-6)
+        if self.averageRate is None:
+            self.averageRate = rate
+        else:
+            self.averageRate = PROGRESS_RATE_WEIGHT * rate \
+                + (1 - PROGRESS_RATE_WEIGHT) * self.averageRate
+        self.lastTime = now
+        self.lastUT = totalUT
+        remaining = self.updateTimes - totalUT
+        eta = remaining / self.averageRate if self.averageRate > 0 else float("inf")
+        if config.progressInterval > 0:
+            LOG.info("History {}/{} ({:.1f}%) at {}: {:.0f} tx/s, {:.0f} tx/s average, ETA {}".format(
+                totalUT, self.updateTimes, 100 * totalUT / self.updateTimes, 
+                currentTime, rate, self.averageRate, 
+                timedelta(seconds=round(eta)) if eta != float("inf") else "unknown"
+            ))
+            LOG.info("Transactions by scenario: {}".format(", ".join(
+                "{} {}".format(name, count) 
+                for name, count in zip(SCENARIO_NAMES, self.scenarioCounts)
+            )))
+        if config.metricsFile != "":
+            self.writeMetrics(totalUT, currentTime, rate, eta)
+
+    def writeMetrics(self, totalUT: int, currentTime: date, rate: float, 
+                     eta: float):
+        simulatedDate = datetime(currentTime.year, currentTime.month, 
+                                 currentTime.day).timestamp()
+        metrics = (
+            ("dbgen_history_transactions_total", "counter", 
+             "Transactions of history generated.", totalUT), 
+            ("dbgen_history_target_transactions", "gauge", 
+             "Transactions of history to generate.", self.updateTimes), 
+            ("dbgen_history_simulated_date_seconds", "gauge", 
+             "Simulated date of history as a Unix timestamp.", simulatedDate), 
+            ("dbgen_history_rate", "gauge", 
+             "Transactions per second of the last interval.", rate), 
+            ("dbgen_history_average_rate", "gauge", 
+             "Moving average of transactions per second.", self.averageRate), 
+            ("dbgen_history_eta_seconds", "gauge", 
+             "Estimated seconds until history is generated.", eta), 
+            ("dbgen_history_last_progress_seconds", "gauge", 
+             "Unix timestamp of the last progress report.", datetime.now().timestamp())
+        )
+        lines = []
+        for name, metricType, description, value in metrics:
+            lines.append("# HELP {} {}".format(name, description))
+            lines.append("# TYPE {} {}".format(name, metricType))
+            lines.append("{} {}".format(name, value if value != float("inf") else "+Inf"))
+        lines.append("# HELP dbgen_history_scenario_transactions_total "
+                     "Transactions of every scenario generated by this run.")
+        lines.append("# TYPE dbgen_history_scenario_transactions_total counter")
+        for name, count in zip(SCENARIO_NAMES, self.scenarioCounts):
+            lines.append('dbgen_history_scenario_transactions_total{{scenario="{}"}} {}'.format(
+                name, count
+            ))
+        # Replace the file at once, so collectors never read half of it
+        path = Path(config.metricsFile)
+        tmpPath = path.with_name(path.name + ".tmp")
+        with open(tmpPath, "w") as metricsFile:
+            metricsFile.write("\n".join(lines) + "\n")
+        os.replace(tmpPath, path)
+
+# Generate transactions until `updateTimes`, return the number of 
+# transactions generated
+def _generateTransactions(state: HistoryState, checkpoint: dict, 
+                          historySqlFile, updateTimes: int) -> int:
+    with TRACER.phase("prepare"):
+        state.prepare(None if checkpoint is None else checkpoint["state"])
+
+    oneDay = timedelta(days=1)
+    if checkpoint is None:
+        avgUTPerDay = updateTimes / (TO_DATE - FROM_DATE).days
+    else:
+        avgUTPerDay = checkpoint["avgUTPerDay"]
+        _setRandomStates(checkpoint["scheduleRandomStates"])
+    scheduleRandomStates = _randomStates()
+    scheduleDays, scheduleScenarios = prepareSchedule(updateTimes, avgUTPerDay)
+    totalUT = 0
+
+    (minCustkey, maxCustkey, minNationkey, maxNationkey, maxOrderkey, 
+     minPartkey, maxPartkey, minSuppkey, maxSuppkey) = state.selectKeyRanges()
+
+    currentTime = FROM_DATE
+    if checkpoint is not None:
+        _setRandomStates(checkpoint["randomStates"])
+        totalUT = checkpoint["totalUT"]
+        currentTime = checkpoint["currentTime"]
+        (minCustkey, maxCustkey, minNationkey, maxNationkey, maxOrderkey, 
+         minPartkey, maxPartkey, minSuppkey, maxSuppkey) = checkpoint["keyRanges"]
+        LOG.info("Continue history from transaction {}".format(totalUT))
+
+    def makeCheckpoint() -> dict:
+        stateSnapshot = state.checkpoint()
+        historySqlFile.flush()
+        os.fsync(historySqlFile.fileno())
+        return {
+            "options": _checkpointOptions(), 
+            "state": stateSnapshot, 
+            "updateTimes": updateTimes, 
+            "avgUTPerDay": avgUTPerDay, 
+            "scheduleRandomStates": scheduleRandomStates, 
+            "randomStates": _randomStates(), 
+            "totalUT": totalUT, 
+            "currentTime": currentTime, 
+            "keyRanges": (minCustkey, maxCustkey, minNationkey, 
+                          maxNationkey, maxOrderkey, minPartkey, 
+                          maxPartkey, minSuppkey, maxSuppkey), 
+            "historyOffset": historySqlFile.tell()
+        }
+
+    progress = ProgressReporter(updateTimes, totalUT)
+    while totalUT < updateTimes:
+        if scheduleDays[totalUT] == currentTime.toordinal():
+            if config.counterBasedRandom:
+                seedTransaction(totalUT)
+            p = scheduleScenarios[totalUT]
+            scenario = bisect(SCENARIO_BOUNDS, p)
+            if SQL_PROFILE or SQL_EXPLAIN_THRESHOLD > 0:
+                PROFILER.scenario = SCENARIO_NAMES[scenario]
+                transactionSt = perf_counter_ns()
 
             # New order
             if 0 <= p < 0.3: 
@@ -686,7 +3642,7 @@ def generataHistory(connStr: str):
                         c_phone, 
                         c_custkey
                     )
-                    _executeWrapper(cur, updateCustomerDataSql)
+                    state.write(updateCustomerDataSql)
                     newOrderHistorySqls.append(updateCustomerDataSql)
 
                     
@@ -733,7 +3689,7 @@ def generataHistory(connStr: str):
                                c_comment, 
                                c_active_time_begin, 
                                c_active_time_end)
-                    _executeWrapper(cur, insertNewCustomerSql)
+                    state.insertCustomer(insertNewCustomerSql, c_custkey)
                     newOrderHistorySqls.append(insertNewCustomerSql)
                 
                 # Insert new order
@@ -750,13 +3706,7 @@ def generataHistory(connStr: str):
                     l_partkey = UNIFORM_RAND.randint(minPartkey, maxPartkey)
 
                     # Randomly choose one supplier of part with "l_partkey"
-                    selectSuppkeySql = '''
-                        select ps_suppkey 
-                        from partsupp 
-                        where ps_partkey = {}
-                    '''.format(l_partkey)
-                    _executeWrapper(cur, selectSuppkeySql)
-                    l_suppkey = UNIFORM_RAND.choice(cur.fetchall())[0]
+                    l_suppkey = UNIFORM_RAND.choice(state.selectSuppkeys(l_partkey))
 
                     l_quantity = UNIFORM_RAND.randint(1,50)
                     l_discount = UNIFORM_RAND.randint(0, 10) / 100
@@ -765,8 +3715,9 @@ def generataHistory(connStr: str):
                                        + ((l_partkey / 10) % 20001) 
                                        + ((l_partkey % 1000) * 100)) * l_quantity
                     l_shipdate = currentTime
+                    # Extended history may go beyond `TO_DATE`
                     l_commitdate = l_shipdate + UNIFORM_RAND.randint(
-                        0,(TO_DATE - l_shipdate).days
+                        0, max(0, (TO_DATE - l_shipdate).days)
                     ) * oneDay
                     l_receiptdate = MAX_DATE
                     l_returnflag = "N"
@@ -819,7 +3770,14 @@ def generataHistory(connStr: str):
                                l_active_time_begin, 
                                l_active_time_end)
                     o_totalprice += l_extendedprice * (1 - l_discount) * (1 + l_tax)
-                    _executeWrapper(cur, insertLineitemSql)
+                    state.insertLineitem(insertLineitemSql, 
+                                         l_orderkey, 
+                                         l_partkey, 
+                                         l_suppkey, 
+                                         l_linenumber, 
+                                         l_quantity, 
+                                         l_extendedprice, 
+                                         l_linestatus)
                     newOrderHistorySqls.append(insertLineitemSql)
 
                 o_orderdate = currentTime
@@ -863,10 +3821,16 @@ def generataHistory(connStr: str):
                            o_active_time_end,
                            o_receivable_time_begin, 
                            o_receivable_time_end)
-                _executeWrapper(cur, insertNewOrderSql)
+                state.insertOrder(insertNewOrderSql, 
+                                  o_orderkey, 
+                                  o_custkey, 
+                                  o_orderstatus, 
+                                  o_totalprice, 
+                                  o_receivable_time_begin, 
+                                  o_receivable_time_end)
                 newOrderHistorySqls.append(insertNewOrderSql)
                 
-                conn.commit()
+                state.commit()
                 historySqlFile.write("\n")
                 historySqlFile.write("\n".join(newOrderHistorySqls))
                 historySqlFile.write("\n")
@@ -876,53 +3840,50 @@ def generataHistory(connStr: str):
                 cancelOrderHistorySql = []
 
                 # Uniformly select one order with non 'F' status
-                selectCancelOrderSql = '''
-                    select o_orderkey, o_orderstatus, o_custkey, o_totalprice
-                    from orders tablesample bernoulli (100) repeatable ({})
-                    where o_orderstatus != 'F'
-                    limit 1
-                '''.format(TABLE_SAMPLE_SEED_RAND.random())
-                _executeWrapper(cur, selectCancelOrderSql)
-                o_orderkey, o_orderstatus, o_custkey, o_totalprice = cur.fetchone()
-                if o_orderstatus == "P":
-                    updateCustomerAcctbalSql = '''
-                        update customer 
-                        set c_acctbal = c_acctbal + {} 
-                        where c_custkey = {};
-                    '''.format(o_totalprice, o_custkey)
-                    _executeWrapper(cur, updateCustomerAcctbalSql)
-                    cancelOrderHistorySql.append(updateCustomerAcctbalSql)
-                l_orderkey = o_orderkey
-                selectFLineitemPKsSql = '''
-                    select l_partkey, l_suppkey, l_quantity
-                    from lineitem
-                    where l_orderkey = {} and l_linestatus = 'F';
-                '''.format(l_orderkey)
-                _executeWrapper(cur, selectFLineitemPKsSql)
-                for l_partkey, l_suppkey, l_quantity in cur.fetchall():
-                    updatePartsuppAvailqtySql = '''
-                        update partsupp
-                        set ps_availqty = ps_availqty + {}
-                        where ps_partkey = {} and ps_suppkey = {};
-                    '''.format(l_quantity, l_partkey, l_suppkey)
-                    deleteFromLineitemSql = '''
-                        delete from lineitem
-                        where l_orderkey = {}
-                            and l_partkey = {}
-                            and l_suppkey = {};
-                    '''.format(l_orderkey, l_partkey, l_suppkey)
-                    _executeWrapper(cur, updatePartsuppAvailqtySql)
-                    cancelOrderHistorySql.append(updatePartsuppAvailqtySql)
-                    _executeWrapper(cur, deleteFromLineitemSql)
-                    cancelOrderHistorySql.append(deleteFromLineitemSql)
-                deleteFromOrdersSql = '''
-                    delete from orders 
-                    where o_orderkey = {};
-                '''.format(o_orderkey)
-                _executeWrapper(cur, deleteFromOrdersSql)
-                cancelOrderHistorySql.append(deleteFromOrdersSql)
+                cancelOrder = state.sampleCancelOrder(TABLE_SAMPLE_SEED_RAND)
+                if cancelOrder is not None:
+                    o_orderkey, o_orderstatus, o_custkey, o_totalprice = cancelOrder
+                    if o_orderstatus == "P":
+                        updateCustomerAcctbalSql = '''
+                            update customer 
+                            set c_acctbal = c_acctbal + {} 
+                            where c_custkey = {};
+                        '''.format(o_totalprice, o_custkey)
+                        state.addCustomerAcctbal(updateCustomerAcctbalSql, 
+                                                 o_custkey, 
+                                                 o_totalprice)
+                        cancelOrderHistorySql.append(updateCustomerAcctbalSql)
+                    l_orderkey = o_orderkey
+                    for l_partkey, l_suppkey, l_quantity in state.selectFLineitems(l_orderkey):
+                        updatePartsuppAvailqtySql = '''
+                            update partsupp
+                            set ps_availqty = ps_availqty + {}
+                            where ps_partkey = {} and ps_suppkey = {};
+                        '''.format(l_quantity, l_partkey, l_suppkey)
+                        deleteFromLineitemSql = '''
+                            delete from lineitem
+                            where l_orderkey = {}
+                                and l_partkey = {}
+                                and l_suppkey = {};
+                        '''.format(l_orderkey, l_partkey, l_suppkey)
+                        state.addPartsuppAvailqty(updatePartsuppAvailqtySql, 
+                                                  l_partkey, 
+                                                  l_suppkey, 
+                                                  l_quantity)
+                        cancelOrderHistorySql.append(updatePartsuppAvailqtySql)
+                        state.deleteLineitems(deleteFromLineitemSql, 
+                                              l_orderkey, 
+                                              l_partkey, 
+                                              l_suppkey)
+                        cancelOrderHistorySql.append(deleteFromLineitemSql)
+                    deleteFromOrdersSql = '''
+                        delete from orders 
+                        where o_orderkey = {};
+                    '''.format(o_orderkey)
+                    state.deleteOrder(deleteFromOrdersSql, o_orderkey)
+                    cancelOrderHistorySql.append(deleteFromOrdersSql)
 
-                conn.commit()
+                state.commit()
                 historySqlFile.write("\n")
                 historySqlFile.write("\n".join(cancelOrderHistorySql))
                 historySqlFile.write("\n")
@@ -931,35 +3892,7 @@ def generataHistory(connStr: str):
             elif 0.4 <= p < 0.6:
                 deliverOrderHistorySqls = []
 
-                # Here we use as the same sampling strategy as we do 
-                # in "Uniformly select one order with non 'F' status"
-                SelectDeliverOrderSqlTemplate = '''
-                    select o_orderkey, 
-                        o_orderstatus, 
-                        o_totalprice, 
-                        o_custkey, 
-                        o_receivable_time_begin, 
-                        o_receivable_time_end
-                    from customer inner join (
-                        select o_orderkey, 
-                            o_orderstatus, 
-                            o_totalprice, 
-                            o_custkey, 
-                            o_receivable_time_begin, 
-                            o_receivable_time_end
-                        from orders tablesample bernoulli (100) repeatable ({})
-                        limit 1000
-                    ) as sampled_orders on o_custkey = c_custkey
-                    where (o_orderstatus = 'O' and c_acctbal - o_totalprice >= 0)
-                        or (o_orderstatus = 'P')
-                '''
-                orderRow = ()
-                while (len(orderRow) == 0):
-                    SelectDeliverOrderSql = SelectDeliverOrderSqlTemplate.format(
-                        TABLE_SAMPLE_SEED_RAND.random()
-                    )
-                    _executeWrapper(cur, SelectDeliverOrderSql)
-                    orderRow = UNIFORM_RAND.choice(cur.fetchall())
+                orderRow = state.sampleDeliverOrder(TABLE_SAMPLE_SEED_RAND)
                 o_orderkey, o_orderstatus, o_totalprice, o_custkey, o_receivable_time_begin, o_receivable_time_end = orderRow
                 if o_orderstatus == 'O':
                     updateCustomerAcctbalSql = '''
@@ -972,42 +3905,32 @@ def generataHistory(connStr: str):
                         set o_orderstatus = 'P'
                         where o_orderkey = {};
                     '''.format(o_orderkey)
-                    _executeWrapper(cur, updateCustomerAcctbalSql)
+                    state.addCustomerAcctbal(updateCustomerAcctbalSql, 
+                                             o_custkey, 
+                                             -o_totalprice)
                     deliverOrderHistorySqls.append(updateCustomerAcctbalSql)
-                    _executeWrapper(cur, updateOrderStatusSql)
+                    state.setOrderStatus(updateOrderStatusSql, 
+                                         o_orderkey, 
+                                         'P', 
+                                         o_receivable_time_end)
                     deliverOrderHistorySqls.append(updateOrderStatusSql)
 
                 l_orderkey = o_orderkey
-                selectFromLineitemSql = '''
-                    select l_partkey, l_suppkey, l_linestatus, l_quantity
-                    from lineitem
-                    where l_orderkey = {};
-                '''.format(l_orderkey)
-                _executeWrapper(cur, selectFromLineitemSql)
-                lineitems = cur.fetchall()
+                lineitems = state.selectLineitems(l_orderkey)
                 isAllFStatus = True
                 for l_partkey, l_suppkey, l_linestatus, l_quantity in lineitems:
                     isAllFStatus = isAllFStatus and (l_linestatus == 'F')
                     isConditionTrue = (l_linestatus == 'O')
                     if not isConditionTrue:
                         continue
-                    checkQTYConditionSql = '''
-                        select (ps_availqty - {}) > 0
-                        from partsupp
-                        where ps_partkey = {} and ps_suppkey = {};
-                    '''.format(l_quantity, l_partkey, l_suppkey)
-                    _executeWrapper(cur, checkQTYConditionSql)
-                    isConditionTrue = isConditionTrue and (cur.fetchone())[0]
+                    isConditionTrue = isConditionTrue and state.checkQTYCondition(
+                        l_partkey, l_suppkey, l_quantity
+                    )
                     if not isConditionTrue:
                         continue
-                    checkAvailTimeConditionSql = '''
-                        select (date '{}' >= p_availablity_time_begin)
-                            and (date '{}' <= p_availablity_time_end)
-                        from part
-                        where p_partkey = {};
-                    '''.format(currentTime, currentTime, l_partkey)
-                    _executeWrapper(cur, checkAvailTimeConditionSql)
-                    isConditionTrue = isConditionTrue and (cur.fetchone())[0]
+                    isConditionTrue = isConditionTrue and state.checkAvailTimeCondition(
+                        l_partkey, currentTime
+                    )
                     if isConditionTrue:
                         updatePartsuppSql = '''
                             update partsupp
@@ -1027,9 +3950,16 @@ def generataHistory(connStr: str):
                             l_partkey,
                             l_suppkey
                         )
-                        _executeWrapper(cur, updatePartsuppSql)
+                        state.addPartsuppAvailqty(updatePartsuppSql, 
+                                                  l_partkey, 
+                                                  l_suppkey, 
+                                                  -l_quantity)
                         deliverOrderHistorySqls.append(updatePartsuppSql)
-                        _executeWrapper(cur, updatelineitemSql)
+                        state.setLineitemStatus(updatelineitemSql, 
+                                                l_orderkey, 
+                                                l_partkey, 
+                                                l_suppkey, 
+                                                'F')
                         deliverOrderHistorySqls.append(updatelineitemSql)
                 if (currentTime >= o_receivable_time_begin 
                     and currentTime <= o_receivable_time_end 
@@ -1041,16 +3971,21 @@ def generataHistory(connStr: str):
                                 o_receivable_time_end = date '{}'
                             where o_orderkey = {};
                         '''.format(currentTime, currentTime, o_orderkey)
+                        state.setOrderReceivableTimeEnd(updateOrdersSql, 
+                                                        o_orderkey, 
+                                                        currentTime)
                     else:
                         updateOrdersSql = '''
                             update orders
-                            set o_active_time_end = date '{}',
+                            set o_active_time_end = date '{}'
                             where o_orderkey = {};
                         '''.format(currentTime, o_orderkey)
-                    _executeWrapper(cur, updateOrdersSql)
+                        state.setOrderActiveTimeEnd(updateOrdersSql, 
+                                                    o_orderkey, 
+                                                    currentTime)
                     deliverOrderHistorySqls.append(updateOrdersSql)
 
-                conn.commit()
+                state.commit()
                 historySqlFile.write("\n")
                 historySqlFile.write("\n".join(deliverOrderHistorySqls))
                 historySqlFile.write("\n")
@@ -1060,20 +3995,11 @@ def generataHistory(connStr: str):
                 receivePaymentHistorySqls = []
 
                 # Uniformly select orders still being opened in `currentTime`
-                selectFromOrdersSql = '''
-                    select o_orderkey, o_totalprice, o_custkey
-                    from orders tablesample bernoulli (100) repeatable ({})
-                    where o_receivable_time_begin <= date '{}'
-                        and o_receivable_time_end >= date '{}'
-                        and o_orderstatus = 'O'
-                    limit 1
-                '''.format(TABLE_SAMPLE_SEED_RAND.random(),
-                           currentTime,
-                           currentTime)
-                _executeWrapper(cur, selectFromOrdersSql)
-                allReceOrders = cur.fetchall()
-                if len(allReceOrders) > 0:
-                    o_orderkey, o_totalprice, o_custkey = allReceOrders.pop()
+                receOrder = state.sampleReceivableOrder(
+                    TABLE_SAMPLE_SEED_RAND, currentTime
+                )
+                if receOrder is not None:
+                    o_orderkey, o_totalprice, o_custkey = receOrder
                     updateOrdersReceTimeSql = '''
                         update orders
                         set o_receivable_time_end = date '{}'
@@ -1084,12 +4010,16 @@ def generataHistory(connStr: str):
                         set c_acctbal = c_acctbal + {}
                         where c_custkey = {};
                     '''.format(o_totalprice, o_custkey)
-                    _executeWrapper(cur, updateOrdersReceTimeSql)
+                    state.setOrderReceivableTimeEnd(updateOrdersReceTimeSql, 
+                                                    o_orderkey, 
+                                                    currentTime)
                     receivePaymentHistorySqls.append(updateOrdersReceTimeSql)
-                    _executeWrapper(cur, updateCustomerSql)
+                    state.addCustomerAcctbal(updateCustomerSql, 
+                                             o_custkey, 
+                                             o_totalprice)
                     receivePaymentHistorySqls.append(updateCustomerSql)
             
-                conn.commit()
+                state.commit()
                 historySqlFile.write("\n")
                 historySqlFile.write("\n".join(receivePaymentHistorySqls))
                 historySqlFile.write("\n")
@@ -1098,87 +4028,78 @@ def generataHistory(connStr: str):
             elif 0.8 <= p < 0.85:
                 # Uniformly select lineitem with 'O' status and related 
                 # part is available
-                selectUpdateStockSqlTemplate = '''
-                    select l_partkey, l_suppkey, l_quantity
-                    from (
-                        select l_partkey, l_suppkey, l_quantity
-                        from lineitem tablesample bernoulli (100) repeatable ({})
-                        where l_linestatus = 'O'
-                        limit 1000
-                    ) as opened_lineitem inner join part
-                        on l_partkey = p_partkey
-                    where p_availablity_time_begin <= date '{}'
-                        and p_availablity_time_end >= date '{}'
-                '''
-                updateStockLineitems = []
-                while (len(updateStockLineitems) == 0):
-                    selectUpdateStockSql = selectUpdateStockSqlTemplate.format(
-                        TABLE_SAMPLE_SEED_RAND.random(),
-                        currentTime,
-                        currentTime
-                    )
-                    _executeWrapper(cur, selectUpdateStockSql)
-                    updateStockLineitems = cur.fetchall()
-                l_partkey, l_suppkey, l_quantity = UNIFORM_RAND.choice(
-                    updateStockLineitems
+                updateStockHistorySqls = []
+                updateStockLineitem = state.sampleUpdateStockLineitem(
+                    TABLE_SAMPLE_SEED_RAND, currentTime
                 )
+                l_partkey, l_suppkey, l_quantity = updateStockLineitem
                 updatePartsuppQTYSql = '''
                     update partsupp
                     set ps_availqty = ps_availqty + 2 * {}
                     where ps_partkey = {} and ps_suppkey = {};
                 '''.format(l_quantity, l_partkey, l_suppkey)
-                _executeWrapper(cur, updatePartsuppQTYSql)
+                state.addPartsuppAvailqty(updatePartsuppQTYSql, 
+                                          l_partkey, 
+                                          l_suppkey, 
+                                          2 * l_quantity)
+                updateStockHistorySqls.append(updatePartsuppQTYSql)
 
-                conn.commit()
+                state.commit()
                 historySqlFile.write("\n")
-                historySqlFile.write(updatePartsuppQTYSql)
+                historySqlFile.write("\n".join(updateStockHistorySqls))
                 historySqlFile.write("\n")
 
             # Delay availablity
             elif 0.85 <= p < 0.9:
                 p_partkey = UNIFORM_RAND.randint(minPartkey, maxPartkey)
+                p_availablity_time_begin = currentTime + UNIFORM_RAND.randint(1, 14) * oneDay
+                p_availablity_time_end = MAX_DATE
                 updatePartAvailTimeSql = '''
                     update part
                     set p_availablity_time_begin = date '{}',
                         p_availablity_time_end = date '{}'
                     where p_partkey = {};
-                '''.format(currentTime + UNIFORM_RAND.randint(1, 14) * oneDay,
-                           MAX_DATE,
+                '''.format(p_availablity_time_begin,
+                           p_availablity_time_end,
                            p_partkey)
-                _executeWrapper(cur, updatePartAvailTimeSql)
+                state.setPartAvailablity(updatePartAvailTimeSql, 
+                                         p_partkey, 
+                                         p_availablity_time_begin, 
+                                         p_availablity_time_end)
 
-                conn.commit()
+                state.commit()
                 historySqlFile.write("\n")
                 historySqlFile.write(updatePartAvailTimeSql)
                 historySqlFile.write("\n")
 
             # Change price by supplier
             elif 0.9 <= p < 0.95:
-                selectChangePricePartsuppSqlSql = '''
-                    select ps_partkey, ps_suppkey
-                    from partsupp tablesample bernoulli (100) repeatable ({})
-                    limit 1
-                '''.format(TABLE_SAMPLE_SEED_RAND.random())
-                _executeWrapper(cur, selectChangePricePartsuppSqlSql)
-                ps_partkey, ps_suppkey = cur.fetchone()
+                changePriceHistorySqls = []
                 updatePartsuppSql = '''
                     update partsupp
                     set ps_supplycost = abs(ps_supplycost + ({})),
                         ps_validity_time_begin = date '{}',
                         ps_validity_time_end = date '{}'
                     where ps_partkey = {} and ps_suppkey = {};
-                '''.format(
-                    UNIFORM_RAND.randint(-100, 100),
-                    currentTime + int(UNIFORM_RAND.gauss((-15 + 30)/2, 1.0)) * oneDay,
-                    MAX_DATE,
-                    ps_partkey,
-                    ps_suppkey
+                '''
+                changePricePartsupp = state.sampleChangePricePartsupp(
+                    TABLE_SAMPLE_SEED_RAND
                 )
-                _executeWrapper(cur, updatePartsuppSql)
+                if changePricePartsupp is not None:
+                    ps_partkey, ps_suppkey = changePricePartsupp
+                    changePriceSql = updatePartsuppSql.format(
+                        UNIFORM_RAND.randint(-100, 100),
+                        currentTime + int(UNIFORM_RAND.gauss((-15 + 30)/2, 1.0)) * oneDay,
+                        MAX_DATE,
+                        ps_partkey,
+                        ps_suppkey
+                    )
+                    state.write(changePriceSql)
+                    changePriceHistorySqls.append(changePriceSql)
 
-                conn.commit()
+                state.commit()
                 historySqlFile.write("\n")
-                historySqlFile.write(updatePartsuppSql)
+                historySqlFile.write("\n".join(changePriceHistorySqls))
                 historySqlFile.write("\n")
 
             # Update supplier
@@ -1189,9 +4110,9 @@ def generataHistory(connStr: str):
                     set s_acctbal = abs(s_acctbal + ({}))
                     where s_suppkey = {};
                 '''.format(UNIFORM_RAND.randint(-100, 100),s_suppkey)
-                _executeWrapper(cur, updateSupplierAcctbalSql)
+                state.write(updateSupplierAcctbalSql)
 
-                conn.commit()
+                state.commit()
                 historySqlFile.write("\n")
                 historySqlFile.write(updateSupplierAcctbalSql)
                 historySqlFile.write("\n")
@@ -1201,97 +4122,217 @@ def generataHistory(connStr: str):
                 manOrderDataHistorySqls = []
 
                 o_totalprice = 0
-                selectManOrderSql = '''
-                    select o_orderkey
-                    from orders tablesample bernoulli (100) repeatable ({})
-                    where date '{}' > o_receivable_time_end + interval '1 month'
-                        and o_orderstatus = 'F'
-                    limit 1
-                '''.format(TABLE_SAMPLE_SEED_RAND.random(), currentTime)
-                _executeWrapper(cur, selectManOrderSql)
-                o_orderkey = cur.fetchone()[0]
-                selectFromLineitemSql = '''
-                    select l_orderkey, l_partkey, l_suppkey, l_extendedprice
-                    from lineitem
-                    where l_orderkey = {};
-                '''.format(o_orderkey)
-                _executeWrapper(cur, selectFromLineitemSql)
-                lineitems = cur.fetchall()
-                for l_orderkey, l_partkey, l_suppkey, l_extendedprice in lineitems:
-                    l_extendedprice = l_extendedprice + UNIFORM_RAND.randint(1, 10)
-                    updateLineitemExtPriceSql = '''
-                        update lineitem
-                        set l_extendedprice = {}
-                        where l_orderkey = {}
-                            and l_partkey = {}
-                            and l_suppkey = {};
-                    '''.format(l_extendedprice, l_orderkey, l_partkey, l_suppkey)
-                    _executeWrapper(cur, updateLineitemExtPriceSql)
-                    manOrderDataHistorySqls.append(updateLineitemExtPriceSql)
-                    o_totalprice += l_extendedprice
-                updateOrderTotPriceSql = '''
-                    update orders 
-                    set o_totalprice = {} 
-                    where o_orderkey = {};
-                '''.format(o_totalprice, o_orderkey)
-                _executeWrapper(cur, updateOrderTotPriceSql)
-                manOrderDataHistorySqls.append(updateOrderTotPriceSql)
+                o_orderkey = state.sampleManipulateOrder(
+                    TABLE_SAMPLE_SEED_RAND, currentTime
+                )
+                if o_orderkey is not None:
+                    lineitems = state.selectLineitemPrices(o_orderkey)
+                    for l_orderkey, l_partkey, l_suppkey, l_extendedprice in lineitems:
+                        l_extendedprice = l_extendedprice + UNIFORM_RAND.randint(1, 10)
+                        updateLineitemExtPriceSql = '''
+                            update lineitem
+                            set l_extendedprice = {}
+                            where l_orderkey = {}
+                                and l_partkey = {}
+                                and l_suppkey = {};
+                        '''.format(l_extendedprice, l_orderkey, l_partkey, l_suppkey)
+                        state.setLineitemExtendedprice(updateLineitemExtPriceSql, 
+                                                       l_orderkey, 
+                                                       l_partkey, 
+                                                       l_suppkey, 
+                                                       l_extendedprice)
+                        manOrderDataHistorySqls.append(updateLineitemExtPriceSql)
+                        o_totalprice += l_extendedprice
+                    updateOrderTotPriceSql = '''
+                        update orders 
+                        set o_totalprice = {} 
+                        where o_orderkey = {};
+                    '''.format(o_totalprice, o_orderkey)
+                    state.setOrderTotalprice(updateOrderTotPriceSql, 
+                                             o_orderkey, 
+                                             o_totalprice)
+                    manOrderDataHistorySqls.append(updateOrderTotPriceSql)
 
-                conn.commit()
+                state.commit()
                 historySqlFile.write("\n")
                 historySqlFile.write("\n".join(manOrderDataHistorySqls))
                 historySqlFile.write("\n")
 
-            currentUT -= 1
+            if SQL_PROFILE:
+                PROFILER.record(PROFILER.template("transaction"), 
+                                perf_counter_ns() - transactionSt)
+            PROFILER.scenario = ""
             totalUT += 1
+            progress.update(totalUT, currentTime, scenario)
+            if (config.checkpointInterval > 0 
+                and totalUT % config.checkpointInterval == 0 
+                and totalUT < updateTimes):
+                saveCheckpoint(makeCheckpoint())
+                state.finishCheckpoint()
         else:
-            currentUT += avgUTPerDay
             currentTime += oneDay
+            state.endDay()
 
+    progress.report(totalUT, currentTime, perf_counter())
+    if config.keepHistoryState:
+        saveCheckpoint(makeCheckpoint(), _historyStatePath())
+        state.finishCheckpoint()
     historySqlFile.flush()
-    historySqlFile.close()
-
-    # drop index on primary key of part, supplier, partsupp, customer, 
-    # orders, lineitem
-    dropPartPKSql = "drop index if exists part_pk"
-    dropSupplierPKSql = "drop index if exists supplier_pk"
-    dropPartsuppPKSql = "drop index if exists partsupp_pk"
-    dropCustomerPKSql = "drop index if exists customer_pk"
-    dropOrdersPKSql = "drop index if exists orders_pk"
-    dropLineitemPKSql = "drop index if exists lineitem_pk"
-    dropPKSqls = [dropPartPKSql,
-                  dropSupplierPKSql, 
-                  dropPartsuppPKSql, 
-                  dropCustomerPKSql, 
-                  dropOrdersPKSql, 
-                  dropLineitemPKSql]
-    for dropPKSql in dropPKSqls:
-        _executeWrapper(cur, dropPKSql)
-
-    conn.commit()
-
-    # drop btree index on o_receivable_time
-    dropReceivableTimeBTreeIndexSql = "drop index if exists o_receivable_time_btree"
-    _executeWrapper(cur, dropReceivableTimeBTreeIndexSql)
-
-    conn.commit()
-
-    # drop btree index on p_availablity_time 
-    dropAvailablityTimeBTreeIndexSql = "drop index if exists p_availablity_time_btree"
-    _executeWrapper(cur, dropAvailablityTimeBTreeIndexSql)
-
-    conn.commit()
-
-    conn.commit()
-
-    cur.close()
-    conn.close()
-
-
-
+    return totalUT - (0 if checkpoint is None else checkpoint["totalUT"])
+
+
+
+
+
+# Manifest in destPath records the fingerprint and the size and hash of 
+# the outputs of every phase, a phase whose fingerprint and outputs are 
+# unchanged is skipped on rerun. It also caches the hashes of tpch tables. 
+# The manifest also records which V1data the database holds, history 
+# generated in the database leaves it holding no V1data.
+def _manifestPath() -> Path:
+    return Path(config.destPath) / "manifest.json"
+
+def loadManifest() -> dict:
+    try:
+        with open(_manifestPath()) as manifestFile:
+            return json.load(manifestFile)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+def saveManifest(manifest: dict):
+    path = _manifestPath()
+    tmpPath = path.with_name(path.name + ".tmp")
+    with open(tmpPath, "w") as manifestFile:
+        json.dump(manifest, manifestFile, indent=4, sort_keys=True)
+    os.replace(tmpPath, path)
+
+def _historyFingerprint(version1Fingerprint: str) -> str:
+    fingerprint = md5("|".join(str(value) for value in (
+        version1Fingerprint, 
+        HISTORY_VERSION, 
+        config.updateTimes, 
+        config.compatibleComments, 
+        config.counterBasedRandom, 
+        config.poissonSchedule, 
+        config.keepHistoryState
+    )).encode())
+    return "tpc-bih history " + fingerprint.hexdigest()
+
+def _phaseOutputs(fileNames) -> dict:
+    outputs = {}
+    for fileName in fileNames:
+        path = Path(config.destPath) / fileName
+        outputs[fileName] = {"size": path.stat().st_size, "md5": _fileHash(path)}
+    return outputs
+
+def _isPhaseDone(manifest: dict, phase: str, fingerprint: str) -> bool:
+    record = manifest.get(phase)
+    if record is None or record["fingerprint"] != fingerprint:
+        return False
+    with TRACER.phase("check " + phase):
+        for fileName, output in record["outputs"].items():
+            path = Path(config.destPath) / fileName
+            # sizes are compared first to skip hashing changed outputs
+            if not path.exists() or path.stat().st_size != output["size"] \
+                    or _fileHash(path) != output["md5"]:
+                return False
+    return True
+
+# Run the phases whose inputs changed since the last run, `force` runs all 
+# of them. Resuming or extending a history only runs the history phase.
+def runPhases(connStr: str, resume: bool = False, extendTimes: int = 0, 
+              force: bool = False):
+    manifest = {} if force else loadManifest()
+    version1Files = ["bi-{}.tbl".format(tblName) for tblName in TABLE_KEYS]
+    historyFiles = ["history.sql"]
+    if config.keepHistoryState:
+        historyFiles.append(_historyStatePath().name)
+
+    if resume or extendTimes > 0:
+        if not config.v1Only:
+            manifest.pop("history", None)
+            manifest.pop("database", None)
+            saveManifest(manifest)
+            LOG.info("Start generating history")
+            with TRACER.phase("history"):
+                generataHistory(connStr, resume, extendTimes)
+            LOG.info("Success! History have been generated.")
+        return
+
+    version1Key = _version1Fingerprint(manifest.setdefault("inputs", {}))
+    saveManifest(manifest)
+    if _isPhaseDone(manifest, "version1", version1Key):
+        LOG.info("V1 data are up to date.")
+    else:
+        manifest.pop("history", None)
+        manifest.pop("database", None)
+        saveManifest(manifest)
+        LOG.info("Start generating v1data")
+        with TRACER.phase("version1"):
+            initializeVersion1(connStr, fingerprint=version1Key)
+        manifest["version1"] = {
+            "fingerprint": version1Key, 
+            "outputs": _phaseOutputs(version1Files)
+        }
+        if config.version1Mode != "stream" or not config.v1Only:
+            manifest["database"] = {
+                "dbname": config.dbname, 
+                "fingerprint": version1Key
+            }
+        saveManifest(manifest)
+        LOG.info("Success! V1 data have been generated.")
+
+    if config.v1Only:
+        return
+
+    historyKey = _historyFingerprint(version1Key)
+    if _isPhaseDone(manifest, "history", historyKey):
+        LOG.info("History is up to date.")
+        return
+
+    # restore V1data in the database without generating it again
+    if manifest.get("database") != {"dbname": config.dbname, 
+                                    "fingerprint": version1Key}:
+        with TRACER.phase("restore"):
+            if config.version1Template != "" \
+                    and cloneVersion1Template(connStr, version1Key):
+                LOG.info("V1 data are cloned from template {}".format(
+                    config.version1Template
+                ))
+            else:
+                LOG.info("Start loading v1data")
+                loadVersion1(connStr)
+        manifest["database"] = {
+            "dbname": config.dbname, 
+            "fingerprint": version1Key
+        }
+    manifest.pop("history", None)
+    if not config.inMemoryHistory:
+        manifest.pop("database")
+    saveManifest(manifest)
+
+    LOG.info("Start generating history")
+    with TRACER.phase("history"):
+        generataHistory(connStr)
+    manifest["history"] = {
+        "fingerprint": historyKey, 
+        "outputs": _phaseOutputs(historyFiles)
+    }
+    saveManifest(manifest)
+    LOG.info("Success! History have been generated.")
 
 
 if __name__ == '__main__':
+    argParser = ArgumentParser(description="Generate TPC-BiH data")
+    argParser.add_argument("--resume", action="store_true", 
+                           help="continue history from its last checkpoint")
+    argParser.add_argument("--extend", type=int, default=0, metavar="N", 
+                           help="append N transactions to a kept history")
+    argParser.add_argument("--force", action="store_true", 
+                           help="run every phase even if its inputs are unchanged")
+    args = argParser.parse_args()
+
+    setupLogging()
     config.config()
 
     connStr = "dbname={} user={} password={} host={} port={}".format(
@@ -1304,11 +4345,7 @@ if __name__ == '__main__':
 
     LOG.info("RUN START AT {}".format(datetime.now()))
 
-    LOG.info("Start generating v1data")
-    initializeVersion1(connStr)
-    LOG.info("Success! V1 data have been generated.")
-
-    if (not config.v1Only):
-        LOG.info("Start generating history")
-        generataHistory(connStr)
-        LOG.info("Success! History have been generated.")
+    runPhases(connStr, args.resume, args.extend, args.force)
+    TRACER.dump(Path(config.destPath))
+    if SQL_PROFILE:
+        PROFILER.dump(Path(config.destPath))
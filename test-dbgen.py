@@ -2,13 +2,56 @@ import unittest
 import random
 from pathlib import Path
 from hashlib import md5
+from datetime import timedelta
+from decimal import Decimal
 from subprocess import run as runCmd
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
 import psycopg2
 
 import dbgen
 
 SAFE_RUN_NUMBER = 100000
 
+# Connection string of the database in config
+def connectionString() -> str:
+    return "dbname={} user={} password={} host={} port={}".format(
+        dbgen.config.dbname, 
+        dbgen.config.user, 
+        dbgen.config.password, 
+        dbgen.config.host, 
+        dbgen.config.port
+    )
+
+# Reset random generators to the seeds of dbgen, so two runs generate the 
+# same data
+def resetRandomGenerators():
+    dbgen.UPDATE_P_RAND = random.Random(0.7579544029403025)
+    dbgen.UPDATE_SCENARIO_P_RAND = random.Random(0.420571580830845)
+    dbgen.UNIFORM_RAND = random.Random(0.25891675029296335)
+    dbgen.TABLE_SAMPLE_SEED_RAND = random.Random(0.5112747213686085)
+
+# Test case replacing options and attributes of dbgen in temporary run 
+# directories, which are all restored or removed after the test
+class DbgenTestCase (unittest.TestCase):
+
+    def setConfig(self, **options):
+        for name, value in options.items():
+            patcher = patch.object(dbgen.config, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def patchDbgen(self, **attributes):
+        for name, value in attributes.items():
+            patcher = patch.object(dbgen, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def makeRunPath(self) -> Path:
+        runDir = TemporaryDirectory()
+        self.addCleanup(runDir.cleanup)
+        return Path(runDir.name)
+
 class TestGenerateAddressLen (unittest.TestCase):
 
     def testGenerateAddressLen(self):
@@ -24,7 +67,7 @@ class TestGeneratePhoneLen (unittest.TestCase):
             genPhone = dbgen.generatePhone(random.randint(0, 25))
             self.assertEqual(len(genPhone), 15)
 
-class TestGenerateCommentLen (unittest.TestCase):
+class TestGenerateCommentLen (DbgenTestCase):
     
     def testGenerateNCommentLen(self):
         for i in range(SAFE_RUN_NUMBER):
@@ -66,6 +109,246 @@ class TestGenerateCommentLen (unittest.TestCase):
             genComment = dbgen.generateComment(44)
             self.assertLessEqual(len(genComment), 44)
 
+    def testGenerateCommentsLen(self):
+        genComments = dbgen.generateComments(SAFE_RUN_NUMBER, 44)
+        self.assertEqual(len(genComments), SAFE_RUN_NUMBER)
+        for genComment in genComments:
+            self.assertLessEqual(len(genComment), 44)
+
+    def testGenerateCompatibleCommentLen(self):
+        self.setConfig(compatibleComments=True)
+        for i in range(SAFE_RUN_NUMBER):
+            genComment = dbgen.generateComment(117)
+            self.assertLessEqual(len(genComment), 117)
+
+class TestImportWithoutSideEffects (DbgenTestCase):
+
+    def setUp(self) -> None:
+        self.importRunPath = self.makeRunPath()
+
+    def testImportWithoutSideEffects(self):
+        importCode = "\n".join((
+            "import sys", 
+            "sys.path.insert(0, {!r})".format(str(Path(dbgen.__file__).parent)), 
+            "import dbgen", 
+            "assert dbgen.COMMENT_TABLES is None", 
+            "assert len(dbgen.LOG.handlers) == 0", 
+            "print(dbgen.generateComment(44))"
+        ))
+        result = runCmd(["python3", "-c", importCode], cwd=self.importRunPath, 
+                        capture_output=True, text=True)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertGreater(len(result.stdout.strip()), 0)
+        self.assertEqual(list(self.importRunPath.iterdir()), [])
+
+class TestRankedKeySetSelect (unittest.TestCase):
+
+    def testRankedKeySetSelect(self):
+        keySet = dbgen.RankedKeySet()
+        keys = set()
+        for i in range(SAFE_RUN_NUMBER):
+            key = random.randint(0, 50000)
+            if random.random() < 0.6:
+                keySet.add(key)
+                keys.add(key)
+            else:
+                keySet.discard(key)
+                keys.discard(key)
+        sortedKeys = sorted(keys)
+        self.assertEqual(len(keySet), len(sortedKeys))
+        for rank in range(len(sortedKeys)):
+            self.assertEqual(keySet.select(rank), sortedKeys[rank])
+        self.assertEqual(list(keySet), sortedKeys)
+
+    def testRankedKeySetSampleEmpty(self):
+        keySet = dbgen.RankedKeySet()
+        self.assertIsNone(keySet.sample(random.Random(0)))
+        keySet.add(7)
+        keySet.discard(7)
+        self.assertIsNone(keySet.sample(random.Random(0)))
+
+class TestHistorySamplerDeliverableOrders (unittest.TestCase):
+
+    def testDeliverableOrders(self):
+        sampler = dbgen.HistorySampler()
+        day = dbgen.FROM_DATE
+        sampler.addCustomer(1, Decimal("100.00"))
+        sampler.addOrder(10, 1, "O", Decimal("80.00"), day, day)
+        sampler.addOrder(11, 1, "O", Decimal("150.00"), day, day)
+        sampler.addOrder(12, 2, "P", Decimal("10.00"), day, day)
+        sampler.addOrder(13, 1, "F", Decimal("10.00"), day, day)
+        # the customer of an order with 'O' status is missing
+        sampler.addOrder(14, 3, "O", Decimal("10.00"), day, day)
+        self.assertEqual(list(sampler.deliverableOrders), [10, 12])
+
+        sampler.addCustomerAcctbal(1, Decimal("60.00"))
+        self.assertEqual(list(sampler.deliverableOrders), [10, 11, 12])
+
+        sampler.setOrderStatus(10, "P", day)
+        sampler.addCustomerAcctbal(1, Decimal("-100.00"))
+        self.assertEqual(list(sampler.deliverableOrders), [10, 12])
+
+        sampler.addCustomer(3, Decimal("0.00"))
+        sampler.addCustomerAcctbal(3, Decimal("10.00"))
+        sampler.removeOrder(12)
+        sampler.setOrderStatus(10, "F", day)
+        self.assertEqual(list(sampler.deliverableOrders), [14])
+
+class TestUpdateStockLineitem (unittest.TestCase):
+
+    def testUpdateStockLineitem(self):
+        state = dbgen.MemoryHistoryState("")
+        day = dbgen.FROM_DATE
+        state.partAvailablity = {1: [day + timedelta(days=1), dbgen.MAX_DATE], 
+                                 2: [day + timedelta(days=1), dbgen.MAX_DATE]}
+        state.lineitems = {1: [[1, 1, 1, Decimal(5), "O", Decimal(0)], 
+                               [2, 2, 1, Decimal(6), "O", Decimal(0)], 
+                               [3, 2, 2, Decimal(7), "F", Decimal(0)]]}
+        for linenumber in (1, 2, 3):
+            state.sampler.addLineitem(1, linenumber, "O")
+
+        # no part is available, the lineitem with 'F' status is dropped
+        with self.assertRaises(RuntimeError):
+            state.sampleUpdateStockLineitem(random.Random(0), day)
+        self.assertEqual(len(state.sampler.openLineitems), 2)
+
+        state.partAvailablity[2][0] = day
+        self.assertEqual(
+            state.sampleUpdateStockLineitem(random.Random(0), day), 
+            (2, 1, Decimal(6))
+        )
+
+class TestLatencyHistogramQuantile (unittest.TestCase):
+
+    def testLatencyHistogramQuantile(self):
+        histogram = dbgen.LatencyHistogram()
+        values = [random.randint(1, 10 ** 9) for i in range(SAFE_RUN_NUMBER)]
+        for value in values:
+            histogram.record(value)
+        values.sort()
+        self.assertEqual(histogram.count, len(values))
+        self.assertEqual(histogram.max, values[-1])
+        for q in (0.5, 0.95, 0.99):
+            exact = values[int(q * len(values)) - 1]
+            self.assertLessEqual(abs(histogram.quantile(q) - exact), exact / 16)
+
+    def testStatementLabel(self):
+        self.assertEqual(dbgen._statementLabel(
+            "\n    delete from lineitem where l_orderkey = 1;"
+        ), "delete lineitem")
+        self.assertEqual(dbgen._statementLabel(
+            "select o_orderstatus from orders left join customer"
+        ), "select orders")
+
+class TestPhaseTracer (DbgenTestCase):
+
+    def setUp(self) -> None:
+        self.reportPath = self.makeRunPath()
+
+    def testPhaseTracer(self):
+        tracer = dbgen.PhaseTracer()
+        with tracer.phase("outer") as outer:
+            with tracer.phase("inner") as inner:
+                inner["rows"] = 3
+                sum(range(SAFE_RUN_NUMBER))
+        self.assertEqual([record["phase"] for record in tracer.phases], 
+                         ["outer", "outer/inner"])
+        self.assertEqual(outer["rows"], 0)
+        self.assertGreaterEqual(outer["wall"], inner["wall"])
+        tracer.dump(self.reportPath)
+        with open(self.reportPath / "run-report.txt") as reportFile:
+            self.assertEqual(len(reportFile.readlines()), 3)
+
+class TestProgressMetrics (DbgenTestCase):
+
+    def setUp(self) -> None:
+        self.metricsPath = self.makeRunPath() / "dbgen.prom"
+        self.setConfig(metricsFile=str(self.metricsPath))
+
+    def testProgressMetrics(self):
+        progress = dbgen.ProgressReporter(10, 0)
+        for totalUT in range(1, 5):
+            progress.update(totalUT, dbgen.FROM_DATE, 0)
+        progress.report(4, dbgen.FROM_DATE, progress.lastTime + 2)
+        with open(self.metricsPath) as metricsFile:
+            metrics = metricsFile.read().splitlines()
+        self.assertIn("dbgen_history_transactions_total 4", metrics)
+        self.assertIn("dbgen_history_eta_seconds 3.0", metrics)
+        self.assertIn(
+            'dbgen_history_scenario_transactions_total{scenario="new order"} 4', 
+            metrics
+        )
+
+class TestSeedTransaction (unittest.TestCase):
+
+    def testSeedTransaction(self):
+        dbgen.seedTransaction(42)
+        draws = [dbgen.UNIFORM_RAND.random() for i in range(10)]
+        for index in range(100):
+            dbgen.seedTransaction(index)
+            dbgen.UNIFORM_RAND.random()
+        dbgen.seedTransaction(42)
+        self.assertEqual([dbgen.UNIFORM_RAND.random() for i in range(10)], 
+                         draws)
+        dbgen.seedTransaction(43)
+        self.assertNotEqual(dbgen.UNIFORM_RAND.random(), draws[0])
+
+class TestScheduleFile (DbgenTestCase):
+
+    def setUp(self) -> None:
+        self.schedulePath = self.makeRunPath() / "schedule-test.txt"
+
+    def testScheduleFile(self):
+        days, scenarios = dbgen.buildSchedule(dbgen.config.updateTimes)
+        self.assertEqual(len(days), dbgen.config.updateTimes)
+        self.assertEqual(list(days), sorted(days))
+        avgUTPerDay = dbgen.config.updateTimes / 3652
+        dbgen.saveSchedule(self.schedulePath, days, scenarios, avgUTPerDay)
+        self.assertEqual(
+            dbgen.loadSchedule(self.schedulePath, len(days), avgUTPerDay), 
+            (days, scenarios)
+        )
+        self.assertIsNone(
+            dbgen.loadSchedule(self.schedulePath, len(days) + 1, avgUTPerDay)
+        )
+
+    def testPoissonSchedule(self):
+        avgUTPerDay = 4.0
+        randomStates = dbgen._randomStates()
+        days, scenarios = dbgen.buildPoissonSchedule(20000, avgUTPerDay)
+        self.assertEqual(list(days), sorted(days))
+        self.assertAlmostEqual(20000 / (days[-1] - days[0] + 1), avgUTPerDay, 
+                               delta=0.2)
+        dbgen.saveSchedule(self.schedulePath, days, scenarios, avgUTPerDay)
+
+        # an extended schedule keeps the days of the shorter one
+        dbgen._setRandomStates(randomStates)
+        longerDays, longerScenarios = dbgen.buildPoissonSchedule(30000, avgUTPerDay)
+        self.assertEqual(longerDays[:20000], days)
+        self.assertEqual(longerScenarios[:20000], scenarios)
+
+class TestSplitTblFile (DbgenTestCase):
+
+    def setUp(self) -> None:
+        self.tblPath = self.makeRunPath() / "split-test.tbl"
+        with open(self.tblPath, "w") as f:
+            for i in range(1000):
+                f.write("{}|{}|\n".format(i, "x" * random.randint(0, 50)))
+
+    def testSplitTblFile(self):
+        size = self.tblPath.stat().st_size
+        with open(self.tblPath, "rb") as f:
+            content = f.read()
+        for chunkSize in (1, 100, 4096, size, size + 1):
+            chunks = dbgen.splitTblFile(self.tblPath, chunkSize)
+            self.assertEqual(chunks[0][0], 0)
+            self.assertEqual(chunks[-1][1], size)
+            for (begin, end), (nextBegin, _) in zip(chunks, chunks[1:]):
+                self.assertEqual(end, nextBegin)
+            for begin, end in chunks:
+                self.assertLess(begin, end)
+                self.assertEqual(content[end - 1:end], b"\n")
+
 def calculateHash(path: Path) -> str:
         pathMd5 = md5()
         with open(path, "rb") as f:
@@ -73,38 +356,24 @@ def calculateHash(path: Path) -> str:
                 pathMd5.update(chunk)
         return pathMd5.hexdigest()
 
-class TestSameResultsForTwoRuns (unittest.TestCase):
+class TestSameResultsForTwoRuns (DbgenTestCase):
 
     # create two result directories 
     def setUp(self) -> None:
-        dbgen.config.v1Only = False
-        dbgen.config.updateTimes = 100000
-        self.firstRunPath = Path.cwd() / "first-run"
-        self.secondRunPath = Path.cwd() / "second-run"
-        self.firstRunPath.mkdir()
-        self.secondRunPath.mkdir()
+        self.setConfig(v1Only=False, updateTimes=100000)
+        self.firstRunPath = self.makeRunPath()
+        self.secondRunPath = self.makeRunPath()
 
     def testSameResultsForTwoRuns(self):
-        connStr = "dbname={} user={} password={} host={} port={}".format(
-            dbgen.config.dbname, 
-            dbgen.config.user, 
-            dbgen.config.password, 
-            dbgen.config.host, 
-            dbgen.config.port
-        )
+        connStr = connectionString()
         
-        dbgen.config.destPath = str(self.firstRunPath)
-        dbgen.initializeVersion1(connStr, False)
+        self.setConfig(destPath=str(self.firstRunPath))
+        dbgen.initializeVersion1(connStr)
         dbgen.generataHistory(connStr, False)
 
-        # Reset random generators
-        dbgen.UPDATE_P_RAND = random.Random(0.7579544029403025)
-        dbgen.UPDATE_SCENARIO_P_RAND = random.Random(0.420571580830845)
-        dbgen.UNIFORM_RAND = random.Random(0.25891675029296335)
-        dbgen.TABLE_SAMPLE_SEED_RAND = random.Random(0.5112747213686085)
-
-        dbgen.config.destPath = str(self.secondRunPath)
-        dbgen.initializeVersion1(connStr, False)
+        resetRandomGenerators()
+        self.setConfig(destPath=str(self.secondRunPath))
+        dbgen.initializeVersion1(connStr)
         dbgen.generataHistory(connStr, False)
 
         # compare files
@@ -119,83 +388,713 @@ class TestSameResultsForTwoRuns (unittest.TestCase):
                 calculateHash(secondRunFile)
             )
 
-    # delete two result directories 
-    def tearDown(self) -> None:
-        for file in self.firstRunPath.glob("*"):
-            file.unlink()
-        for file in self.secondRunPath.glob("*"):
-            file.unlink()
-        self.firstRunPath.rmdir()
-        self.secondRunPath.rmdir()
-        dbgen.config.v1Only = True
-        dbgen.config.updateTimes = 10000
+class TestSameResultsForTwoEngines (DbgenTestCase):
+
+    def setUp(self) -> None:
+        self.setConfig(v1Only=False, updateTimes=5000)
+        self.postgresRunPath = self.makeRunPath()
+        self.memoryRunPath = self.makeRunPath()
+
+    def testSameResultsForTwoEngines(self):
+        connStr = connectionString()
+
+        resetRandomGenerators()
+        self.setConfig(inMemoryHistory=False, destPath=str(self.postgresRunPath))
+        dbgen.initializeVersion1(connStr)
+        dbgen.generataHistory(connStr)
+
+        resetRandomGenerators()
+        self.setConfig(inMemoryHistory=True, destPath=str(self.memoryRunPath))
+        dbgen.initializeVersion1(connStr)
+        dbgen.generataHistory(connStr)
+
+        self.assertEqual(
+            calculateHash(self.postgresRunPath / "history.sql"), 
+            calculateHash(self.memoryRunPath / "history.sql")
+        )
+
+class TestExplainSlowStatements (DbgenTestCase):
+
+    def setUp(self) -> None:
+        self.setConfig(v1Only=False, updateTimes=2000)
+        self.plainRunPath = self.makeRunPath()
+        self.explainRunPath = self.makeRunPath()
+
+    def testExplainSlowStatements(self):
+        connStr = connectionString()
+
+        resetRandomGenerators()
+        self.setConfig(destPath=str(self.plainRunPath))
+        dbgen.initializeVersion1(connStr)
+        dbgen.generataHistory(connStr)
+
+        # Every statement is slow, explaining must not change the data
+        resetRandomGenerators()
+        self.patchDbgen(SQL_EXPLAIN_THRESHOLD=1e-9)
+        dbgen.EXPLAIN_COUNTS.clear()
+        self.setConfig(destPath=str(self.explainRunPath))
+        dbgen.initializeVersion1(connStr)
+        dbgen.generataHistory(connStr)
+
+        for file in self.plainRunPath.glob("*"):
+            self.assertEqual(
+                calculateHash(file), 
+                calculateHash(self.explainRunPath / file.name)
+            )
+        with open(self.explainRunPath / "sql-explain.txt") as explainFile:
+            plans = explainFile.read()
+        self.assertIn("-- update lineitem", plans)
+        self.assertIn("-- deliver order: select orders", plans)
+        self.assertIn("Buffers:", plans)
+
+class TestSameResultsForBulkLoad (DbgenTestCase):
+
+    SETTING_NAMES = ("synchronous_commit", "maintenance_work_mem", 
+                     "max_parallel_maintenance_workers")
+
+    def setUp(self) -> None:
+        self.setConfig(v1Only=False, updateTimes=2000)
+        self.plainRunPath = self.makeRunPath()
+        self.bulkRunPath = self.makeRunPath()
+        self.loggedRunPath = self.makeRunPath()
+
+    def showSettings(self, cur) -> dict:
+        settings = {}
+        for name in self.SETTING_NAMES:
+            cur.execute("show {}".format(name))
+            settings[name] = cur.fetchone()[0]
+        return settings
+
+    def newSessionSettings(self, connStr: str) -> dict:
+        conn = psycopg2.connect(connStr)
+        with conn.cursor() as cur:
+            settings = self.showSettings(cur)
+        conn.close()
+        return settings
+
+    def tablePersistences(self, connStr: str) -> set:
+        conn = psycopg2.connect(connStr)
+        with conn.cursor() as cur:
+            cur.execute("select relpersistence from pg_class "
+                        "where relnamespace = current_schema()::regnamespace "
+                        "and relname in %s", (tuple(dbgen.TABLE_KEYS),))
+            persistences = {row[0] for row in cur.fetchall()}
+        conn.close()
+        return persistences
+
+    def testSameResultsForBulkLoad(self):
+        connStr = connectionString()
+        defaultSettings = self.newSessionSettings(connStr)
+
+        resetRandomGenerators()
+        self.setConfig(destPath=str(self.plainRunPath))
+        dbgen.initializeVersion1(connStr)
+        dbgen.generataHistory(connStr)
+
+        # sessions the bulk profile is reset on must be back to the defaults
+        resetSettings = []
+        resetSessionSettings = dbgen.resetSessionSettings
+        def recordedResetSessionSettings(cur, names):
+            resetSessionSettings(cur, names)
+            resetSettings.append(self.showSettings(cur))
+        self.patchDbgen(resetSessionSettings=recordedResetSessionSettings)
+
+        resetRandomGenerators()
+        self.setConfig(bulkLoad=True, prewarmTables=True, 
+                       destPath=str(self.bulkRunPath))
+        dbgen.initializeVersion1(connStr)
+        dbgen.generataHistory(connStr)
+
+        for file in self.plainRunPath.glob("*"):
+            self.assertEqual(
+                calculateHash(file), 
+                calculateHash(self.bulkRunPath / file.name)
+            )
+
+        self.assertEqual(self.tablePersistences(connStr), {"u"})
+        self.assertGreater(len(resetSettings), 0)
+        for settings in resetSettings:
+            self.assertEqual(settings, defaultSettings)
+        self.assertEqual(self.newSessionSettings(connStr), defaultSettings)
+
+        resetRandomGenerators()
+        self.setConfig(bulkLoadLogged=True, destPath=str(self.loggedRunPath))
+        dbgen.initializeVersion1(connStr)
+        self.assertEqual(self.tablePersistences(connStr), {"p"})
+
+class TestSameResultsForParallelIndexes (DbgenTestCase):
+
+    def setUp(self) -> None:
+        self.setConfig(v1Only=False, updateTimes=2000)
+        self.serialRunPath = self.makeRunPath()
+        self.parallelRunPath = self.makeRunPath()
+
+    def testSameResultsForParallelIndexes(self):
+        connStr = connectionString()
+
+        resetRandomGenerators()
+        self.setConfig(indexParallelism=1, destPath=str(self.serialRunPath))
+        dbgen.initializeVersion1(connStr)
+        dbgen.generataHistory(connStr)
+
+        resetRandomGenerators()
+        self.setConfig(indexParallelism=4, keepHistoryIndexes=True, 
+                       destPath=str(self.parallelRunPath))
+        dbgen.initializeVersion1(connStr)
+        dbgen.generataHistory(connStr)
+
+        for file in self.serialRunPath.glob("*"):
+            self.assertEqual(
+                calculateHash(file), 
+                calculateHash(self.parallelRunPath / file.name)
+            )
+
+        # the indexes are kept for a later run
+        conn = psycopg2.connect(connStr)
+        with conn.cursor() as cur:
+            cur.execute("select count(*) from pg_indexes where indexname in %s", 
+                        (tuple(index[0] for index in dbgen.HISTORY_INDEXES),))
+            self.assertEqual(cur.fetchone()[0], len(dbgen.HISTORY_INDEXES))
+        conn.close()
+
+class TestSameResultsForPartitions (DbgenTestCase):
+
+    def setUp(self) -> None:
+        self.setConfig(v1Only=False, updateTimes=2000, version1Mode="ctas")
+        self.plainRunPath = self.makeRunPath()
+        self.partitionRunPath = self.makeRunPath()
+
+    def testSameResultsForPartitions(self):
+        connStr = connectionString()
+
+        resetRandomGenerators()
+        self.setConfig(destPath=str(self.plainRunPath))
+        dbgen.initializeVersion1(connStr)
+        dbgen.generataHistory(connStr)
+
+        resetRandomGenerators()
+        self.setConfig(partitions=4, destPath=str(self.partitionRunPath))
+        dbgen.initializeVersion1(connStr)
+        dbgen.generataHistory(connStr)
+
+        for file in self.plainRunPath.glob("*"):
+            self.assertEqual(
+                calculateHash(file), 
+                calculateHash(self.partitionRunPath / file.name)
+            )
+        self.assertEqual(len(list(self.partitionRunPath.glob("*"))), 
+                         len(list(self.plainRunPath.glob("*"))))
+
+        # every partitioned table is split into nonempty partitions
+        conn = psycopg2.connect(connStr)
+        with conn.cursor() as cur:
+            for tblName in dbgen.PARTITION_KEYS:
+                cur.execute("select inhrelid::regclass::text from pg_inherits "
+                            "where inhparent = %s::regclass", (tblName,))
+                partitions = [row[0] for row in cur.fetchall()]
+                self.assertEqual(len(partitions), dbgen.config.partitions)
+                for partition in partitions:
+                    cur.execute("select exists (select from {})".format(partition))
+                    self.assertTrue(cur.fetchone()[0], partition)
+        conn.close()
+
+class TestSameResultsForShards (DbgenTestCase):
+
+    def setUp(self) -> None:
+        self.setConfig(v1Only=False, updateTimes=2000, version1Mode="stream")
+        self.plainRunPath = self.makeRunPath()
+        self.shardRunPath = self.makeRunPath()
+        # databases on the same server stand in for the nodes
+        self.connStr = connectionString()
+        self.shardNames = ["{}_shard{}".format(dbgen.config.dbname, i) 
+                           for i in range(3)]
+        maintenanceConn = dbgen._connectMaintenance(self.connStr)
+        with maintenanceConn.cursor() as cur:
+            for shardName in self.shardNames:
+                cur.execute("drop database if exists {}".format(shardName))
+                cur.execute("create database {}".format(shardName))
+        maintenanceConn.close()
+        self.addCleanup(self.dropShards)
+
+    def dropShards(self):
+        maintenanceConn = dbgen._connectMaintenance(self.connStr)
+        with maintenanceConn.cursor() as cur:
+            for shardName in self.shardNames:
+                cur.execute("drop database if exists {}".format(shardName))
+        maintenanceConn.close()
 
-class TestInvalidUpdateTimes(unittest.TestCase):
+    def shardConnStrs(self) -> list:
+        return [
+            self.connStr.replace("dbname={} ".format(dbgen.config.dbname), 
+                                 "dbname={} ".format(shardName)) 
+            for shardName in self.shardNames
+        ]
+
+    def testSameResultsForShards(self):
+        resetRandomGenerators()
+        self.setConfig(destPath=str(self.plainRunPath))
+        dbgen.initializeVersion1(self.connStr)
+        dbgen.generataHistory(self.connStr)
+
+        resetRandomGenerators()
+        self.setConfig(shards=self.shardConnStrs(), destPath=str(self.shardRunPath))
+        dbgen.initializeVersion1(self.connStr)
+        dbgen.generataHistory(self.connStr)
+
+        for file in self.plainRunPath.glob("*"):
+            self.assertEqual(
+                calculateHash(file), 
+                calculateHash(self.shardRunPath / file.name)
+            )
+
+        # every order and lineitem is on the shard of its orderkey, 
+        # customers are on every shard
+        orderNum = 0
+        lineitemNum = 0
+        lows = dbgen.orderkeyBounds(len(dbgen.config.shards))
+        for i, shardConnStr in enumerate(dbgen.config.shards):
+            conn = psycopg2.connect(shardConnStr)
+            with conn.cursor() as cur:
+                cur.execute("select count(*) from orders")
+                orderNum += cur.fetchone()[0]
+                cur.execute("select count(*) from lineitem")
+                lineitemNum += cur.fetchone()[0]
+                cur.execute(
+                    "select count(*) from orders "
+                    "where o_orderkey < %s or o_orderkey >= %s", 
+                    (([0] + lows)[i], (lows + [1 << 62])[i])
+                )
+                self.assertEqual(cur.fetchone()[0], 0)
+                cur.execute("select count(*) from customer")
+                customerNum = cur.fetchone()[0]
+            conn.close()
+            conn = psycopg2.connect(self.connStr)
+            with conn.cursor() as cur:
+                cur.execute("select count(*) from customer")
+                self.assertEqual(customerNum, cur.fetchone()[0])
+            conn.close()
+        conn = psycopg2.connect(self.connStr)
+        with conn.cursor() as cur:
+            cur.execute("select count(*) from orders")
+            self.assertEqual(orderNum, cur.fetchone()[0])
+            cur.execute("select count(*) from lineitem")
+            self.assertEqual(lineitemNum, cur.fetchone()[0])
+        conn.close()
+
+    def testRefuseShardsAtOtherCheckpoints(self):
+        resetRandomGenerators()
+        self.setConfig(shards=self.shardConnStrs(), checkpointInterval=500, 
+                       destPath=str(self.shardRunPath))
+        dbgen.initializeVersion1(self.connStr)
+        # interrupt the run after the first checkpoint is committed
+        generateAddress = dbgen.generateAddress
+        def interruptedGenerateAddress():
+            if (self.shardRunPath / "history.checkpoint").exists():
+                raise KeyboardInterrupt
+            return generateAddress()
+        with patch.object(dbgen, "generateAddress", interruptedGenerateAddress):
+            with self.assertRaises(KeyboardInterrupt):
+                dbgen.generataHistory(self.connStr)
+
+        # a shard committed before the checkpoint of the others
+        conn = psycopg2.connect(dbgen.config.shards[1])
+        with conn.cursor() as cur:
+            cur.execute("update dbgen_checkpoint set id = id - 1")
+        conn.commit()
+        conn.close()
+        resetRandomGenerators()
+        with self.assertRaises(RuntimeError):
+            dbgen.generataHistory(self.connStr, True)
+
+class TestSameResultsForVersion1Modes (DbgenTestCase):
+
+    def setUp(self) -> None:
+        self.setConfig(v1Only=True)
+        self.updateRunPath = self.makeRunPath()
+        self.ctasRunPath = self.makeRunPath()
+        self.streamRunPath = self.makeRunPath()
+
+    def testSameResultsForVersion1Modes(self):
+        connStr = connectionString()
+
+        self.setConfig(version1Mode="update", destPath=str(self.updateRunPath))
+        dbgen.initializeVersion1(connStr)
+
+        # orders of the ctas mode are derived concurrently by partitions
+        self.setConfig(version1Mode="ctas", partitions=3, 
+                       destPath=str(self.ctasRunPath))
+        dbgen.initializeVersion1(connStr)
+
+        # tables created unlogged are logged out of the bulk profile
+        conn = psycopg2.connect(connStr)
+        with conn.cursor() as cur:
+            cur.execute(
+                "select count(*) from pg_class "
+                "where relnamespace = current_schema()::regnamespace "
+                "and relkind = 'r' and relpersistence = 'u'"
+            )
+            self.assertEqual(cur.fetchone()[0], 0)
+        conn.close()
+
+        self.setConfig(version1Mode="stream", partitions=0, 
+                       destPath=str(self.streamRunPath))
+        dbgen.initializeVersion1(connStr)
+
+        # Receivable times are drawn by the same hash in every mode
+        for file in self.updateRunPath.glob("bi-*.tbl"):
+            self.assertEqual(
+                calculateHash(file), 
+                calculateHash(self.ctasRunPath / file.name)
+            )
+            self.assertEqual(
+                calculateHash(file), 
+                calculateHash(self.streamRunPath / file.name)
+            )
+        with open(self.streamRunPath / "bi-orders.tbl") as streamFile:
+            for streamLine in streamFile:
+                begin, end, receivableBegin, receivableEnd \
+                    = streamLine.rstrip("\n").split("|")[9:]
+                self.assertLessEqual(begin, receivableBegin)
+                self.assertLessEqual(receivableBegin, receivableEnd)
+                self.assertLessEqual(receivableEnd, end)
+
+class TestSameResultsForVersion1Parallelism (DbgenTestCase):
+
+    def setUp(self) -> None:
+        self.setConfig(v1Only=True, version1Mode="stream")
+        self.serialRunPath = self.makeRunPath()
+        self.parallelRunPath = self.makeRunPath()
+
+    def testSameResultsForVersion1Parallelism(self):
+        self.setConfig(version1Parallelism=1, destPath=str(self.serialRunPath))
+        dbgen.initializeVersion1("")
+
+        self.setConfig(version1Parallelism=3, destPath=str(self.parallelRunPath))
+        dbgen.initializeVersion1("")
+
+        self.assertEqual(
+            sorted(file.name for file in self.parallelRunPath.glob("*")), 
+            sorted(file.name for file in self.serialRunPath.glob("*"))
+        )
+        for file in self.serialRunPath.glob("*"):
+            self.assertEqual(
+                calculateHash(file), 
+                calculateHash(self.parallelRunPath / file.name)
+            )
+
+class TestVersion1Template (DbgenTestCase):
+
+    def setUp(self) -> None:
+        self.setConfig(v1Only=True, 
+                       version1Template=dbgen.config.dbname + "_template")
+        self.buildRunPath = self.makeRunPath()
+        self.cloneRunPath = self.makeRunPath()
+        self.connStr = connectionString()
+        self.addCleanup(self.dropTemplate)
+
+    def dropTemplate(self):
+        conn = dbgen._connectMaintenance(self.connStr)
+        cur = conn.cursor()
+        dbgen._dropTemplate(cur, dbgen.config.version1Template)
+        cur.close()
+        conn.close()
+
+    def testVersion1Template(self):
+        self.setConfig(destPath=str(self.buildRunPath))
+        dbgen.initializeVersion1(self.connStr)
+
+        # The second run must not generate V1data again
+        def failBuild(connStr):
+            raise AssertionError("V1data is generated again")
+        with patch.object(dbgen, "buildVersion1", failBuild):
+            self.setConfig(destPath=str(self.cloneRunPath))
+            dbgen.initializeVersion1(self.connStr)
+
+        for file in self.buildRunPath.glob("*"):
+            self.assertEqual(
+                calculateHash(file), 
+                calculateHash(self.cloneRunPath / file.name)
+            )
+
+class TestResumeHistory (DbgenTestCase):
+
+    def setUp(self) -> None:
+        self.setConfig(v1Only=False, updateTimes=5000, checkpointInterval=1000)
+        self.fullRunPath = self.makeRunPath()
+        self.resumedRunPath = self.makeRunPath()
+
+    def testResumeHistory(self):
+        connStr = connectionString()
+
+        resetRandomGenerators()
+        self.setConfig(destPath=str(self.fullRunPath))
+        dbgen.initializeVersion1(connStr)
+        dbgen.generataHistory(connStr)
+
+        # Interrupt the run in the middle of a transaction after the 
+        # second checkpoint
+        resetRandomGenerators()
+        self.setConfig(destPath=str(self.resumedRunPath))
+        dbgen.initializeVersion1(connStr)
+        saveCheckpoint = dbgen.saveCheckpoint
+        generateAddress = dbgen.generateAddress
+        checkpointedUTs = []
+        def recordedSaveCheckpoint(checkpoint):
+            checkpointedUTs.append(checkpoint["totalUT"])
+            saveCheckpoint(checkpoint)
+        addressNums = []
+        def interruptedGenerateAddress():
+            if len(checkpointedUTs) >= 2:
+                addressNums.append(1)
+                if len(addressNums) > 5:
+                    raise KeyboardInterrupt
+            return generateAddress()
+        with patch.object(dbgen, "saveCheckpoint", recordedSaveCheckpoint), \
+                patch.object(dbgen, "generateAddress", interruptedGenerateAddress):
+            with self.assertRaises(KeyboardInterrupt):
+                dbgen.generataHistory(connStr)
+        self.assertTrue((self.resumedRunPath / "history.checkpoint").exists())
+
+        resetRandomGenerators()
+        dbgen.generataHistory(connStr, True)
+        self.assertFalse((self.resumedRunPath / "history.checkpoint").exists())
+
+        self.assertEqual(
+            calculateHash(self.fullRunPath / "history.sql"), 
+            calculateHash(self.resumedRunPath / "history.sql")
+        )
+
+class TestExtendHistory (DbgenTestCase):
+
+    def setUp(self) -> None:
+        self.setConfig(v1Only=False, updateTimes=2000, keepHistoryState=True)
+        self.onceRunPath = self.makeRunPath()
+        self.twiceRunPath = self.makeRunPath()
+
+    def testExtendHistory(self):
+        connStr = connectionString()
+
+        resetRandomGenerators()
+        self.setConfig(destPath=str(self.onceRunPath))
+        dbgen.initializeVersion1(connStr)
+        dbgen.generataHistory(connStr)
+        with open(self.onceRunPath / "history.sql") as historyFile:
+            baseHistory = historyFile.read()
+        dbgen.generataHistory(connStr, extendTimes=1000)
+
+        resetRandomGenerators()
+        self.setConfig(destPath=str(self.twiceRunPath))
+        dbgen.initializeVersion1(connStr)
+        dbgen.generataHistory(connStr)
+        dbgen.generataHistory(connStr, extendTimes=500)
+        dbgen.generataHistory(connStr, extendTimes=500)
+
+        self.assertEqual(
+            calculateHash(self.onceRunPath / "history.sql"), 
+            calculateHash(self.twiceRunPath / "history.sql")
+        )
+        with open(self.onceRunPath / "history.sql") as historyFile:
+            self.assertTrue(historyFile.read().startswith(baseHistory))
+        self.assertEqual(
+            dbgen.loadCheckpoint(self.onceRunPath / "history.state")["totalUT"], 
+            3000
+        )
+
+class TestSkipUnchangedPhases (DbgenTestCase):
+
+    def setUp(self) -> None:
+        self.setConfig(v1Only=False)
+        self.cachedRunPath = self.makeRunPath()
+        self.freshRunPath = self.makeRunPath()
+
+    def testSkipUnchangedPhases(self):
+        connStr = connectionString()
+
+        resetRandomGenerators()
+        self.setConfig(updateTimes=1000, destPath=str(self.cachedRunPath))
+        dbgen.runPhases(connStr)
+
+        def failPhase(*args, **kwargs):
+            raise AssertionError("unchanged phase runs again")
+        # V1data is loaded from its files instead of being generated
+        resetRandomGenerators()
+        self.setConfig(updateTimes=2000)
+        with patch.object(dbgen, "initializeVersion1", failPhase):
+            dbgen.runPhases(connStr)
+            with patch.object(dbgen, "generataHistory", failPhase):
+                dbgen.runPhases(connStr)
+
+        # an output changed in place with the same size is generated again
+        historyPath = self.cachedRunPath / "history.sql"
+        history = historyPath.read_bytes()
+        historyPath.write_bytes(history[:-1] + b"#")
+        resetRandomGenerators()
+        dbgen.runPhases(connStr)
+        self.assertEqual(historyPath.read_bytes(), history)
+
+        resetRandomGenerators()
+        self.setConfig(destPath=str(self.freshRunPath))
+        dbgen.runPhases(connStr, force=True)
+
+        for file in self.freshRunPath.glob("*.sql"):
+            self.assertEqual(
+                calculateHash(file), 
+                calculateHash(self.cachedRunPath / file.name)
+            )
+        for file in self.freshRunPath.glob("*.tbl"):
+            self.assertEqual(
+                calculateHash(file), 
+                calculateHash(self.cachedRunPath / file.name)
+            )
+
+class TestVersion1Fingerprint (DbgenTestCase):
+
+    def testCachedInputHashes(self):
+        inputHashes = {}
+        fingerprint = dbgen._version1Fingerprint(inputHashes)
+        self.assertEqual(len(inputHashes), len(dbgen.TABLE_KEYS))
+
+        hashedPaths = []
+        fileHash = dbgen._fileHash
+        def recordedFileHash(path):
+            hashedPaths.append(path)
+            return fileHash(path)
+        self.patchDbgen(_fileHash=recordedFileHash)
+        self.assertEqual(dbgen._version1Fingerprint(inputHashes), fingerprint)
+        self.assertEqual(hashedPaths, [])
+
+        # a table whose modification time changed is hashed again
+        cached = next(iter(inputHashes.values()))
+        cached["mtime_ns"] -= 1
+        self.assertEqual(dbgen._version1Fingerprint(inputHashes), fingerprint)
+        self.assertEqual(len(hashedPaths), 1)
+
+    def testVersionConstants(self):
+        fingerprint = dbgen._version1Fingerprint()
+        self.patchDbgen(VERSION1_VERSION=dbgen.VERSION1_VERSION + 1)
+        self.assertNotEqual(dbgen._version1Fingerprint(), fingerprint)
+
+        historyFingerprint = dbgen._historyFingerprint(fingerprint)
+        self.patchDbgen(HISTORY_VERSION=dbgen.HISTORY_VERSION + 1)
+        self.assertNotEqual(
+            dbgen._historyFingerprint(fingerprint), historyFingerprint
+        )
+
+class TestInvalidUpdateTimes(DbgenTestCase):
 
     def testInvalidUpdateTimes(self):
-        dbgen.config.updateTimes = 0 
+        self.setConfig(updateTimes=0)
         with self.assertRaises(AssertionError):
             dbgen.config.config()
 
-        dbgen.config.updateTimes = -1
+        self.setConfig(updateTimes=-1)
         with self.assertRaises(AssertionError):
             dbgen.config.config()
 
-        dbgen.config.updateTimes = 10000
-
-class TestInvalidTpchTblPath(unittest.TestCase):
-    def setUp(self) -> None:
-        self.originPath = Path(dbgen.config.tpchTblPath)
+class TestInvalidHistoryCommitInterval(DbgenTestCase):
 
-    def testEmptyAndNonexistedTpchTblPath(self):
-        dbgen.config.tpchTblPath = ""
+    def testInvalidHistoryCommitInterval(self):
+        self.setConfig(historyCommitInterval=-1)
         with self.assertRaises(AssertionError):
             dbgen.config.config()
-        dbgen.config.tpchTblPath = str(self.originPath)
 
-    def testDefaultIsInvalid(self):
-        newPath = self.originPath.parent / "temp"
-        if self.originPath.exists():
-            self.originPath.rename(newPath)
+        self.setConfig(historyCommitInterval=1.5)
         with self.assertRaises(AssertionError):
             dbgen.config.config()
-        if newPath.exists():
-            newPath.rename(self.originPath)
 
-    def testAtLeastOneTableMissed(self):
-        newPath = Path.cwd() / "temp"
-        newPath.mkdir()
-        ordersPath = newPath / "orders.tbl"
-        ordersPath.touch()
-        dbgen.config.tpchTblPath = str(newPath)
+class TestInvalidLoadParallelism(DbgenTestCase):
+
+    def testInvalidLoadParallelism(self):
+        with patch.object(dbgen.config, "loadParallelism", 0):
+            with self.assertRaises(AssertionError):
+                dbgen.config.config()
+
+        with patch.object(dbgen.config, "loadChunkSize", 0):
+            with self.assertRaises(AssertionError):
+                dbgen.config.config()
+
+        with patch.object(dbgen.config, "indexParallelism", 0):
+            with self.assertRaises(AssertionError):
+                dbgen.config.config()
+
+class TestInvalidVersion1Mode(DbgenTestCase):
+
+    def testInvalidVersion1Mode(self):
+        with patch.object(dbgen.config, "version1Mode", "copy"):
+            with self.assertRaises(AssertionError):
+                dbgen.config.config()
+
+        with patch.object(dbgen.config, "version1Parallelism", 0):
+            with self.assertRaises(AssertionError):
+                dbgen.config.config()
+
+class TestInvalidMetricsFile(DbgenTestCase):
+
+    def testInvalidMetricsFile(self):
+        # metrics are written at progress reports
+        self.setConfig(metricsFile="dbgen.prom", progressInterval=0)
         with self.assertRaises(AssertionError):
             dbgen.config.config()
-        ordersPath.unlink()
-        newPath.rmdir()
-        dbgen.config.tpchTblPath = str(self.originPath)
+        self.setConfig(metricsFile="")
+        dbgen.config.config()
 
-        
-class TestInvalidPsqlPath(unittest.TestCase):
+class TestInvalidShards(DbgenTestCase):
 
-    def testInvalidPsqlPath(self):
-        dbgen.config.psqlPath = ""
+    def testInvalidShards(self):
+        self.setConfig(shards="dbname=shard0")
         with self.assertRaises(AssertionError):
             dbgen.config.config()
-        
-        dbgen.config.psqlPath = str(Path.cwd() / "psql")
-        with self.assertRaises(FileNotFoundError):
+
+        # shards are loaded from V1data streamed from tpch tables
+        self.setConfig(shards=["dbname=shard0"])
+        with self.assertRaises(AssertionError):
+            dbgen.config.config()
+
+        self.setConfig(version1Mode="stream")
+        with patch.object(dbgen.config, "inMemoryHistory", True):
+            with self.assertRaises(AssertionError):
+                dbgen.config.config()
+
+        with patch.object(dbgen.config, "version1Template", "tpchtemplate"):
+            with self.assertRaises(AssertionError):
+                dbgen.config.config()
+
+class TestInvalidTpchTblPath(DbgenTestCase):
+
+    def testEmptyAndNonexistedTpchTblPath(self):
+        self.setConfig(tpchTblPath="")
+        with self.assertRaises(AssertionError):
             dbgen.config.config()
 
-        dbgen.config.psqlPath = "psql"
+    def testDefaultIsInvalid(self):
+        originPath = Path(dbgen.config.tpchTblPath)
+        newPath = originPath.parent / "temp"
+        if originPath.exists():
+            originPath.rename(newPath)
+            self.addCleanup(newPath.rename, originPath)
+        with self.assertRaises(AssertionError):
+            dbgen.config.config()
 
+    def testAtLeastOneTableMissed(self):
+        newPath = self.makeRunPath()
+        (newPath / "orders.tbl").touch()
+        self.setConfig(tpchTblPath=str(newPath))
+        with self.assertRaises(AssertionError):
+            dbgen.config.config()
 
-class TestValidV1Only(unittest.TestCase):
+class TestValidV1Only(DbgenTestCase):
 
     def testValidV1Only(self):
-        dbgen.config.v1Only = 10
+        self.setConfig(v1Only=10)
+        with self.assertRaises(AssertionError):
+            dbgen.config.config()
+
+class TestValidInMemoryHistory(DbgenTestCase):
+
+    def testValidInMemoryHistory(self):
+        self.setConfig(inMemoryHistory=1)
         with self.assertRaises(AssertionError):
             dbgen.config.config()
-        dbgen.config.v1Only = True
 
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file